@@ -0,0 +1,87 @@
+import os
+import tempfile
+import zipfile
+from dataclasses import replace
+from pathlib import Path
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+
+import pytest
+
+# Тесты не должны трогать рабочую conversations.db: URL задаётся до импорта src.database
+_tmp_db_dir = tempfile.mkdtemp(prefix="rag_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp_db_dir}/conversations.db")
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from src.database import init_db, make_engine  # noqa: E402
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Отдельная база SQLite (WAL, FTS5, триггеры) на каждый тест."""
+    db_engine = make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    init_db(db_engine)
+    yield db_engine
+    db_engine.dispose()
+
+
+@pytest.fixture
+def db(db_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    yield session
+    session.close()
+
+
+def write_docx(path: Path, paragraphs) -> Path:
+    """Минимальный .docx (только word/document.xml) — его читает Docx2txtLoader."""
+    body = "".join(f"<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", document)
+    return path
+
+
+@pytest.fixture
+def store_paths(tmp_path, monkeypatch):
+    """Каталоги данных и индекса во временной папке вместо data/ и vector_store/."""
+    from src import ingest
+
+    fake = SimpleNamespace(root=tmp_path, data_dir=tmp_path / "data", vector_dir=tmp_path / "vector_store")
+    fake.data_dir.mkdir()
+    fake.vector_dir.mkdir()
+    monkeypatch.setattr(ingest, "paths", fake)
+    monkeypatch.setattr(ingest, "ensure_dirs", lambda: None)
+    return fake
+
+
+def write_store(path: Path, texts) -> None:
+    """Индекс (index.faiss + chunks.sqlite3) из коротких текстов на хэш-эмбеддингах."""
+    from langchain.schema import Document
+
+    from src.bench import HashEmbeddings
+    from src.vectordb import VectorDB
+
+    docs = [Document(page_content=t, metadata={"source": "lecture.pdf", "page": i}) for i, t in enumerate(texts)]
+    vdb = VectorDB.from_documents(docs, HashEmbeddings(), path, ids=[f"c{i}" for i in range(len(docs))])
+    vdb.save()
+    vdb.close()
+
+
+@pytest.fixture
+def rag_engine(tmp_path, monkeypatch):
+    """RAGEngine над временным индексом; индекс проверяется на каждом запросе, пакетирование выключено."""
+    from src import engine as engine_module
+    from src.bench import HashEmbeddings
+
+    cfg = replace(engine_module.retrieval_cfg, reload_check_interval=0, batch_window_ms=0)
+    monkeypatch.setattr(engine_module, "retrieval_cfg", cfg)
+    write_store(tmp_path, ["Нормальные формы отношений", "Индексы ускоряют поиск строк"])
+    rag = engine_module.RAGEngine(vector_dir=tmp_path)
+    rag._embeddings = HashEmbeddings()
+    yield rag
+    rag.reset()
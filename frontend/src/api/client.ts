@@ -8,33 +8,60 @@ export interface MessageHistory {
 export interface AskRequest {
   question: string;
   k?: number;
+  // история берётся на сервере из диалога conversation_id, туда же сохраняется ход;
+  // без conversation_id диалог пользователя user_id создаётся первым ходом
+  conversation_id?: number | null;
+  user_id?: string;
+  // только для старых клиентов без conversation_id
   history?: MessageHistory[];
 }
 
 export interface AskResponse {
   question: string;
   answer: string;
+  // куда сохранён ход
+  conversation_id?: number | null;
+  user_message_id?: number | null;
+  assistant_message_id?: number | null;
 }
 
 export interface QuizRequest {
   topic: string;
   num?: number;
+  // история берётся на сервере из диалога conversation_id, туда же сохраняется ход;
+  // без conversation_id диалог пользователя user_id создаётся первым ходом
+  conversation_id?: number | null;
+  user_id?: string;
+  // только для старых клиентов без conversation_id
   history?: MessageHistory[];
 }
 
 export interface QuizResponse {
   topic: string;
   questions: string;
+  // куда сохранён ход
+  conversation_id?: number | null;
+  user_message_id?: number | null;
+  assistant_message_id?: number | null;
 }
 
 export interface TaskRequest {
   topic: string;
+  // история берётся на сервере из диалога conversation_id, туда же сохраняется ход;
+  // без conversation_id диалог пользователя user_id создаётся первым ходом
+  conversation_id?: number | null;
+  user_id?: string;
+  // только для старых клиентов без conversation_id
   history?: MessageHistory[];
 }
 
 export interface TaskResponse {
   topic: string;
   task: string;
+  // куда сохранён ход
+  conversation_id?: number | null;
+  user_message_id?: number | null;
+  assistant_message_id?: number | null;
 }
 
 export interface ConversationCreate {
@@ -70,6 +97,43 @@ export interface ConversationListItem {
   message_count: number;
 }
 
+export interface TurnCreate {
+  // без conversation_id диалог создаётся на сервере в той же транзакции
+  conversation_id?: number | null;
+  user_id?: string;
+  title?: string;
+  conversation_type?: string;
+  user_content: string;
+  assistant_content: string;
+}
+
+export interface TurnResponse {
+  conversation_id: number;
+  created: boolean;
+  user_message: MessageData;
+  assistant_message: MessageData;
+}
+
+export interface SearchResult {
+  id: number;
+  title: string;
+  conversation_type: string;
+  created_at: string;
+  updated_at: string;
+  // найденное сообщение (null — совпал заголовок) и фрагмент с <mark>…</mark>
+  message_id: number | null;
+  snippet: string;
+  rank: number;
+}
+
+export interface ConversationListPage {
+  conversations: ConversationListItem[];
+  // курсор следующей страницы; null — страниц больше нет
+  next_cursor: string | null;
+  limit: number;
+  total?: number;
+}
+
 export interface MessageCreate {
   conversation_id: number;
   role: 'user' | 'assistant';
@@ -137,16 +201,16 @@ class ApiClient {
   async getUserConversations(
     userId: string,
     params?: {
-      skip?: number;
+      cursor?: string;
       limit?: number;
       search?: string;
       conversation_type?: string;
       date_from?: string;
       date_to?: string;
     }
-  ): Promise<{ conversations: ConversationListItem[]; total: number; skip: number; limit: number }> {
+  ): Promise<ConversationListPage> {
     const queryParams = new URLSearchParams();
-    if (params?.skip !== undefined) queryParams.append('skip', params.skip.toString());
+    if (params?.cursor) queryParams.append('cursor', params.cursor);
     if (params?.limit !== undefined) queryParams.append('limit', params.limit.toString());
     if (params?.search) queryParams.append('search', params.search);
     if (params?.conversation_type) queryParams.append('conversation_type', params.conversation_type);
@@ -156,7 +220,20 @@ class ApiClient {
     const queryString = queryParams.toString();
     const url = `/users/${userId}/conversations${queryString ? `?${queryString}` : ''}`;
     
-    return this.request<{ conversations: ConversationListItem[]; total: number; skip: number; limit: number }>(url, {
+    return this.request<ConversationListPage>(url, {
+      method: 'GET',
+    });
+  }
+
+  async searchConversations(
+    userId: string,
+    q: string,
+    params?: { limit?: number; conversation_type?: string }
+  ): Promise<{ results: SearchResult[] }> {
+    const queryParams = new URLSearchParams({ q });
+    if (params?.limit !== undefined) queryParams.append('limit', params.limit.toString());
+    if (params?.conversation_type) queryParams.append('conversation_type', params.conversation_type);
+    return this.request<{ results: SearchResult[] }>(`/users/${userId}/search?${queryParams.toString()}`, {
       method: 'GET',
     });
   }
@@ -174,6 +251,13 @@ class ApiClient {
     });
   }
 
+  async appendTurn(data: TurnCreate): Promise<TurnResponse> {
+    return this.request<TurnResponse>('/turns', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    });
+  }
+
   async getConversationMessages(conversationId: number): Promise<MessageData[]> {
     return this.request<MessageData[]>(`/conversations/${conversationId}/messages`, {
       method: 'GET',
@@ -1,7 +1,7 @@
 import { useState, type KeyboardEvent } from 'react';
 import { Send } from 'lucide-react';
 import { useChatStore } from '../store/chatStore';
-import { apiClient, type MessageHistory } from '../api/client';
+import { apiClient } from '../api/client';
 
 export default function ChatInput() {
   const [input, setInput] = useState('');
@@ -10,41 +10,17 @@ export default function ChatInput() {
     setLoading, 
     isLoading, 
     currentType, 
-    messages,
     currentConversationId,
-    createNewConversation,
-    saveMessageToDb,
+    userId,
+    rememberConversation,
   } = useChatStore();
 
-  const getHistory = (): MessageHistory[] => {
-    // Получаем историю сообщений только текущего типа запроса
-    return messages
-      .filter((msg) => msg.type === currentType)
-      .map((msg) => ({
-        role: msg.role,
-        content: msg.content,
-      }));
-  };
-
   const handleSend = async () => {
     if (!input.trim() || isLoading || !currentType) return;
 
     const userMessage = input.trim();
     setInput('');
 
-    // Создаем новый диалог, если его еще нет
-    let conversationId = currentConversationId;
-    if (!conversationId) {
-      conversationId = await createNewConversation(currentType);
-      if (!conversationId) {
-        console.error('Failed to create conversation');
-        return;
-      }
-    }
-
-    // Получаем историю сообщений текущего типа ДО добавления нового сообщения
-    const history = getHistory();
-
     // Добавляем сообщение пользователя
     addMessage({
       role: 'user',
@@ -52,52 +28,45 @@ export default function ChatInput() {
       type: currentType,
     });
 
-    // Сохраняем сообщение пользователя в БД
-    await saveMessageToDb('user', userMessage);
-
     setLoading(true);
 
+    // историю сервер читает из диалога и сам сохраняет в него ход;
+    // без диалога он создаёт новый диалог пользователя
+    const conversation = { conversation_id: currentConversationId, user_id: userId };
+
     try {
       let response;
       
-      let assistantMessage = '';
-      
       switch (currentType) {
         case 'question':
-          response = await apiClient.ask({ question: userMessage, history });
-          assistantMessage = response.answer;
+          response = await apiClient.ask({ question: userMessage, ...conversation });
           addMessage({
             role: 'assistant',
-            content: assistantMessage,
+            content: response.answer,
             type: currentType,
           });
           break;
         
         case 'quiz':
-          response = await apiClient.quiz({ topic: userMessage, num: 5, history });
-          assistantMessage = `Квиз по теме "${response.topic}":\n\n${response.questions}`;
+          response = await apiClient.quiz({ topic: userMessage, num: 5, ...conversation });
           addMessage({
             role: 'assistant',
-            content: assistantMessage,
+            content: `Квиз по теме "${response.topic}":\n\n${response.questions}`,
             type: currentType,
           });
           break;
         
         case 'task':
-          response = await apiClient.task({ topic: userMessage, history });
-          assistantMessage = `Задание по теме "${response.topic}":\n\n${response.task}`;
+          response = await apiClient.task({ topic: userMessage, ...conversation });
           addMessage({
             role: 'assistant',
-            content: assistantMessage,
+            content: `Задание по теме "${response.topic}":\n\n${response.task}`,
             type: currentType,
           });
           break;
       }
       
-      // Сохраняем ответ ассистента в БД
-      if (assistantMessage) {
-        await saveMessageToDb('assistant', assistantMessage);
-      }
+      rememberConversation(response?.conversation_id);
     } catch (error) {
       console.error('Error sending message:', error);
       addMessage({
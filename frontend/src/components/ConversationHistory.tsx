@@ -9,7 +9,9 @@ export default function ConversationHistory() {
   const [searchQuery, setSearchQuery] = useState('');
   const [filterType, setFilterType] = useState<string>('');
   const [showFilters, setShowFilters] = useState(false);
-  const [total, setTotal] = useState(0);
+  // курсоры начала уже открытых страниц: cursors[page] — для текущей
+  const [cursors, setCursors] = useState<(string | undefined)[]>([undefined]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [page, setPage] = useState(0);
   const [editingId, setEditingId] = useState<number | null>(null);
   const [editTitle, setEditTitle] = useState('');
@@ -40,13 +42,13 @@ export default function ConversationHistory() {
   const loadConversations = async () => {
     try {
       const data = await apiClient.getUserConversations(userId, {
-        skip: page * limit,
+        cursor: cursors[page],
         limit,
         search: searchQuery || undefined,
         conversation_type: filterType || undefined,
       });
       setConversations(data.conversations);
-      setTotal(data.total);
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Failed to load conversations:', error);
     }
@@ -129,11 +131,13 @@ export default function ConversationHistory() {
 
   const handleSearch = (value: string) => {
     setSearchQuery(value);
+    setCursors([undefined]);
     setPage(0);
   };
 
   const handleFilterChange = (type: string) => {
     setFilterType(type);
+    setCursors([undefined]);
     setPage(0);
   };
 
@@ -163,7 +167,11 @@ export default function ConversationHistory() {
     }
   };
 
-  const totalPages = Math.ceil(total / limit);
+  const handleNextPage = () => {
+    if (!nextCursor) return;
+    setCursors([...cursors.slice(0, page + 1), nextCursor]);
+    setPage(page + 1);
+  };
 
   return (
     <>
@@ -333,7 +341,7 @@ export default function ConversationHistory() {
           </div>
 
           {/* Pagination */}
-          {totalPages > 1 && (
+          {(page > 0 || nextCursor) && (
             <div className="p-4 border-t border-gray-200 dark:border-gray-700">
               <div className="flex items-center justify-between text-sm">
                 <button
@@ -344,11 +352,11 @@ export default function ConversationHistory() {
                   Назад
                 </button>
                 <span className="text-gray-600 dark:text-gray-400">
-                  {page + 1} / {totalPages}
+                  {page + 1}
                 </span>
                 <button
-                  onClick={() => setPage(Math.min(totalPages - 1, page + 1))}
-                  disabled={page >= totalPages - 1}
+                  onClick={handleNextPage}
+                  disabled={!nextCursor}
                   className="px-3 py-1 rounded bg-gray-100 dark:bg-gray-700 hover:bg-gray-200 dark:hover:bg-gray-600 disabled:opacity-50 disabled:cursor-not-allowed"
                 >
                   Вперед
@@ -95,6 +95,16 @@ export const useChatStore = create<ChatState>()(
         }
       },
 
+      // ход сохраняет сервер (/ask, /quiz, /task); новый диалог он создаёт первым ходом
+      rememberConversation: (conversationId) => {
+        const state = get();
+        if (conversationId == null || conversationId === state.currentConversationId) return;
+        set({ currentConversationId: conversationId });
+        if (state.currentConversationId === null && state.onConversationCreated) {
+          state.onConversationCreated();
+        }
+      },
+
       loadConversation: async (conversationId) => {
         try {
           const conversation = await apiClient.getConversation(conversationId);
@@ -23,6 +23,7 @@ export interface ChatState {
   setCurrentConversationId: (id: number | null) => void;
   createNewConversation: (type: MessageType) => Promise<number | null>;
   saveMessageToDb: (role: 'user' | 'assistant', content: string) => Promise<void>;
+  rememberConversation: (conversationId: number | null | undefined) => void;
   loadConversation: (conversationId: number) => Promise<void>;
   setOnConversationCreated: (callback: (() => void) | null) => void;
 }
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class MicroBatcher:
+    """Собирает одновременные запросы из разных потоков в один пакет.
+
+    Первый запрос открывает окно длиной window секунд; всё, что пришло за это
+    время (но не больше max_batch), обрабатывается одним вызовом handler,
+    а результаты раздаются вызывающим потокам. handler получает список
+    элементов и возвращает список результатов той же длины.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], window: float, max_batch: int) -> None:
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._queue: List[Tuple[Any, Future]] = []
+        self._cond = threading.Condition()
+        self._worker: threading.Thread | None = None
+
+    def submit(self, item: Any) -> Any:
+        """Ставит элемент в очередь и блокируется до получения результата."""
+        future: Future = Future()
+        with self._cond:
+            self._queue.append((item, future))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return future.result()
+
+    def _take_batch(self) -> List[Tuple[Any, Future]]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.handler([item for item, _ in batch])
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, float | int]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import platform
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from sqlalchemy.orm import sessionmaker
+
+from . import crud
+from .config import chunk_cfg, context_cfg, embed_cfg, retrieval_cfg
+
+
+_SUBJECTS = (
+    "реляционная модель", "таблица", "первичный ключ", "внешний ключ", "индекс", "транзакция", "нормализация",
+    "хранилище данных", "репликация", "шардирование", "запрос", "представление", "журнал предзаписи",
+    "линейная регрессия", "логистическая регрессия", "решающее дерево", "случайный лес", "градиентный бустинг",
+    "обучающая выборка", "валидация", "переобучение", "регуляризация", "функция потерь", "признак",
+    "кластеризация", "метод k ближайших соседей", "нейронная сеть", "градиентный спуск",
+)
+_VERBS = (
+    "определяет", "хранит", "ускоряет", "ограничивает", "описывает", "использует", "уменьшает", "увеличивает",
+    "проверяет", "связывает", "оценивает", "предсказывает", "разделяет", "объединяет", "сохраняет",
+)
+_OBJECTS = (
+    "целостность данных", "время ответа", "структуру записей", "зависимости между атрибутами", "ошибку модели",
+    "качество прогноза", "объём хранения", "порядок строк", "согласованность копий", "распределение нагрузки",
+    "значения признаков", "веса модели", "границы классов", "дисперсию оценки", "план выполнения",
+)
+_TAILS = (
+    "при большом объёме данных", "в распределённой системе", "на этапе проектирования", "во время обучения",
+    "для каждой строки", "без потери информации", "с учётом ограничений", "на тестовой выборке",
+    "в учебном курсе", "по сравнению с полным перебором",
+)
+
+
+def synthetic_sentence(rng: random.Random) -> str:
+    words = [rng.choice(_SUBJECTS), rng.choice(_VERBS), rng.choice(_OBJECTS)]
+    if rng.random() < 0.6:
+        words.append(rng.choice(_TAILS))
+    sentence = " ".join(words)
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def synthetic_corpus(n_docs: int = 40, paragraphs: int = 30, seed: int = 0) -> List[Document]:
+    """Лекции-заглушки на русском: абзацы из 3–8 предложений о хранении данных и ML."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_docs):
+        text = "\n\n".join(
+            " ".join(synthetic_sentence(rng) for _ in range(rng.randint(3, 8))) for _ in range(paragraphs)
+        )
+        docs.append(Document(page_content=text, metadata={"source": f"{i + 1}_Синтетическая_лекция.docx"}))
+    return docs
+
+
+def synthetic_chunks(n_docs: int = 40, seed: int = 0) -> List[Document]:
+    """Чанки синтетического корпуса с chunk_index, как после индексации."""
+    from .ingest import split_documents
+
+    chunks = split_documents(synthetic_corpus(n_docs, seed=seed))
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["chunk_index"] = i
+    return chunks
+
+
+def synthetic_questions(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n):
+        subject, obj = rng.choice(_SUBJECTS), rng.choice(_OBJECTS)
+        questions.append(rng.choice((
+            f"Что такое {subject}?",
+            f"Зачем нужен {subject}?",
+            f"Как {subject} влияет на {obj}?",
+            f"Объясните, что {subject} {rng.choice(_VERBS)} {obj}.",
+        )))
+    return questions
+
+
+class HashEmbeddings(Embeddings):
+    """Детерминированная замена модели эмбеддингов: хэширование слов в вектор.
+
+    Не требует модели и сети; близкие по словам тексты получают близкие векторы,
+    поэтому поиск по индексу ведёт себя правдоподобно.
+    """
+
+    def __init__(self, dim: int = 384) -> None:
+        self.dim = dim
+        self.cache = None
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_queries(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text).tolist()
+
+
+def fake_chat_model(answer: str = "Индекс ускоряет поиск строк по значению ключа.") -> FakeListChatModel:
+    """Чат-модель без Ollama: мгновенно возвращает один и тот же ответ."""
+    return FakeListChatModel(responses=[answer])
+
+
+class StageSkipped(Exception):
+    """Этап нельзя выполнить здесь: нет необязательной зависимости (модели эмбеддингов)."""
+
+
+@dataclass
+class Stage:
+    """Замер: setup() готовит состояние, op(state, item) обрабатывает один элемент и
+    возвращает число обработанных единиц (unit) для пропускной способности."""
+
+    name: str
+    unit: str
+    items: Sequence
+    op: Callable[[object, object], int]
+    setup: Callable[[], object] = lambda: None
+    extra: Dict[str, object] = field(default_factory=dict)
+
+
+def percentile_ms(samples: Sequence[float], q: float) -> float:
+    """q-й перцентиль задержек (секунды) в миллисекундах; 0 для пустой выборки."""
+    return float(np.percentile(np.asarray(samples) * 1000, q)) if len(samples) else 0.0
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    return {f"p{q}": percentile_ms(latencies, q) for q in (50, 95, 99)} if latencies else {}
+
+
+def run_stage(stage: Stage) -> Dict[str, object]:
+    """Время и задержки — в обычном прогоне, пик памяти — во втором, под tracemalloc
+    (он сам замедляет выполнение в разы и исказил бы время)."""
+    state = stage.setup()
+    latencies: List[float] = []
+    units = 0
+    started = time.perf_counter()
+    for item in stage.items:
+        t = time.perf_counter()
+        units += stage.op(state, item)
+        latencies.append(time.perf_counter() - t)
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        state = stage.setup()
+        for item in stage.items:
+            stage.op(state, item)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "unit": stage.unit,
+        "ops": len(latencies),
+        "units": units,
+        "seconds": seconds,
+        "throughput": units / seconds if seconds else 0.0,
+        "latency_ms": _percentiles(latencies),
+        "peak_mb": peak / 1e6,
+        **stage.extra,
+    }
+
+
+def _stages(tmp: Path, docs: int, queries: int, real_embeddings: bool, seed: int) -> List[Stage]:
+    from .engine import RAGEngine
+    from .database import init_db, make_engine
+    from .ingest import split_documents
+    from .rag import RAGQA, _format_docs
+    from .vectordb import VectorDB
+
+    corpus = synthetic_corpus(docs, seed=seed)
+    chunks = synthetic_chunks(docs, seed=seed)
+    texts = [c.page_content for c in chunks]
+    batches = [texts[i:i + embed_cfg.batch_size] for i in range(0, len(texts), embed_cfg.batch_size)]
+    questions = synthetic_questions(queries, seed=seed + 1)
+    embeddings = HashEmbeddings()
+
+    vdb = VectorDB.from_documents(chunks, embeddings, tmp / "vector_store")
+    vdb.save()
+    query_vectors = embeddings.embed_queries(questions)
+    top_docs = [vdb.get_documents([row for row, _ in hits]) for hits in vdb.search_by_vectors(query_vectors, 5)]
+
+    def engine() -> RAGQA:
+        # новый движок на каждый прогон: кэши запросов не переносятся между прогонами
+        rag_engine = RAGEngine(vector_dir=tmp / "vector_store", llm=fake_chat_model())
+        rag_engine._embeddings = embeddings
+        return RAGQA(engine=rag_engine, k=5)
+
+    def split(_: object, doc: Document) -> int:
+        return sum(len(c.page_content) for c in split_documents([doc]))
+
+    def embed(_: object, batch: List[str]) -> int:
+        return len(embeddings.embed_documents(batch))
+
+    def build_index(_: object, batch: List[Document]) -> int:
+        VectorDB.from_documents(batch, embeddings, tmp / "build").close()
+        return len(batch)
+
+    def search(_: object, vector: np.ndarray) -> int:
+        vdb.search_by_vector(vector, 5)
+        return 1
+
+    def search_batch(_: object, matrix: np.ndarray) -> int:
+        return len(vdb.search_by_vectors(matrix, 5))
+
+    def format_docs(_: object, found: List[Document]) -> int:
+        _format_docs(found)
+        return len(found)
+
+    def prompt(qa: RAGQA, question: str) -> int:
+        qa.build_messages(question)
+        return 1
+
+    def ask(qa: RAGQA, question: str) -> int:
+        qa.ask(question)
+        return 1
+
+    def db() -> object:
+        path = tmp / f"bench_{time.monotonic_ns()}.db"
+        db_engine = make_engine(f"sqlite:///{path}")
+        init_db(db_engine)
+        session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+        conversations = [crud.create_conversation(session, f"bench_{i % 20}", f"Диалог {i}", "question").id
+                         for i in range(200)]
+        return session, conversations
+
+    def add_message(state, i: int) -> int:
+        session, conversations = state
+        crud.add_message(session, conversations[i % len(conversations)], "user", questions[i % len(questions)])
+        return 1
+
+    def list_conversations(state, i: int) -> int:
+        session, _ = state
+        rows, _ = crud.list_user_conversations(session, f"bench_{i % 20}", limit=20)
+        return len(rows)
+
+    stages = [
+        Stage("split_documents", "chars", corpus, split,
+              extra={"chunks": len(chunks), "chunk_size": chunk_cfg.chunk_size}),
+        Stage("embed_hash", "texts", batches, embed),
+        Stage("index_build", "chunks", [chunks[i:i + 500] for i in range(0, len(chunks), 500)], build_index),
+        Stage("search", "queries", list(query_vectors), search),
+        Stage("search_batch", "queries", [query_vectors[i:i + 32] for i in range(0, len(query_vectors), 32)], search_batch),
+        Stage("format_docs", "docs", top_docs, format_docs),
+        Stage("prompt", "prompts", questions, prompt, setup=engine,
+              extra={"batch_window_ms": retrieval_cfg.batch_window_ms, "mmr": context_cfg.mmr}),
+        Stage("ask_fake_llm", "answers", questions, ask, setup=engine),
+        Stage("db_add_message", "messages", list(range(queries * 2)), add_message, setup=db),
+        Stage("db_list_conversations", "lists", list(range(queries)), list_conversations, setup=db),
+    ]
+    if real_embeddings:
+        stages.insert(2, _real_embedding_stage(batches))
+    return stages
+
+
+def _real_embedding_stage(batches: List[List[str]]) -> Stage:
+    model: Dict[str, object] = {}
+
+    def setup() -> object:
+        if "st" not in model:
+            try:
+                from .ingest import STEmbeddings
+
+                model["st"] = STEmbeddings()
+            except Exception as e:
+                # например, модель эмбеддингов не скачана, а сети нет
+                raise StageSkipped(f"{type(e).__name__}: {e}") from e
+        return model["st"]
+
+    return Stage("embed_model", "texts", batches, lambda st, batch: len(st.encode(batch)), setup=setup,
+                 extra={"model": embed_cfg.model_name})
+
+
+def run_benchmarks(
+    docs: int = 40,
+    queries: int = 200,
+    stages: Optional[Sequence[str]] = None,
+    real_embeddings: bool = False,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Микробенчмарки горячих путей без Ollama и сети.
+
+    Синтетический русский корпус из docs лекций режется сплиттером, индексируется
+    хэш-эмбеддингами (с real_embeddings — ещё и настоящей моделью) и опрашивается
+    queries вопросами; генерацию заменяет фиктивная чат-модель, БД — временный SQLite.
+    Для каждого этапа: пропускная способность, p50/p95/p99 одной операции и пик памяти.
+    """
+    results: Dict[str, object] = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "docs": docs,
+            "queries": queries,
+            "seed": seed,
+        },
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for stage in _stages(Path(tmp), docs, queries, real_embeddings, seed):
+            if stages and stage.name not in stages:
+                continue
+            try:
+                results["stages"][stage.name] = run_stage(stage)
+            except StageSkipped as e:
+                results["stages"][stage.name] = {"skipped": str(e)}
+            except Exception as e:
+                results["stages"][stage.name] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+
+def failed_stages(results: Dict[str, object]) -> List[str]:
+    """Этапы, упавшие с ошибкой (в отличие от пропущенных)."""
+    return [name for name, stage in results["stages"].items() if "error" in stage]
+
+
+def compare(current: Dict[str, object], baseline: Dict[str, object], tolerance: float = 0.2) -> List[Dict[str, object]]:
+    """Регрессии относительно baseline: пропускная способность ниже, а p95 или пик
+    памяти выше больше чем на tolerance (доля). Упавший этап — тоже регрессия."""
+    regressions = []
+    for name, now in current["stages"].items():
+        if "error" in now:
+            regressions.append({"stage": name, "metric": "error", "current": now["error"]})
+            continue
+        before = baseline.get("stages", {}).get(name)
+        if not before or "skipped" in now or "skipped" in before or "error" in before:
+            continue
+        checks = [
+            ("throughput", before["throughput"], now["throughput"], -1),
+            ("p95_ms", before["latency_ms"].get("p95", 0), now["latency_ms"].get("p95", 0), 1),
+            ("peak_mb", before["peak_mb"], now["peak_mb"], 1),
+        ]
+        for metric, old, new, sign in checks:
+            if old and sign * (new - old) / old > tolerance:
+                regressions.append({"stage": name, "metric": metric, "baseline": old, "current": new,
+                                    "change": (new - old) / old})
+    return regressions
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from langchain.schema import Document
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chunk_id TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+)
+"""
+
+
+class ChunkStore:
+    """Текст и метаданные чанков в SQLite; строки читаются по требованию.
+
+    row_id чанка совпадает с меткой его вектора в FAISS-индексе. Файл можно
+    открывать из нескольких процессов: читатели подключаются только на чтение
+    (отдельное соединение на поток), блокировки обеспечивает SQLite.
+    close() закрывает соединения всех потоков.
+    """
+
+    def __init__(self, path: Path, writable: bool = False) -> None:
+        self.path = Path(path)
+        self.writable = writable
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        if writable:
+            self._writer = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._writer.execute(SCHEMA)
+            self._writer.commit()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self.writable:
+            return self._writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(conn)
+            self._local.conn = conn
+        return conn
+
+    def insert(self, chunk_ids: Sequence[str], docs: Sequence[Document]) -> List[int]:
+        """Добавляет чанки и возвращает их row_id (без commit)."""
+        cur = self.conn.cursor()
+        rows = []
+        for chunk_id, doc in zip(chunk_ids, docs):
+            cur.execute(
+                "INSERT INTO chunks (chunk_id, content, metadata) VALUES (?, ?, ?)",
+                (chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)),
+            )
+            rows.append(cur.lastrowid)
+        return rows
+
+    def delete(self, chunk_ids: Sequence[str]) -> List[int]:
+        """Удаляет чанки по chunk_id и возвращает row_id удалённых (без commit)."""
+        rows: List[int] = []
+        for start in range(0, len(chunk_ids), 500):
+            part = list(chunk_ids[start:start + 500])
+            marks = ",".join("?" * len(part))
+            rows.extend(r for (r,) in self.conn.execute(
+                f"SELECT row_id FROM chunks WHERE chunk_id IN ({marks})", part
+            ))
+            self.conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({marks})", part)
+        return rows
+
+    def get(self, row_ids: Sequence[int]) -> List[Document]:
+        """Документы по row_id в том же порядке; отсутствующие пропускаются."""
+        found = self.get_map(row_ids)
+        return [found[int(r)] for r in row_ids if int(r) in found]
+
+    def get_map(self, row_ids: Sequence[int]) -> Dict[int, Document]:
+        """Словарь row_id -> документ для найденных строк."""
+        if not row_ids:
+            return {}
+        marks = ",".join("?" * len(row_ids))
+        found: Dict[int, Document] = {}
+        for row_id, chunk_id, content, metadata in self.conn.execute(
+            f"SELECT row_id, chunk_id, content, metadata FROM chunks WHERE row_id IN ({marks})",
+            [int(r) for r in row_ids],
+        ):
+            found[row_id] = Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+        return found
+
+    def iter_contents(self) -> Iterator[Tuple[int, str]]:
+        yield from self.conn.execute("SELECT row_id, content FROM chunks ORDER BY row_id")
+
+    def sources(self) -> List[str]:
+        """Файлы-источники чанков (metadata.source)."""
+        return [s for (s,) in self.conn.execute(
+            "SELECT DISTINCT json_extract(metadata, '$.source') FROM chunks ORDER BY 1"
+        ) if s]
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def commit(self) -> None:
+        if self.writable:
+            self._writer.commit()
+
+    def close(self) -> None:
+        if self.writable:
+            self._writer.close()
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+            # соединения потоков закрыты — при следующем обращении каждый откроет новое
+            self._local = threading.local()
+        for conn in readers:
+            conn.close()
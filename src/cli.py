@@ -1,17 +1,197 @@
 from __future__ import annotations
 
 import argparse
+import json
 import sys
 
-from .ingest import build_vector_store
+from .engine import get_engine
 from .rag import RAGQA
 from .quiz import generate_quiz
 from .tasks import generate_task
 
 
-def cmd_ingest(_: argparse.Namespace) -> int:
-    build_vector_store()
-    print("Index built.")
+def cmd_ingest(ns: argparse.Namespace) -> int:
+    stats = get_engine().rebuild(force_rebuild=ns.full)
+    mode = "full rebuild" if stats.full_rebuild else "incremental"
+    print(
+        f"Index built ({mode}): files +{stats.files_added} ~{stats.files_changed} "
+        f"-{stats.files_removed} ={stats.files_unchanged}, "
+        f"chunks +{stats.chunks_added} -{stats.chunks_removed}, "
+        f"embedding cache hits {stats.cache_hits} / misses {stats.cache_misses}."
+    )
+    return 0
+
+
+def cmd_index_report(ns: argparse.Namespace) -> int:
+    from .index_report import index_report
+
+    engine = get_engine()
+    questions = None
+    if ns.questions:
+        with open(ns.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    report = index_report(engine.vdb, engine.embeddings, k=ns.k, n_queries=ns.queries, questions=questions)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_migrate_index(_: argparse.Namespace) -> int:
+    from .config import paths
+    from .vectordb import migrate_legacy_store
+
+    n = migrate_legacy_store(paths.vector_dir)
+    print(f"Migrated {n} chunks to {paths.vector_dir}.")
+    return 0
+
+
+def cmd_calibrate_gate(ns: argparse.Namespace) -> int:
+    import numpy as np
+
+    from .gate import calibrate, load_examples, save_calibration
+
+    engine = get_engine()
+    examples = load_examples(ns.examples)
+    vectors = np.asarray(engine.embeddings.embed_queries([q for q, _ in examples]), dtype=np.float32)
+    nearest = [hits[0][1] if hits else float("inf") for hits in engine.vdb.search_by_vectors(vectors, 1)]
+    relevant = [d for d, (_, rel) in zip(nearest, examples) if rel]
+    irrelevant = [d for d, (_, rel) in zip(nearest, examples) if not rel]
+    result = calibrate(relevant, irrelevant, target_recall=ns.target_recall)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not ns.dry_run:
+        print(f"Saved to {save_calibration(result)}")
+    return 0
+
+
+def cmd_search_backfill(_: argparse.Namespace) -> int:
+    from .database import init_db, rebuild_search_index
+
+    init_db()
+    n = rebuild_search_index()
+    print(f"Search index rebuilt: {n} titles and messages.")
+    return 0
+
+
+def cmd_export(ns: argparse.Namespace) -> int:
+    from datetime import datetime
+
+    from .export import iter_export, ndjson_chunks
+
+    date_from = datetime.fromisoformat(ns.date_from) if ns.date_from else None
+    date_to = datetime.fromisoformat(ns.date_to) if ns.date_to else None
+    compress = ns.gzip or bool(ns.output and ns.output.endswith(".gz"))
+    counts = {"conversation": 0, "message": 0}
+
+    def counted(records):
+        for record in records:
+            counts[record["record"]] += 1
+            yield record
+
+    records = counted(iter_export(ns.user_id, ns.type, date_from, date_to, chunk_rows=ns.chunk_rows))
+    out = open(ns.output, "wb") if ns.output else sys.stdout.buffer
+    try:
+        for chunk in ndjson_chunks(records, compress=compress):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {counts['conversation']} conversations, {counts['message']} messages.", file=sys.stderr)
+    return 0
+
+
+def cmd_retention(ns: argparse.Namespace) -> int:
+    from .config import retention_cfg
+    from .database import init_db
+    from .retention import apply_retention, enable_incremental_vacuum
+
+    init_db()
+    if ns.full_vacuum:
+        enable_incremental_vacuum()
+        print("Database switched to auto_vacuum=INCREMENTAL.", file=sys.stderr)
+    days = ns.days if ns.days is not None else retention_cfg.days
+    if days <= 0:
+        if ns.full_vacuum:
+            return 0
+        print("Set --days or RETENTION_DAYS.", file=sys.stderr)
+        return 2
+    stats = apply_retention(days=days, mode=ns.mode, batch_size=ns.batch_size, dry_run=ns.dry_run)
+    print(json.dumps(stats.as_dict(), ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_bench_db(ns: argparse.Namespace) -> int:
+    from .db_bench import bench_db
+
+    result = bench_db(writers=ns.writers, turns=ns.turns)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_bench_search(ns: argparse.Namespace) -> int:
+    from .db_bench import bench_search
+
+    result = bench_search(sizes=tuple(ns.sizes), per_user=ns.per_user)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_bench(ns: argparse.Namespace) -> int:
+    from .bench import compare, failed_stages, run_benchmarks
+
+    result = run_benchmarks(docs=ns.docs, queries=ns.queries, stages=ns.stage, real_embeddings=ns.real_embeddings)
+    if ns.baseline:
+        with open(ns.baseline, encoding="utf-8") as f:
+            result["regressions"] = compare(result, json.load(f), tolerance=ns.tolerance)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if ns.output:
+        with open(ns.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 1 if result.get("regressions") or failed_stages(result) else 0
+
+
+def cmd_loadtest(ns: argparse.Namespace) -> int:
+    from .loadtest import MockSettings, parse_mix, run_loadtest
+
+    questions = None
+    if ns.questions:
+        with open(ns.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    mock = MockSettings(
+        latency=ns.latency, token_rate=ns.token_rate, tokens=ns.tokens, stream=not ns.mock_no_stream,
+        parallel=ns.mock_parallel,
+    )
+    report = run_loadtest(
+        rps=ns.rps,
+        duration=ns.duration,
+        mix=parse_mix(ns.mix),
+        users=ns.users,
+        stream=not ns.no_stream,
+        mock=mock,
+        mock_port=ns.mock_port,
+        target=ns.target,
+        server_pid=ns.server_pid,
+        synthetic=ns.synthetic,
+        docs=ns.docs,
+        questions=questions,
+        topics=ns.topic,
+        timeout=ns.timeout,
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if ns.output:
+        with open(ns.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+def cmd_pregenerate(ns: argparse.Namespace) -> int:
+    from .pregen import Pregenerator
+
+    topics = [t.strip() for t in ns.topic] if ns.topic else None
+    pregen = Pregenerator(topics=topics)
+    print(f"Topics: {'; '.join(pregen.topics())}")
+    n = pregen.fill()
+    print(f"Generated {n} quiz/task variants for index version {pregen.engine.index_version}.")
     return 0
 
 
@@ -22,6 +202,44 @@ def cmd_ask(ns: argparse.Namespace) -> int:
     return 0
 
 
+def _read_questions(path: str) -> list[str]:
+    """Вопросы из файла: по одному на строку или JSONL с полем "question"."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["question"]
+            questions.append(line)
+    return questions
+
+
+def cmd_ask_batch(ns: argparse.Namespace) -> int:
+    import asyncio
+
+    questions = _read_questions(ns.questions)
+    qa = RAGQA(k=ns.k)
+    out = open(ns.output, "w", encoding="utf-8") if ns.output else sys.stdout
+
+    async def run() -> int:
+        errors = 0
+        async for item in qa.aask_batch(questions, ns.concurrency):
+            errors += "error" in item
+            out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            out.flush()
+        return errors
+
+    try:
+        errors = asyncio.run(run())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Answered {len(questions) - errors} of {len(questions)} questions ({errors} errors).", file=sys.stderr)
+    return 1 if errors else 0
+
+
 def cmd_quiz(ns: argparse.Namespace) -> int:
     out = generate_quiz(ns.topic, ns.num)
     print(out["questions"])
@@ -39,14 +257,107 @@ def main(argv: list[str] | None = None) -> int:
     parser = argparse.ArgumentParser(prog="rag-edu-agent")
     sub = parser.add_subparsers(dest="cmd", required=True)
 
-    p_ing = sub.add_parser("ingest", help="Build vector index from data/")
+    p_ing = sub.add_parser("ingest", help="Build vector index from data/ (only new or changed files)")
+    p_ing.add_argument("--full", action="store_true", help="Re-parse and re-embed every file")
     p_ing.set_defaults(func=cmd_ingest)
 
+    p_rep = sub.add_parser("index-report", help="Recall@k and search latency of the index vs exact search")
+    p_rep.add_argument("--k", type=int, default=5)
+    p_rep.add_argument("--queries", type=int, default=200, help="Number of sampled chunks used as queries")
+    p_rep.add_argument("--questions", help="File with one question per line to use as queries")
+    p_rep.set_defaults(func=cmd_index_report)
+
+    p_mig = sub.add_parser("migrate-index", help="Convert a legacy index.pkl store to the SQLite chunk store")
+    p_mig.set_defaults(func=cmd_migrate_index)
+
+    p_gate = sub.add_parser("calibrate-gate", help="Calibrate the relevance gate threshold from labeled queries")
+    p_gate.add_argument("examples", help='JSONL file with {"query": ..., "relevant": true|false} per line')
+    p_gate.add_argument("--target-recall", type=float, default=0.98, help="Share of relevant queries to let through")
+    p_gate.add_argument("--dry-run", action="store_true", help="Print the result without writing gate.json")
+    p_gate.set_defaults(func=cmd_calibrate_gate)
+
+    p_sbf = sub.add_parser("search-backfill", help="Rebuild the full-text search index over conversations and messages")
+    p_sbf.set_defaults(func=cmd_search_backfill)
+
+    p_exp = sub.add_parser("export", help="Stream conversations and messages as NDJSON (optionally gzip)")
+    p_exp.add_argument("--user-id", help="Only this user's conversations (default: all users)")
+    p_exp.add_argument("--type", choices=["question", "quiz", "task"], help="Only conversations of this type")
+    p_exp.add_argument("--date-from", help="Conversations created at or after this ISO date")
+    p_exp.add_argument("--date-to", help="Conversations created at or before this ISO date")
+    p_exp.add_argument("--gzip", action="store_true", help="Compress the output (implied by an --output ending in .gz)")
+    p_exp.add_argument("--chunk-rows", type=int, help="Rows fetched from the database at a time (default: EXPORT_CHUNK_ROWS)")
+    p_exp.add_argument("--output", help="Write here instead of stdout")
+    p_exp.set_defaults(func=cmd_export)
+
+    p_ret = sub.add_parser("retention", help="Archive or delete conversations inactive for N days, then vacuum")
+    p_ret.add_argument("--days", type=int, help="Inactivity period in days (default: RETENTION_DAYS)")
+    p_ret.add_argument("--mode", choices=["archive", "delete"], help="Keep compressed copies or drop (default: RETENTION_MODE)")
+    p_ret.add_argument("--batch-size", type=int, help="Conversations per transaction (default: RETENTION_BATCH_SIZE)")
+    p_ret.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+    p_ret.add_argument(
+        "--full-vacuum", action="store_true",
+        help="Switch an existing database to incremental auto-vacuum with a one-time VACUUM (locks the database)",
+    )
+    p_ret.set_defaults(func=cmd_retention)
+
+    p_bdb = sub.add_parser("bench-db", help="Compare chat persistence write throughput: legacy vs WAL + append_turn")
+    p_bdb.add_argument("--writers", type=int, default=4, help="Concurrent writer threads")
+    p_bdb.add_argument("--turns", type=int, default=200, help="Turns written by each writer")
+    p_bdb.set_defaults(func=cmd_bench_db)
+
+    p_bse = sub.add_parser("bench-search", help="Full-text search latency as the conversation database grows")
+    p_bse.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000], help="Total messages")
+    p_bse.add_argument("--per-user", type=int, default=500, help="Messages per user")
+    p_bse.set_defaults(func=cmd_bench_search)
+
+    p_bch = sub.add_parser("bench", help="Microbenchmarks of ingest, retrieval, prompt and persistence hot paths (offline)")
+    p_bch.add_argument("--docs", type=int, default=40, help="Synthetic lectures in the corpus")
+    p_bch.add_argument("--queries", type=int, default=200, help="Synthetic questions per stage")
+    p_bch.add_argument("--stage", action="append", help="Run only this stage (repeatable)")
+    p_bch.add_argument("--real-embeddings", action="store_true", help="Also time the configured embedding model")
+    p_bch.add_argument("--output", help="Also write the JSON result here (use as a later --baseline)")
+    p_bch.add_argument("--baseline", help="Previous result to compare with; exit code 1 on regressions")
+    p_bch.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before a regression")
+    p_bch.set_defaults(func=cmd_bench)
+
+    p_load = sub.add_parser("loadtest", help="Replay ask/quiz/task/history traffic against the API with a mock Ollama")
+    p_load.add_argument("--rps", type=float, default=2.0, help="Target requests per second (Poisson arrivals)")
+    p_load.add_argument("--duration", type=float, default=60.0, help="Test length in seconds")
+    p_load.add_argument("--mix", default="ask=0.6,quiz=0.15,task=0.1,history=0.15", help="Traffic mix by request kind")
+    p_load.add_argument("--users", type=int, default=20, help="Virtual users continuing their conversations")
+    p_load.add_argument("--no-stream", action="store_true", help="Use /ask, /quiz, /task instead of the SSE endpoints")
+    p_load.add_argument("--questions", help="File with one question per line (default: synthetic questions)")
+    p_load.add_argument("--topic", action="append", help="Quiz/task topic (repeatable; default: synthetic topics)")
+    p_load.add_argument("--synthetic", action="store_true", help="Serve a synthetic index with hash embeddings (no model)")
+    p_load.add_argument("--docs", type=int, default=40, help="Synthetic lectures with --synthetic")
+    p_load.add_argument("--latency", type=float, default=0.5, help="Mock: seconds before the first token")
+    p_load.add_argument("--token-rate", type=float, default=20.0, help="Mock: generated tokens per second")
+    p_load.add_argument("--tokens", type=int, default=150, help="Mock: tokens per answer")
+    p_load.add_argument("--mock-parallel", type=int, default=1, help="Mock: concurrent generations (OLLAMA_NUM_PARALLEL)")
+    p_load.add_argument("--mock-no-stream", action="store_true", help="Mock: send each answer whole when it is done")
+    p_load.add_argument("--mock-port", type=int, help="Mock port (with --target the mock starts only if this is set)")
+    p_load.add_argument("--target", help="Load an already running API at this URL instead of starting one")
+    p_load.add_argument("--server-pid", type=int, help="PID of the --target API for CPU/memory sampling")
+    p_load.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    p_load.add_argument("--output", help="Also write the JSON report here")
+    p_load.set_defaults(func=cmd_loadtest)
+
+    p_pre = sub.add_parser("pregenerate", help="Generate missing quiz/task variants for known topics now")
+    p_pre.add_argument("--topic", action="append", help="Topic to pregenerate (repeatable; default: configured or corpus topics)")
+    p_pre.set_defaults(func=cmd_pregenerate)
+
     p_ask = sub.add_parser("ask", help="Ask a question constrained to materials")
     p_ask.add_argument("question", type=str)
     p_ask.add_argument("--k", type=int, default=5)
     p_ask.set_defaults(func=cmd_ask)
 
+    p_batch = sub.add_parser("ask-batch", help="Answer many questions with one batched retrieval pass (JSONL output)")
+    p_batch.add_argument("questions", help='File with one question per line or JSONL with {"question": ...}')
+    p_batch.add_argument("--k", type=int, default=5)
+    p_batch.add_argument("--concurrency", type=int, help="Parallel generations (default: ASK_BATCH_CONCURRENCY)")
+    p_batch.add_argument("--output", help="Write JSONL results here instead of stdout")
+    p_batch.set_defaults(func=cmd_ask_batch)
+
     p_quiz = sub.add_parser("quiz", help="Generate quiz questions by topic")
     p_quiz.add_argument("--topic", required=True)
     p_quiz.add_argument("--num", type=int, default=5)
@@ -19,24 +19,153 @@ class Paths:
 class EmbeddingConfig:
     model_name: str = os.getenv("EMBEDDINGS_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
     batch_size: int = int(os.getenv("EMBEDDINGS_BATCH_SIZE", "32"))
+    # число процессов для кодирования чанков при индексации (1 — без пула)
+    num_workers: int = int(os.getenv("EMBEDDINGS_WORKERS", "1"))
+    # сколько батчей отдаётся процессу за раз; от него зависит разбиение на блоки,
+    # поэтому результат не зависит от числа процессов
+    block_batches: int = int(os.getenv("EMBEDDINGS_BLOCK_BATCHES", "8"))
+    # кэш эмбеддингов чанков на диске (по умолчанию vector_store/embedding_cache; 0 МБ — выключен)
+    cache_dir: str = os.getenv("EMBEDDINGS_CACHE_DIR", "")
+    cache_max_mb: int = int(os.getenv("EMBEDDINGS_CACHE_MAX_MB", "512"))
 
 
 @dataclass(frozen=True)
 class LLMConfig:
     ollama_model: str = os.getenv("OLLAMA_MODEL", "hf.co/yandex/YandexGPT-5-Lite-8B-instruct-GGUF:Q4_K_M")
     ollama_base_url: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    # одновременные генерации, длина очереди ожидания и таймаут ожидания слота (с)
+    max_concurrency: int = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+    max_queue: int = int(os.getenv("OLLAMA_MAX_QUEUE", "16"))
+    queue_timeout: float = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30"))
+    # сколько модель остаётся в памяти Ollama после запроса ("30m", секунды или -1 — всегда)
+    keep_alive: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    request_timeout: float = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "300"))
+    # период фоновой проверки доступности (с) и прогрев модели при старте API
+    health_interval: float = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+    warmup: bool = os.getenv("OLLAMA_WARMUP", "1") not in ("0", "false", "no")
+    # /ask/batch: одновременные генерации одного пакета и максимальный размер пакета
+    batch_concurrency: int = int(os.getenv("ASK_BATCH_CONCURRENCY", "2"))
+    batch_max_questions: int = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "1000"))
 
 
 @dataclass(frozen=True)
 class ChunkingConfig:
     chunk_size: int = int(os.getenv("CHUNK_SIZE", "1200"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "200"))
+    # процессы для разбора и нарезки файлов (0 — по числу ядер)
+    parse_workers: int = int(os.getenv("INGEST_PARSE_WORKERS", "0"))
+
+
+@dataclass(frozen=True)
+class IndexConfig:
+    # flat (точный поиск), ivf, hnsw, pq, ivfpq
+    index_type: str = os.getenv("FAISS_INDEX_TYPE", "flat")
+    nlist: int = int(os.getenv("FAISS_NLIST", "0"))  # 0 — подбирается по размеру корпуса
+    nprobe: int = int(os.getenv("FAISS_NPROBE", "8"))
+    hnsw_m: int = int(os.getenv("FAISS_HNSW_M", "32"))
+    ef_construction: int = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+    ef_search: int = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+    pq_m: int = int(os.getenv("FAISS_PQ_M", "16"))  # байт на вектор при 8 битах на код
+    pq_nbits: int = int(os.getenv("FAISS_PQ_NBITS", "8"))
+
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    # как часто (в секундах) проверять, не изменился ли индекс на диске
+    reload_check_interval: float = float(os.getenv("INDEX_RELOAD_CHECK_INTERVAL", "2"))
+    # LRU-кэши: текст запроса -> эмбеддинг и (эмбеддинг, k, версия индекса) -> id чанков
+    query_cache_size: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    result_cache_size: int = int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096"))
+    # микробатчинг запросов: окно сбора (мс, 0 — выключен) и максимальный размер пакета
+    batch_window_ms: float = float(os.getenv("QUERY_BATCH_WINDOW_MS", "3"))
+    batch_max_size: int = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+    # фильтр релевантности: максимальное L2-расстояние до ближайшего чанка
+    # (0 — брать откалиброванный порог из vector_store/gate.json, если он есть)
+    relevance_max_distance: float = float(os.getenv("RELEVANCE_MAX_DISTANCE", "0"))
+
+
+@dataclass(frozen=True)
+class PromptConfig:
+    # окно контекста модели (передаётся в Ollama как num_ctx) и резерв под ответ, в токенах
+    context_window: int = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+    answer_reserve: int = int(os.getenv("LLM_ANSWER_RESERVE", "1024"))
+    # сколько токенов истории идёт в промпт дословно; более старые ходы сворачиваются в сводку
+    history_budget: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+    summary_max_tokens: int = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+    # грубая оценка числа токенов по длине текста (для кириллицы около 3 символов на токен)
+    chars_per_token: float = float(os.getenv("CHARS_PER_TOKEN", "3"))
+
+
+@dataclass(frozen=True)
+class ContextConfig:
+    # кандидатов из поиска на каждый фрагмент контекста (k * factor), из них MMR выбирает k
+    fetch_factor: int = int(os.getenv("CONTEXT_FETCH_FACTOR", "2"))
+    mmr: bool = os.getenv("CONTEXT_MMR", "1") not in ("0", "false", "no")
+    # баланс релевантности и разнообразия в MMR (1 — только релевантность)
+    mmr_lambda: float = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+    # косинусная близость, начиная с которой чанк считается дубликатом уже выбранного
+    duplicate_threshold: float = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.95"))
+    # потолок токенов на контекст (0 — всё, что осталось от окна модели)
+    max_tokens: int = int(os.getenv("CONTEXT_MAX_TOKENS", "0"))
+
+
+@dataclass(frozen=True)
+class PregenConfig:
+    # фоновая генерация квизов и заданий в простое API
+    enabled: bool = os.getenv("PREGEN_ENABLED", "0") in ("1", "true", "yes")
+    # темы через «;» или файл с темой на строке; если оба пусты — темы берутся из названий файлов корпуса
+    topics: str = os.getenv("PREGEN_TOPICS", "")
+    topics_file: str = os.getenv("PREGEN_TOPICS_FILE", "")
+    # сколько невыданных вариантов держать на тему, число вопросов в квизе
+    variants: int = int(os.getenv("PREGEN_VARIANTS", "3"))
+    quiz_num: int = int(os.getenv("PREGEN_QUIZ_NUM", "5"))
+    # сколько секунд LLM должна простаивать перед очередной фоновой генерацией
+    idle_seconds: float = float(os.getenv("PREGEN_IDLE_SECONDS", "30"))
+    # косинусная близость темы запроса к теме варианта, при которой вариант подходит
+    match_threshold: float = float(os.getenv("PREGEN_MATCH_THRESHOLD", "0.92"))
+
+
+@dataclass(frozen=True)
+class DatabaseConfig:
+    # SQLAlchemy URL базы диалогов (пусто — conversations.db в корне проекта)
+    url: str = os.getenv("DATABASE_URL", "")
+    # режим журнала SQLite: WAL — читатели не блокируются писателем (DELETE — как раньше)
+    journal_mode: str = os.getenv("DB_JOURNAL_MODE", "WAL")
+    # NORMAL в WAL-режиме не теряет целостность, fsync — только при checkpoint
+    synchronous: str = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+    # сколько миллисекунд ждать освобождения блокировки записи вместо «database is locked»
+    busy_timeout_ms: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    # выгрузка диалогов: сколько строк курсор читает из БД за раз
+    export_chunk_rows: int = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+    # INCREMENTAL — освобождённые страницы возвращаются ОС через PRAGMA incremental_vacuum
+    # (действует для новой БД; существующую переводит `cli retention --full-vacuum`)
+    auto_vacuum: str = os.getenv("DB_AUTO_VACUUM", "INCREMENTAL")
+
+
+@dataclass(frozen=True)
+class RetentionConfig:
+    # диалоги без активности дольше days дней выносятся из рабочих таблиц (0 — политика выключена)
+    days: int = int(os.getenv("RETENTION_DAYS", "0"))
+    # archive — сжатый JSON в таблицу archived_conversations, delete — удалить без следа
+    mode: str = os.getenv("RETENTION_MODE", "archive")
+    # диалогов за одну транзакцию и сколько страниц освобождать за проход (0 — все)
+    batch_size: int = int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+    vacuum_pages: int = int(os.getenv("RETENTION_VACUUM_PAGES", "0"))
+    # период фонового запуска в API, часы
+    interval_hours: float = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
 
 
 paths = Paths()
 embed_cfg = EmbeddingConfig()
 llm_cfg = LLMConfig()
 chunk_cfg = ChunkingConfig()
+index_cfg = IndexConfig()
+retrieval_cfg = RetrievalConfig()
+prompt_cfg = PromptConfig()
+context_cfg = ContextConfig()
+pregen_cfg = PregenConfig()
+retention_cfg = RetentionConfig()
+db_cfg = DatabaseConfig()
 
 
 def ensure_dirs() -> None:
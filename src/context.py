@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from .config import chunk_cfg, context_cfg
+from .history import count_tokens, truncate_to_tokens
+
+
+SEPARATOR = "\n---\n"
+
+
+@dataclass
+class Candidates:
+    """Кандидаты поиска для одного запроса: документы, расстояния и векторы."""
+
+    query_vector: np.ndarray
+    row_ids: List[int]
+    docs: List[Document]
+    distances: List[float]
+    # векторы чанков из индекса (для PQ — приближённые); None, если индекс их не отдаёт
+    vectors: Optional[np.ndarray] = None
+
+    def scored(self) -> List[Tuple[Document, float]]:
+        return list(zip(self.docs, self.distances))
+
+
+@dataclass
+class ContextStats:
+    candidates: int = 0
+    selected: int = 0  # фрагментов в промпте после склейки
+    merged: int = 0  # чанков, склеенных с соседними
+    duplicates: int = 0  # отброшено как почти дубликаты
+    over_budget: int = 0  # не влезло в бюджет токенов
+    tokens_naive: int = 0  # сколько занял бы top-k как есть
+    tokens: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_naive - self.tokens, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {**asdict(self), "tokens_saved": self.tokens_saved}
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr(
+    query_vector: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_: float,
+    duplicate_threshold: float,
+) -> Tuple[List[int], int]:
+    """Maximal Marginal Relevance по косинусной близости.
+
+    Возвращает индексы выбранных векторов (в порядке выбора) и число
+    отброшенных почти дубликатов — кандидатов, чья близость к уже выбранному
+    не меньше duplicate_threshold.
+    """
+    n = len(vectors)
+    if n == 0 or k <= 0:
+        return [], 0
+    docs = _unit(np.asarray(vectors, dtype=np.float32))
+    relevance = docs @ _unit(np.asarray(query_vector, dtype=np.float32))
+    redundancy = np.full(n, -np.inf, dtype=np.float32)  # max близость к выбранным
+    alive = np.ones(n, dtype=bool)
+    selected: List[int] = []
+    duplicates = 0
+    while len(selected) < k and alive.any():
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        score = np.where(alive, lambda_ * relevance - (1 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(score))
+        selected.append(best)
+        alive[best] = False
+        redundancy = np.maximum(redundancy, docs @ docs[best])
+        dup = alive & (redundancy >= duplicate_threshold)
+        duplicates += int(dup.sum())
+        alive &= ~dup
+    return selected, duplicates
+
+
+def join_overlapping(a: str, b: str, max_overlap: int) -> str:
+    """Склеивает соседние чанки, не повторяя общий участок (перекрытие сплиттера)."""
+    probe = b[:16]
+    if probe:
+        pos = a.find(probe, max(0, len(a) - max_overlap - len(probe)))
+        while pos != -1:
+            if b.startswith(a[pos:]):
+                return a + b[len(a) - pos:]
+            pos = a.find(probe, pos + 1)
+    return a + "\n" + b
+
+
+def _position(doc: Document, row_id: int) -> Tuple[str, int]:
+    """Файл и номер чанка в нём; у индексов старого формата номер — row_id (порядок вставки)."""
+    meta = doc.metadata
+    if "chunk_index" in meta:
+        return meta.get("file_hash") or meta.get("source", ""), int(meta["chunk_index"])
+    return meta.get("source", ""), int(row_id)
+
+
+def merge_adjacent(docs: Sequence[Document], row_ids: Sequence[int]) -> Tuple[List[Document], int]:
+    """Склеивает выбранные чанки, идущие в одном файле подряд.
+
+    Склеенный фрагмент занимает место самого релевантного из своих чанков.
+    Возвращает фрагменты и число чанков, поглощённых соседями.
+    """
+    positions = [_position(doc, row_id) for doc, row_id in zip(docs, row_ids)]
+    order = sorted(range(len(docs)), key=lambda i: positions[i])
+    runs: List[List[int]] = []
+    for i in order:
+        if runs and positions[runs[-1][-1]][0] == positions[i][0] and positions[i][1] - positions[runs[-1][-1]][1] == 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    merged: List[Tuple[int, Document]] = []
+    for run in runs:
+        text = docs[run[0]].page_content
+        for i in run[1:]:
+            text = join_overlapping(text, docs[i].page_content, chunk_cfg.chunk_overlap * 2)
+        head = docs[run[0]]
+        doc = head if len(run) == 1 else Document(
+            id=head.id, page_content=text, metadata={**head.metadata, "merged_chunks": len(run)}
+        )
+        merged.append((min(run), doc))
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged], len(docs) - len(runs)
+
+
+def select_context(candidates: Candidates, k: int, max_tokens: int) -> Tuple[str, Dict[str, int]]:
+    """Отбирает контекст для промпта из кандидатов поиска.
+
+    1. MMR по векторам чанков выбирает до k фрагментов и отбрасывает почти дубликаты.
+    2. Соседние чанки одного файла склеиваются без повторения перекрытия.
+    3. Фрагменты добавляются по убыванию релевантности, пока влезают в max_tokens
+       (самый релевантный — всегда, при нехватке места обрезанным).
+    """
+    stats = ContextStats(candidates=len(candidates.docs))
+    docs, rows = candidates.docs, candidates.row_ids
+    stats.tokens_naive = count_tokens(SEPARATOR.join(d.page_content for d in docs[:k]))
+    if context_cfg.mmr and candidates.vectors is not None and len(docs) > 1:
+        picked, stats.duplicates = mmr(
+            candidates.query_vector, candidates.vectors, k, context_cfg.mmr_lambda, context_cfg.duplicate_threshold
+        )
+        picked.sort()  # дальше — в порядке исходной релевантности
+    else:
+        picked = list(range(min(k, len(docs))))
+    fragments, stats.merged = merge_adjacent([docs[i] for i in picked], [rows[i] for i in picked])
+    if context_cfg.max_tokens:
+        max_tokens = min(max_tokens, context_cfg.max_tokens)
+
+    parts: List[str] = []
+    used = 0
+    for doc in fragments:
+        cost = count_tokens(doc.page_content) + (count_tokens(SEPARATOR) if parts else 0)
+        if used + cost > max_tokens:
+            if not parts:
+                parts.append(truncate_to_tokens(doc.page_content, max(max_tokens, 256)))
+                used = count_tokens(parts[0])
+            continue
+        parts.append(doc.page_content)
+        used += cost
+    stats.over_budget = len(fragments) - len(parts)
+    stats.selected = len(parts)
+    context = SEPARATOR.join(parts)
+    stats.tokens = count_tokens(context)
+    _record(stats)
+    return context, stats.as_dict()
+
+
+_totals: Dict[str, int] = {"requests": 0, "tokens_naive": 0, "tokens": 0, "merged": 0, "duplicates": 0}
+_totals_lock = threading.Lock()
+
+
+def _record(stats: ContextStats) -> None:
+    with _totals_lock:
+        _totals["requests"] += 1
+        _totals["tokens_naive"] += stats.tokens_naive
+        _totals["tokens"] += stats.tokens
+        _totals["merged"] += stats.merged
+        _totals["duplicates"] += stats.duplicates
+
+
+def context_totals() -> Dict[str, int]:
+    """Суммарная статистика отбора контекста с запуска процесса."""
+    with _totals_lock:
+        totals = dict(_totals)
+    totals["tokens_saved"] = max(totals["tokens_naive"] - totals["tokens"], 0)
+    return totals
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import base64
+import re
+from typing import List, Optional, Tuple
 from datetime import datetime, timedelta
 
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
+from sqlalchemy import Integer, and_, false, func, or_, text
 
-from .database import Conversation, Message
+from .database import SEARCH_TABLE, Conversation, Message, Pregenerated
+from .metrics import timed_db
 
 
+@timed_db
 def create_conversation(
     db: Session,
     user_id: str,
@@ -27,27 +31,32 @@ def create_conversation(
     return conversation
 
 
+@timed_db
 def get_conversation(db: Session, conversation_id: int) -> Optional[Conversation]:
     """Получение диалога по ID."""
     return db.query(Conversation).filter(Conversation.id == conversation_id).first()
 
 
-def get_user_conversations(
-    db: Session,
+def _filter_user_conversations(
+    query,
     user_id: str,
-    skip: int = 0,
-    limit: int = 100,
     search: Optional[str] = None,
     conversation_type: Optional[str] = None,
     date_from: Optional[datetime] = None,
     date_to: Optional[datetime] = None
-) -> List[Conversation]:
-    """Получение всех диалогов пользователя с фильтрацией и поиском."""
-    query = db.query(Conversation).filter(Conversation.user_id == user_id)
+):
+    """Фильтры списка диалогов пользователя: поиск по заголовку, тип, даты создания."""
+    query = query.filter(Conversation.user_id == user_id)
     
-    # Поиск по заголовку
+    # Поиск по заголовку и тексту сообщений (полнотекстовый индекс)
     if search:
-        query = query.filter(Conversation.title.ilike(f"%{search}%"))
+        match = fts_query(user_id, search)
+        if match is None:
+            return query.filter(false())
+        matched = text(
+            f"SELECT conversation_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"
+        ).bindparams(match=match).columns(conversation_id=Integer)
+        query = query.filter(Conversation.id.in_(matched))
     
     # Фильтр по типу
     if conversation_type:
@@ -59,15 +68,182 @@ def get_user_conversations(
     if date_to:
         query = query.filter(Conversation.created_at <= date_to)
     
-    return (
-        query
-        .order_by(Conversation.updated_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+    return query
+
+
+# сколько последних совпавших сообщений пользователя ранжируется при поиске
+SEARCH_CANDIDATES = 500
+
+
+def _fold(text_: str) -> str:
+    # как токенизатор FTS (unicode61 remove_diacritics 2): регистр, ё -> е, й -> и
+    return text_.casefold().replace("ё", "е").replace("й", "и")
+
+
+def _search_terms(search: str) -> List[str]:
+    """Слова поиска в виде префиксов.
+
+    Стеммера для русского в SQLite нет, поэтому у слов длиннее четырёх букв
+    отбрасывается до двух последних символов (окончание): «формы» ищется как
+    «форм*», «нормализации» — как «нормализ*». Префикс не длиннее 8 символов —
+    для таких длин в FTS-таблице есть префиксный индекс. Слова короче четырёх
+    букв ищутся целиком.
+    """
+    return [w if len(w) < 4 else w[:max(4, len(w) - 2)][:8] for w in re.findall(r"\w+", _fold(search))]
+
+
+def fts_query(user_id: str, search: str) -> Optional[str]:
+    """Запрос FTS5 из строки поиска: все слова среди записей пользователя; None — слов нет."""
+    terms = _search_terms(search)
+    if not terms:
+        return None
+    body = " AND ".join(f'"{t}"' if len(t) < 4 else f'"{t}"*' for t in terms)
+    owner = user_id.encode("utf-8").hex().upper()  # как hex(user_id) в триггерах
+    return f'owner:"{owner}" AND body:({body})'
+
+
+def _rank(tokens: List[str], terms: List[str], avg_len: float) -> float:
+    """BM25 без IDF: насыщение частоты слов и поправка на длину текста.
+
+    Встроенный bm25() FTS5 для IDF обходит совпадения всех пользователей, и его
+    время растёт с общим объёмом базы; здесь считаются только строки пользователя.
+    """
+    norm = 1.2 * (0.25 + 0.75 * len(tokens) / max(avg_len, 1.0))
+    score = 0.0
+    for term in terms:
+        tf = sum(1 for tok in tokens if (tok == term if len(term) < 4 else tok.startswith(term)))
+        score += tf * 2.2 / (tf + norm)
+    return score
+
+
+@timed_db
+def search_conversations(
+    db: Session,
+    user_id: str,
+    search: str,
+    limit: int = 20,
+    conversation_type: Optional[str] = None
+) -> List[dict]:
+    """Диалоги пользователя, где встречаются слова поиска, по убыванию релевантности.
+
+    Для каждого диалога — лучшее совпадение: фрагмент текста с выделенными
+    словами (snippet) и id сообщения (None, если совпал заголовок). Ранжируются
+    совпавшие заголовки и последние SEARCH_CANDIDATES совпавших сообщений —
+    время поиска зависит от объёма переписки пользователя, а не всей базы.
+    """
+    match = fts_query(user_id, search)
+    if match is None:
+        return []
+    terms = _search_terms(search)
+    select = (
+        f"SELECT rowid, conversation_id, body, "
+        f"snippet({SEARCH_TABLE}, 1, '<mark>', '</mark>', '…', 16) AS snippet "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match "
     )
+    titles = db.execute(text(select + "AND rowid < 0"), {"match": match}).all()
+    messages = db.execute(
+        text(select + "AND rowid > 0 ORDER BY rowid DESC LIMIT :n"), {"match": match, "n": SEARCH_CANDIDATES}
+    ).all()
+    rows = titles + messages
+    if not rows:
+        return []
+    tokens = [re.findall(r"\w+", _fold(row.body)) for row in rows]
+    avg_len = sum(len(t) for t in tokens) / len(rows)
+    best: dict = {}
+    for (rowid, conversation_id, _, snippet), row_tokens in zip(rows, tokens):
+        rank = _rank(row_tokens, terms, avg_len) * (2.0 if rowid < 0 else 1.0)  # совпадение в заголовке весомее
+        if conversation_id not in best or rank > best[conversation_id]["rank"]:
+            best[conversation_id] = {
+                "message_id": rowid if rowid > 0 else None,
+                "snippet": snippet,
+                "rank": rank,
+            }
+    query = db.query(
+        Conversation.id,
+        Conversation.title,
+        Conversation.conversation_type,
+        Conversation.created_at,
+        Conversation.updated_at,
+    ).filter(Conversation.id.in_(list(best)), Conversation.user_id == user_id)
+    if conversation_type:
+        query = query.filter(Conversation.conversation_type == conversation_type)
+    results = [{**row._asdict(), **best[row.id]} for row in query.all()]
+    results.sort(key=lambda item: item["rank"], reverse=True)
+    return results[:limit]
+
+
+def encode_cursor(updated_at: datetime, conversation_id: int) -> str:
+    """Курсор страницы списка диалогов: позиция последнего показанного диалога."""
+    raw = f"{updated_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
 
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разбор курсора; ValueError, если курсор повреждён."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, conversation_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except ValueError:  # в том числе ошибки base64 и UTF-8
+        raise ValueError("Некорректный курсор")
+
+
+@timed_db
+def list_user_conversations(
+    db: Session,
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    search: Optional[str] = None,
+    conversation_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> Tuple[list, Optional[str]]:
+    """Страница списка диалогов с числом сообщений и курсор следующей страницы.
+
+    Диалоги идут по убыванию (updated_at, id); cursor — значение next_cursor
+    предыдущей страницы, страница начинается сразу после него (keyset-пагинация
+    по индексу ix_conversations_user_updated вместо OFFSET). Число сообщений
+    считается подзапросом по индексу ix_messages_conversation_timestamp, сами
+    сообщения не загружаются. Строки содержат только поля для списка.
+    """
+    message_count = (
+        db.query(func.count(Message.id))
+        .filter(Message.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    query = _filter_user_conversations(
+        db.query(
+            Conversation.id,
+            Conversation.user_id,
+            Conversation.title,
+            Conversation.conversation_type,
+            Conversation.created_at,
+            Conversation.updated_at,
+            message_count.label("message_count"),
+        ),
+        user_id, search, conversation_type, date_from, date_to
+    )
+    if cursor:
+        updated_at, last_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                Conversation.updated_at < updated_at,
+                and_(Conversation.updated_at == updated_at, Conversation.id < last_id),
+            )
+        )
+    query = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+    # на одну строку больше — чтобы узнать, есть ли следующая страница
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+    return rows, next_cursor
+
+
+@timed_db
 def count_user_conversations(
     db: Session,
     user_id: str,
@@ -77,30 +253,26 @@ def count_user_conversations(
     date_to: Optional[datetime] = None
 ) -> int:
     """Подсчет количества диалогов пользователя с учетом фильтров."""
-    query = db.query(func.count(Conversation.id)).filter(Conversation.user_id == user_id)
-    
-    if search:
-        query = query.filter(Conversation.title.ilike(f"%{search}%"))
-    if conversation_type:
-        query = query.filter(Conversation.conversation_type == conversation_type)
-    if date_from:
-        query = query.filter(Conversation.created_at >= date_from)
-    if date_to:
-        query = query.filter(Conversation.created_at <= date_to)
-    
+    query = _filter_user_conversations(
+        db.query(func.count(Conversation.id)), user_id, search, conversation_type, date_from, date_to
+    )
     return query.scalar()
 
 
+@timed_db
 def delete_conversation(db: Session, conversation_id: int) -> bool:
-    """Удаление диалога."""
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    if conversation:
-        db.delete(conversation)
-        db.commit()
-        return True
-    return False
+    """Удаление диалога вместе с сообщениями.
+
+    Два DELETE по индексам одной транзакцией — без загрузки сообщений в
+    сессию, как при каскаде ORM.
+    """
+    db.query(Message).filter(Message.conversation_id == conversation_id).delete(synchronize_session=False)
+    deleted = db.query(Conversation).filter(Conversation.id == conversation_id).delete(synchronize_session=False)
+    db.commit()
+    return bool(deleted)
 
 
+@timed_db
 def add_message(
     db: Session,
     conversation_id: int,
@@ -125,6 +297,59 @@ def add_message(
     return message
 
 
+@timed_db
+def append_turn(
+    db: Session,
+    user_content: str,
+    assistant_content: str,
+    conversation_id: Optional[int] = None,
+    user_id: Optional[str] = None,
+    title: Optional[str] = None,
+    conversation_type: Optional[str] = None
+) -> Optional[Tuple[int, Message, Message]]:
+    """Добавление хода (сообщение пользователя и ответ) одной транзакцией.
+
+    Без conversation_id диалог создаётся в той же транзакции (нужны user_id,
+    title и conversation_type). Существование диалога проверяется тем же
+    UPDATE, что поднимает его updated_at, без отдельного SELECT.
+    Возвращает (id диалога, сообщение пользователя, ответ); None — диалога нет.
+    """
+    now = datetime.utcnow()
+    if conversation_id is None:
+        conversation = Conversation(
+            user_id=user_id,
+            title=title,
+            conversation_type=conversation_type,
+            created_at=now,
+            updated_at=now
+        )
+        db.add(conversation)
+        db.flush()
+        conversation_id = conversation.id
+    else:
+        updated = (
+            db.query(Conversation)
+            .filter(Conversation.id == conversation_id)
+            .update({"updated_at": now}, synchronize_session=False)
+        )
+        if not updated:
+            db.rollback()
+            return None
+    user_msg = Message(conversation_id=conversation_id, role="user", content=user_content, timestamp=now)
+    assistant_msg = Message(
+        conversation_id=conversation_id, role="assistant", content=assistant_content, timestamp=now
+    )
+    db.add_all([user_msg, assistant_msg])
+    # id и поля известны после flush — перечитывать строки после commit не нужно
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = True
+    return conversation_id, user_msg, assistant_msg
+
+
+@timed_db
 def get_conversation_messages(
     db: Session,
     conversation_id: int
@@ -133,11 +358,32 @@ def get_conversation_messages(
     return (
         db.query(Message)
         .filter(Message.conversation_id == conversation_id)
-        .order_by(Message.timestamp.asc())
+        .order_by(Message.timestamp.asc(), Message.id.asc())
+        .all()
+    )
+
+
+@timed_db
+def get_history_messages(
+    db: Session,
+    conversation_id: int,
+    offset: int = 0
+) -> List[Tuple[str, str]]:
+    """(роль, текст) сообщений диалога по времени, начиная с offset-го.
+
+    Один запрос по индексу ix_messages_conversation_timestamp; первые offset
+    сообщений (уже свёрнутые в сводку) не читаются.
+    """
+    return (
+        db.query(Message.role, Message.content)
+        .filter(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp.asc(), Message.id.asc())
+        .offset(offset)
         .all()
     )
 
 
+@timed_db
 def update_conversation_title(
     db: Session,
     conversation_id: int,
@@ -151,3 +397,125 @@ def update_conversation_title(
         db.commit()
         db.refresh(conversation)
     return conversation
+
+
+@timed_db
+def update_conversation_summary(
+    db: Session,
+    conversation_id: int,
+    summary: str,
+    upto: int,
+    digest: str
+) -> None:
+    """Сохранение сводки ранних ходов диалога (время изменения диалога не трогаем)."""
+    (
+        db.query(Conversation)
+        .filter(Conversation.id == conversation_id)
+        .update(
+            {
+                "summary": summary,
+                "summary_upto": upto,
+                "summary_hash": digest,
+                # иначе сработает onupdate и диалог «поднимется» в списке
+                "updated_at": Conversation.updated_at,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+
+
+@timed_db
+def add_pregenerated(
+    db: Session,
+    kind: str,
+    topic: str,
+    topic_key: str,
+    num: int,
+    content: str,
+    index_version: str
+) -> Pregenerated:
+    """Сохранение заранее сгенерированного варианта квиза или задания."""
+    item = Pregenerated(
+        kind=kind,
+        topic=topic,
+        topic_key=topic_key,
+        num=num,
+        content=content,
+        index_version=index_version
+    )
+    db.add(item)
+    db.commit()
+    db.refresh(item)
+    return item
+
+
+@timed_db
+def take_pregenerated(
+    db: Session,
+    kind: str,
+    topic_key: str,
+    num: int,
+    index_version: str
+) -> Optional[Pregenerated]:
+    """Выдача ещё не выданного варианта; вариант помечается выданным."""
+    while True:
+        item = (
+            db.query(Pregenerated)
+            .filter(
+                Pregenerated.index_version == index_version,
+                Pregenerated.kind == kind,
+                Pregenerated.topic_key == topic_key,
+                Pregenerated.num == num,
+                Pregenerated.served_at.is_(None),
+            )
+            .order_by(Pregenerated.created_at.asc())
+            .first()
+        )
+        if item is None:
+            return None
+        # условие served_at IS NULL защищает от выдачи одного варианта двум запросам
+        taken = (
+            db.query(Pregenerated)
+            .filter(Pregenerated.id == item.id, Pregenerated.served_at.is_(None))
+            .update({"served_at": datetime.utcnow()}, synchronize_session=False)
+        )
+        db.commit()
+        if taken:
+            db.refresh(item)
+            return item
+
+
+@timed_db
+def count_fresh_pregenerated(db: Session, index_version: str) -> dict:
+    """Число невыданных вариантов по (kind, topic_key, num) для версии индекса."""
+    rows = (
+        db.query(Pregenerated.kind, Pregenerated.topic_key, Pregenerated.num, func.count(Pregenerated.id))
+        .filter(Pregenerated.index_version == index_version, Pregenerated.served_at.is_(None))
+        .group_by(Pregenerated.kind, Pregenerated.topic_key, Pregenerated.num)
+        .all()
+    )
+    return {(kind, key, num): count for kind, key, num, count in rows}
+
+
+@timed_db
+def get_pregenerated_topics(db: Session, index_version: str) -> List[tuple]:
+    """Темы (topic_key, topic), для которых есть варианты текущей версии индекса."""
+    return (
+        db.query(Pregenerated.topic_key, func.min(Pregenerated.topic))
+        .filter(Pregenerated.index_version == index_version)
+        .group_by(Pregenerated.topic_key)
+        .all()
+    )
+
+
+@timed_db
+def delete_stale_pregenerated(db: Session, index_version: str) -> int:
+    """Удаление вариантов, сгенерированных по другим версиям индекса."""
+    deleted = (
+        db.query(Pregenerated)
+        .filter(Pregenerated.index_version != index_version)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
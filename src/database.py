@@ -3,17 +3,51 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, ForeignKey, Index, LargeBinary
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, Session
 
-from .config import paths
+from .config import db_cfg, paths
 
 
-# Создаем базу данных в корневой директории проекта
-DATABASE_URL = f"sqlite:///{paths.root}/conversations.db"
+# По умолчанию база данных в корневой директории проекта
+DATABASE_URL = db_cfg.url or f"sqlite:///{paths.root}/conversations.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+def make_engine(
+    url: str,
+    journal_mode: str | None = None,
+    synchronous: str | None = None,
+    busy_timeout_ms: int | None = None,
+    auto_vacuum: str | None = None,
+):
+    """Движок SQLite с настройками журнала, синхронизации и ожидания блокировок.
+
+    Параметры по умолчанию берутся из db_cfg; PRAGMA выполняются на каждом
+    новом соединении пула (journal_mode=WAL и auto_vacuum сохраняются в самом файле БД).
+    """
+    journal_mode = journal_mode or db_cfg.journal_mode
+    synchronous = synchronous or db_cfg.synchronous
+    busy_timeout_ms = db_cfg.busy_timeout_ms if busy_timeout_ms is None else busy_timeout_ms
+    auto_vacuum = auto_vacuum or db_cfg.auto_vacuum
+    db_engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(db_engine, "connect")
+    def _set_pragmas(dbapi_conn, _record) -> None:
+        cursor = dbapi_conn.cursor()
+        # у БД с таблицами режим не меняется без VACUUM — для неё это ничего не делает
+        cursor.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.close()
+
+    return db_engine
+
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -30,9 +64,19 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Сводка ранних ходов для промпта: сколько первых сообщений истории свёрнуто и их хэш
+    summary = Column(Text, nullable=True)
+    summary_upto = Column(Integer, nullable=True)
+    summary_hash = Column(String, nullable=True)
+
     # Связь с сообщениями
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # список диалогов пользователя по убыванию updated_at (id в SQLite входит в индекс как rowid)
+        Index("ix_conversations_user_updated", "user_id", "updated_at"),
+    )
+
 
 class Message(Base):
     """Модель для хранения сообщений в диалоге."""
@@ -47,10 +91,135 @@ class Message(Base):
     # Связь с диалогом
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        # сообщения диалога по времени и подсчёт их числа без чтения самих сообщений
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),
+    )
+
+
+class Pregenerated(Base):
+    """Заранее сгенерированные варианты квизов и заданий по известным темам."""
+    __tablename__ = "pregenerated"
 
-def init_db() -> None:
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # quiz или task
+    topic = Column(String, nullable=False)
+    topic_key = Column(String, nullable=False)  # нормализованная тема для поиска
+    num = Column(Integer, nullable=False, default=0)  # число вопросов квиза (0 для заданий)
+    content = Column(Text, nullable=False)
+    index_version = Column(String, nullable=False)  # версия индекса, по которой сгенерировано
+    created_at = Column(DateTime, default=datetime.utcnow)
+    served_at = Column(DateTime, nullable=True)  # когда вариант выдан студенту
+
+    __table_args__ = (
+        Index("ix_pregenerated_lookup", "index_version", "kind", "topic_key", "num", "served_at"),
+    )
+
+
+class ArchivedConversation(Base):
+    """Диалоги, вынесенные политикой хранения из рабочих таблиц."""
+    __tablename__ = "archived_conversations"
+
+    id = Column(Integer, primary_key=True)
+    # id исходного диалога: SQLite может выдать его снова новому диалогу, поэтому не ключ
+    conversation_id = Column(Integer, index=True, nullable=False)
+    user_id = Column(String, index=True, nullable=False)
+    title = Column(String, nullable=False)
+    conversation_type = Column(String, nullable=False)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    message_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    # zlib-сжатый JSON в формате GET /conversations/{id}/export
+    payload = Column(LargeBinary, nullable=False)
+
+
+def _migrate(db_engine) -> None:
+    """Добавляет в уже существующие таблицы колонки и индексы, появившиеся в моделях позже."""
+    inspector = inspect(db_engine)
+    with db_engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = column.type.compile(dialect=db_engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+# Полнотекстовый поиск: по строке FTS5 на заголовок диалога (rowid = -id диалога)
+# и на каждое сообщение (rowid = id сообщения). owner — hex(user_id) одним токеном, чтобы
+# поиск ограничивался пользователем внутри самого FTS-запроса (список его строк, а не всех).
+# Таблица обновляется триггерами.
+SEARCH_TABLE = "search_fts"
+
+_SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        owner, body, conversation_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '4 5 6 7 8'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_conversations_ai AFTER INSERT ON conversations BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id) VALUES (-new.id, hex(new.user_id), new.title, new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_conversations_au AFTER UPDATE OF title, user_id ON conversations BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = -old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id) VALUES (-new.id, hex(new.user_id), new.title, new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_conversations_ad AFTER DELETE ON conversations BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = -old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_messages_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id)
+        SELECT new.id, hex(user_id), new.content, new.conversation_id FROM conversations WHERE id = new.conversation_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_messages_au AFTER UPDATE OF content ON messages BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id)
+        SELECT new.id, hex(user_id), new.content, new.conversation_id FROM conversations WHERE id = new.conversation_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_messages_ad AFTER DELETE ON messages BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+
+def rebuild_search_index(db_engine=None) -> int:
+    """Заполняет полнотекстовый индекс заново по всем диалогам и сообщениям; возвращает число строк."""
+    with (db_engine or engine).begin() as conn:
+        conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+        conn.execute(text(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id) "
+            "SELECT -id, hex(user_id), title, id FROM conversations"
+        ))
+        conn.execute(text(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, owner, body, conversation_id) "
+            "SELECT m.id, hex(c.user_id), m.content, m.conversation_id "
+            "FROM messages m JOIN conversations c ON c.id = m.conversation_id"
+        ))
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+        return conn.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+
+
+def _create_search_index(db_engine) -> bool:
+    """Создаёт FTS-таблицу и триггеры, если их нет; True — таблица создана только что."""
+    created = not inspect(db_engine).has_table(SEARCH_TABLE)
+    with db_engine.begin() as conn:
+        for ddl in _SEARCH_DDL:
+            conn.execute(text(ddl))
+    return created
+
+
+def init_db(db_engine=None) -> None:
     """Инициализация базы данных."""
-    Base.metadata.create_all(bind=engine)
+    db_engine = db_engine or engine
+    Base.metadata.create_all(bind=db_engine)
+    _migrate(db_engine)
+    if _create_search_index(db_engine):
+        # база существовала до полнотекстового поиска — индексируем накопленное
+        rebuild_search_index(db_engine)
 
 
 def get_db() -> Session:
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from . import crud
+from .bench import percentile_ms
+from .database import init_db, make_engine
+
+
+def _legacy_turn(db, conversation_id: int, question: str, answer: str) -> None:
+    # прежний путь фронтенда: два POST /messages
+    crud.add_message(db, conversation_id, "user", question)
+    crud.add_message(db, conversation_id, "assistant", answer)
+
+
+def _append_turn(db, conversation_id: int, question: str, answer: str) -> None:
+    crud.append_turn(db, question, answer, conversation_id=conversation_id)
+
+
+def _run(path: Path, mode: str, writers: int, turns: int, answer_chars: int) -> Dict[str, object]:
+    if mode == "legacy":
+        db_engine = make_engine(f"sqlite:///{path}", journal_mode="DELETE", synchronous="FULL")
+        write = _legacy_turn
+    else:
+        db_engine = make_engine(f"sqlite:///{path}")
+        write = _append_turn
+    init_db(db_engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    answer = "ответ " * (answer_chars // 6)
+
+    with Session() as db:
+        conversations = [
+            crud.create_conversation(db, f"bench_{i}", f"Диалог {i}", "question").id for i in range(writers)
+        ]
+
+    write_lat: List[float] = []
+    read_lat: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def writer(conversation_id: int) -> None:
+        nonlocal errors
+        with Session() as db:
+            for i in range(turns):
+                started = time.perf_counter()
+                try:
+                    write(db, conversation_id, f"Вопрос {i}?", answer)
+                except OperationalError:
+                    db.rollback()
+                    with lock:
+                        errors += 1
+                    continue
+                with lock:
+                    write_lat.append(time.perf_counter() - started)
+
+    def reader() -> None:
+        # боковая панель, открытая во время записи
+        with Session() as db:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    crud.list_user_conversations(db, "bench_0", limit=20)
+                    db.rollback()
+                except OperationalError:
+                    db.rollback()
+                    continue
+                read_lat.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer, args=(cid,)) for cid in conversations]
+    read_thread = threading.Thread(target=reader)
+    read_thread.start()
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    read_thread.join()
+    db_engine.dispose()
+    return {
+        "turns": len(write_lat),
+        "errors": errors,
+        "turns_per_s": len(write_lat) / elapsed if elapsed else 0.0,
+        "write_ms": {"p50": percentile_ms(write_lat, 50), "p99": percentile_ms(write_lat, 99)},
+        "read_ms": {"p50": percentile_ms(read_lat, 50), "p99": percentile_ms(read_lat, 99)},
+    }
+
+
+def bench_db(writers: int = 4, turns: int = 200, answer_chars: int = 1500) -> Dict[str, object]:
+    """Пропускная способность записи ходов диалога во временную БД.
+
+    legacy — журнал DELETE, synchronous=FULL и два add_message на ход;
+    tuned — настройки db_cfg (по умолчанию WAL, NORMAL) и append_turn.
+    writers потоков пишут по turns ходов в свои диалоги, параллельно
+    читатель запрашивает список диалогов.
+    """
+    results: Dict[str, object] = {"writers": writers, "turns_per_writer": turns}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("legacy", "tuned"):
+            results[mode] = _run(Path(tmp) / f"{mode}.db", mode, writers, turns, answer_chars)
+    legacy, tuned = results["legacy"]["turns_per_s"], results["tuned"]["turns_per_s"]
+    results["speedup"] = tuned / legacy if legacy else 0.0
+    return results
+
+
+_WORDS = (
+    "нормализация таблица индекс запрос транзакция ключ модель обучение выборка признак "
+    "регрессия классификация кластер хранилище репликация шардирование схема атрибут"
+).split()
+
+
+def bench_search(
+    sizes: Tuple[int, ...] = (10000, 100000, 300000), per_user: int = 500, queries: int = 200
+) -> Dict[str, object]:
+    """Латентность полнотекстового поиска пользователя при росте базы.
+
+    У каждого пользователя per_user сообщений в 10 диалогах; база растёт за счёт
+    новых пользователей до sizes сообщений. На каждом размере выполняется
+    queries поисков по двум случайным словам у случайных пользователей.
+    """
+    rng = np.random.default_rng(0)
+    results: Dict[str, object] = {"per_user": per_user}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = make_engine(f"sqlite:///{Path(tmp) / 'search.db'}")
+        init_db(db_engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+        users = 0
+        for size in sizes:
+            conversations = []
+            rows = []
+            with db_engine.begin() as conn:
+                for u in range(users, max(size // per_user, users)):
+                    for c in range(10):
+                        conversations.append(conn.execute(
+                            text("INSERT INTO conversations (user_id, title, conversation_type, created_at, updated_at) "
+                                 "VALUES (:u, :t, 'question', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"),
+                            {"u": f"bench_{u}", "t": f"Диалог {c}"},
+                        ).lastrowid)
+                    for i in range(per_user):
+                        words = rng.choice(_WORDS, size=12)
+                        rows.append({"cid": conversations[-1 - i % 10], "content": " ".join(words)})
+                if rows:
+                    conn.execute(
+                        text("INSERT INTO messages (conversation_id, role, content, timestamp) "
+                             "VALUES (:cid, 'user', :content, CURRENT_TIMESTAMP)"),
+                        rows,
+                    )
+                users = max(size // per_user, users)
+            latencies: List[float] = []
+            with Session() as db:
+                for _ in range(queries):
+                    q = " ".join(rng.choice(_WORDS, size=2))
+                    started = time.perf_counter()
+                    crud.search_conversations(db, f"bench_{int(rng.integers(users))}", q)
+                    latencies.append(time.perf_counter() - started)
+            results[str(size)] = {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+        db_engine.dispose()
+    return results
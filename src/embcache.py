@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .config import embed_cfg, paths
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+_WS = re.compile(r"\s+")
+KEY_BYTES = 16
+FORMAT_VERSION = 2
+
+
+class CacheFormatError(ValueError):
+    """Файлы кэша не согласуются с meta.json."""
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()[:KEY_BYTES]
+
+
+@contextmanager
+def _file_lock(path: Path, shared: bool = False) -> Iterator[None]:
+    """Межпроцессная блокировка на файле: fcntl.flock, в Windows — msvcrt.locking (только исключительная)."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _replace_file(path: Path, write: Callable[[BinaryIO], object]) -> None:
+    """Атомарная запись: временный файл и os.replace."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов на диске, адресуемый по (модель, хэш нормализованного текста).
+
+    Для каждой модели — свой каталог: vectors.f32 (строки float32, читаются
+    через memmap), keys.npy (ключи строк), used.npy (счётчик последнего
+    обращения) и meta.json (размерность, число строк, номер поколения). При
+    превышении max_bytes вытесняются давно не использованные строки.
+
+    Каталог может использоваться несколькими процессами: запись идёт под
+    исключительной блокировкой файла lock, чтение — под разделяемой; перед
+    каждой операцией состояние в памяти сверяется с поколением в meta.json.
+    meta.json записывается последним и служит точкой фиксации. Если размеры
+    файлов не совпадают с meta.json (например, процесс упал посреди записи),
+    кэш считается пустым и при следующей записи создаётся заново.
+    """
+
+    def __init__(self, root: Path, model_name: str, max_bytes: int) -> None:
+        self.model_name = model_name
+        self.dir = Path(root) / hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:12]
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dim: int | None = None
+        self._keys: List[bytes] = []
+        self._used: List[int] = []
+        self._rows: Dict[bytes, int] = {}
+        self._tick = 0
+        self._mmap: np.memmap | None = None
+        # поколение meta.json, которое отражает состояние в памяти; 0 — файлов нет
+        self._generation = 0
+        if self._meta_path.exists():
+            with self._lock, self._locked():
+                self._sync(repair=True)
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.dir / "vectors.f32"
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.dir / "meta.json"
+
+    @contextmanager
+    def _locked(self, shared: bool = False) -> Iterator[None]:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.dir / "lock", shared=shared):
+            yield
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["generation"])
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError, TypeError) as e:
+            raise CacheFormatError(f"Unreadable {self._meta_path}: {e}") from e
+
+    def _read_files(self) -> Tuple[int, np.ndarray, np.ndarray]:
+        """Читает и сверяет файлы кэша; при любом расхождении размеров — CacheFormatError."""
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION or meta.get("model") != self.model_name:
+            raise CacheFormatError(f"Unsupported cache format in {self.dir}")
+        dim, rows = int(meta["dim"]), int(meta["rows"])
+        keys = np.load(self.dir / "keys.npy")
+        used = np.load(self.dir / "used.npy")
+        size = self._vectors_path.stat().st_size
+        if keys.dtype != np.dtype(f"S{KEY_BYTES}") or len(keys) != rows or len(used) != rows:
+            raise CacheFormatError(f"keys.npy/used.npy do not match meta.json in {self.dir}")
+        if dim <= 0 or size != rows * dim * 4:
+            raise CacheFormatError(f"vectors.f32 is {size} bytes, expected {rows} x {dim} float32 in {self.dir}")
+        return dim, keys, used
+
+    def _sync(self, repair: bool = False) -> None:
+        """Подтягивает изменения других процессов; вызывается под файловой блокировкой.
+
+        При repair (исключительная блокировка) несогласованные файлы удаляются.
+        """
+        try:
+            generation = self._read_generation()
+            if generation == self._generation:
+                return
+            own = dict(zip(self._keys, self._used))
+            self._reset()
+            if generation:
+                dim, keys, used = self._read_files()
+                self._dim = dim
+                self._keys = [bytes(k) for k in keys]
+                self._rows = {k: i for i, k in enumerate(self._keys)}
+                # счётчики обращений этого процесса, ещё не сохранённые flush, не теряем
+                self._used = [max(int(u), own.get(k, 0)) for k, u in zip(self._keys, used)]
+                self._tick = max(self._tick, max(self._used, default=0))
+            self._generation = generation
+        except (CacheFormatError, OSError, ValueError, KeyError):
+            self._reset()
+            self._generation = -1
+            if repair:
+                for name in ("meta.json", "keys.npy", "used.npy", "vectors.f32"):
+                    (self.dir / name).unlink(missing_ok=True)
+                self._generation = 0
+
+    def _reset(self) -> None:
+        self._dim = None
+        self._keys, self._used, self._rows = [], [], {}
+        self._mmap = None
+
+    def _commit(self) -> None:
+        """Сохраняет ключи и счётчики, затем meta.json с новым поколением; под исключительной блокировкой."""
+        keys = np.array(self._keys, dtype=f"S{KEY_BYTES}")
+        used = np.asarray(self._used, dtype=np.int64)
+        _replace_file(self.dir / "keys.npy", lambda f: np.save(f, keys))
+        _replace_file(self.dir / "used.npy", lambda f: np.save(f, used))
+        generation = self._generation + 1
+        meta = {
+            "version": FORMAT_VERSION,
+            "model": self.model_name,
+            "dim": self._dim,
+            "rows": len(self._keys),
+            "generation": generation,
+        }
+        _replace_file(self._meta_path, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        self._generation = generation
+
+    def _matrix(self) -> np.ndarray:
+        if self._mmap is None or self._mmap.shape[0] != len(self._keys):
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._keys), self._dim))
+        return self._mmap
+
+    def get_many(self, texts: List[str]) -> Tuple[List[bytes], List[Optional[np.ndarray]]]:
+        """Возвращает ключи и векторы (None для промахов) для списка текстов."""
+        keys = [text_key(t) for t in texts]
+        with self._lock, self._locked(shared=True):
+            self._sync()
+            self._tick += 1
+            out: List[Optional[np.ndarray]] = [None] * len(keys)
+            rows = [self._rows.get(k) for k in keys]
+            found = [i for i, r in enumerate(rows) if r is not None]
+            if found:
+                matrix = self._matrix()
+                for i in found:
+                    out[i] = np.array(matrix[rows[i]])
+                    self._used[rows[i]] = self._tick
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return keys, out
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._locked():
+            # строки, дописанные другими процессами, получают свои номера раньше наших
+            self._sync(repair=True)
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension mismatch: {vectors.shape[1]} != {self._dim}")
+            fresh = []
+            for i, k in enumerate(keys):
+                if k not in self._rows:
+                    self._rows[k] = len(self._keys) + len(fresh)
+                    fresh.append(i)
+            if not fresh:
+                return
+            self._mmap = None
+            with open(self._vectors_path, "ab") as f:
+                # хвост незафиксированной записи упавшего процесса отбрасываем
+                f.truncate(len(self._keys) * 4 * self._dim)
+                f.write(vectors[fresh].tobytes())
+            self._keys.extend(keys[i] for i in fresh)
+            self._used.extend([self._tick] * len(fresh))
+            self._commit()
+
+    def _evict(self) -> None:
+        row_bytes = 4 * (self._dim or 0)
+        if not row_bytes or len(self._keys) * row_bytes <= self.max_bytes:
+            return
+        # оставляем самые свежие строки, заполняя ~90% лимита, чтобы не сжимать файл на каждой записи
+        keep_n = int(self.max_bytes * 0.9) // row_bytes
+        order = np.argsort(np.asarray(self._used), kind="stable")[::-1][:keep_n]
+        keep = np.sort(order)
+        matrix = np.array(self._matrix()[keep]) if len(keep) else np.zeros((0, self._dim), np.float32)
+        self._mmap = None
+        _replace_file(self._vectors_path, lambda f: f.write(matrix.tobytes()))
+        self._keys = [self._keys[i] for i in keep]
+        self._used = [self._used[i] for i in keep]
+        self._rows = {k: i for i, k in enumerate(self._keys)}
+
+    def flush(self) -> None:
+        """Применяет вытеснение и сохраняет счётчики обращений на диск."""
+        with self._lock, self._locked():
+            self._sync(repair=True)
+            if self._dim is None:
+                return
+            self._evict()
+            self._commit()
+
+    def stats(self) -> Dict[str, float | int]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._keys),
+            "size_bytes": len(self._keys) * 4 * (self._dim or 0),
+        }
+
+
+def open_embedding_cache(model_name: str | None = None) -> EmbeddingCache | None:
+    """Открывает кэш эмбеддингов для модели; None, если кэш отключён (EMBEDDINGS_CACHE_MAX_MB=0)."""
+    if embed_cfg.cache_max_mb <= 0:
+        return None
+    root = Path(embed_cfg.cache_dir) if embed_cfg.cache_dir else paths.vector_dir / "embedding_cache"
+    return EmbeddingCache(root, model_name or embed_cfg.model_name, embed_cfg.cache_max_mb * 1024 * 1024)
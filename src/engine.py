@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.language_models import BaseChatModel
+
+from . import metrics
+from .config import context_cfg, paths, retrieval_cfg
+from .context import Candidates, context_totals
+from .embcache import normalize_text, open_embedding_cache
+from .gate import get_gate
+from .ingest import IngestStats, STEmbeddings, update_vector_store
+from .batcher import MicroBatcher
+from .llm import get_chat_llm
+from .qcache import LRUCache
+from .vectordb import VectorDB
+
+
+class RAGEngine:
+    """Общий «тёплый» движок: модель эмбеддингов, VectorDB и чат-LLM на весь процесс.
+
+    Всё инициализируется лениво при первом обращении. Индекс перечитывается
+    автоматически, если файлы в vector_store/ изменились на диске. Эмбеддинги
+    запросов и результаты поиска кэшируются; кэш результатов привязан к версии индекса.
+    Промахи кэша от одновременных запросов собираются в пакеты (MicroBatcher).
+    """
+
+    def __init__(self, vector_dir: Path | None = None, llm: BaseChatModel | None = None) -> None:
+        self.vector_dir = Path(vector_dir or paths.vector_dir)
+        self._lock = threading.RLock()
+        self._embeddings: STEmbeddings | None = None
+        self._index: Tuple[VectorDB, str] | None = None
+        self._llm = llm
+        self._stamp: tuple | None = None
+        self._checked_at = 0.0
+        self._query_cache = LRUCache(retrieval_cfg.query_cache_size)
+        self._result_cache = LRUCache(retrieval_cfg.result_cache_size)
+        self._batcher: MicroBatcher | None = None
+        if retrieval_cfg.batch_window_ms > 0:
+            self._batcher = MicroBatcher(
+                self._compute, retrieval_cfg.batch_window_ms / 1000, retrieval_cfg.batch_max_size
+            )
+
+    @property
+    def embeddings(self) -> STEmbeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = STEmbeddings(cache=open_embedding_cache())
+        return self._embeddings
+
+    @property
+    def llm(self) -> BaseChatModel:
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = get_chat_llm()
+        return self._llm
+
+    def _current(self) -> Tuple[VectorDB, str]:
+        """Текущий индекс и его версия (согласованная пара)."""
+        now = time.monotonic()
+        current = self._index
+        if current is not None and now - self._checked_at < retrieval_cfg.reload_check_interval:
+            return current
+        with self._lock:
+            self._checked_at = now
+            stamp = VectorDB.stamp(self.vector_dir)
+            if self._index is None or stamp != self._stamp:
+                if stamp is None:
+                    VectorDB.check_format(self.vector_dir)
+                    raise FileNotFoundError(
+                        f"Векторное хранилище не найдено в {self.vector_dir}. Выполните: python -m src.cli ingest"
+                    )
+                self._set_index(VectorDB.load(self.vector_dir, self.embeddings), stamp)
+            return self._index
+
+    @property
+    def vdb(self) -> VectorDB:
+        return self._current()[0]
+
+    @property
+    def index_version(self) -> str:
+        return self._current()[1]
+
+    def _set_index(self, vdb: VectorDB | None, stamp: tuple | None) -> None:
+        old = self._index
+        self._stamp = stamp
+        if vdb is None:
+            self._index = None
+        else:
+            self._index = (vdb, hashlib.sha1(repr(stamp).encode()).hexdigest()[:16])
+        self._result_cache.clear()
+        if old is not None and old[0] is not vdb:
+            # соединения со старым chunks.sqlite3 (во всех потоках) больше не нужны
+            old[0].close()
+
+    def embed_query(self, query: str) -> np.ndarray:
+        key = normalize_text(query)
+        vector = self._query_cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            vector.setflags(write=False)
+            self._query_cache.put(key, vector)
+        return vector
+
+    @staticmethod
+    def _result_key(vector: np.ndarray, k: int, version: str) -> tuple:
+        return hashlib.sha1(vector.tobytes()).digest(), k, version
+
+    def _search(self, query: str, k: int) -> Tuple[VectorDB, List[Tuple[int, float]]]:
+        vdb, version = self._current()
+        vector = self._query_cache.get(normalize_text(query))
+        if vector is not None:
+            hits = self._result_cache.get(self._result_key(vector, k, version))
+            if hits is not None:
+                return vdb, hits
+        # эндпоинт — для меток метрик: пакет обрабатывается в потоке MicroBatcher
+        item = (query, k, vector, metrics.current_endpoint())
+        if self._batcher is not None:
+            return self._batcher.submit(item)
+        return self._compute([item])[0]
+
+    def _embed_missing(self, queries: Sequence[str], vectors: List[Optional[np.ndarray]]) -> None:
+        """Дополняет vectors эмбеддингами запросов, которых нет (None): одним вызовом модели."""
+        missing: Dict[str, List[int]] = {}
+        for i, (query, vector) in enumerate(zip(queries, vectors)):
+            if vector is None:
+                missing.setdefault(normalize_text(query), []).append(i)
+        if not missing:
+            return
+        texts = [queries[idx[0]] for idx in missing.values()]
+        fresh = np.asarray(self.embeddings.embed_queries(texts), dtype=np.float32)
+        for (key, idx), row in zip(missing.items(), fresh):
+            vector = row.copy()
+            vector.setflags(write=False)
+            self._query_cache.put(key, vector)
+            for i in idx:
+                vectors[i] = vector
+
+    def embed_queries(self, queries: Sequence[str]) -> List[np.ndarray]:
+        """Эмбеддинги пакета запросов: из кэша, промахи — одним вызовом модели."""
+        vectors: List[Optional[np.ndarray]] = [self._query_cache.get(normalize_text(q)) for q in queries]
+        self._embed_missing(queries, vectors)
+        return vectors
+
+    def _compute(self, items: List[tuple]) -> List[Tuple[VectorDB, List[Tuple[int, float]]]]:
+        """Обрабатывает промахи кэша пакетом: один вызов модели и один поиск FAISS.
+
+        items — четвёрки (запрос, k, эмбеддинг или None, эндпоинт запроса).
+        Время модели и поиска записывается в метрики каждому запросу пакета:
+        столько каждый из них и ждал.
+        """
+        vdb, version = self._current()
+        vectors = [vector for _, _, vector, _ in items]
+        started = time.perf_counter()
+        self._embed_missing([query for query, _, _, _ in items], vectors)
+        embedded = time.perf_counter()
+        k_max = max(k for _, k, _, _ in items)
+        found = vdb.search_by_vectors(np.stack(vectors), k_max)
+        searched = time.perf_counter()
+        for _, _, vector, endpoint in items:
+            if vector is None:
+                metrics.observe_stage("embed_query", embedded - started, endpoint)
+            metrics.observe_stage("search", searched - embedded, endpoint)
+        out = []
+        for (_, k, _, _), vector, hits in zip(items, vectors, found):
+            hits = hits[:k]
+            self._result_cache.put(self._result_key(vector, k, version), hits)
+            out.append((vdb, hits))
+        return out
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Возвращает (row_id чанка, расстояние) для k ближайших чанков с учётом кэша."""
+        return self._search(query, k)[1]
+
+    def retrieve(self, query: str, k: int = 5) -> List[Document]:
+        return [doc for doc, _ in self.retrieve_scored(query, k)]
+
+    def retrieve_scored(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        """Документы вместе с L2-расстоянием до запроса (меньше — ближе), ближайший первым."""
+        vdb, hits = self._search(query, k)
+        docs = vdb.store.get_map([row_id for row_id, _ in hits])
+        return [(docs[row_id], dist) for row_id, dist in hits if row_id in docs]
+
+    @staticmethod
+    def _candidates(
+        vdb: VectorDB, query_vector: np.ndarray, hits: List[Tuple[int, float]], docs: Dict[int, Document]
+    ) -> Candidates:
+        hits = [(row_id, dist) for row_id, dist in hits if row_id in docs]
+        rows = [row_id for row_id, _ in hits]
+        return Candidates(
+            query_vector=query_vector,
+            row_ids=rows,
+            docs=[docs[row_id] for row_id in rows],
+            distances=[dist for _, dist in hits],
+            vectors=vdb.reconstruct(rows) if context_cfg.mmr else None,
+        )
+
+    def candidates(self, query: str, k: int) -> Candidates:
+        """Кандидаты для отбора контекста: документы, расстояния и векторы чанков из индекса."""
+        with metrics.stage("retrieve"):
+            vdb, hits = self._search(query, k)
+            docs = vdb.store.get_map([row_id for row_id, _ in hits])
+            return self._candidates(vdb, self.embed_query(query), hits, docs)
+
+    def candidates_batch(self, queries: Sequence[str], k: int) -> List[Candidates]:
+        """Кандидаты для пакета запросов: один вызов модели эмбеддингов,
+        один поиск FAISS и одно чтение чанков из хранилища (для /ask/batch)."""
+        if not queries:
+            return []
+        with metrics.stage("retrieve"):
+            vdb, _ = self._current()
+            with metrics.stage("embed_query"):
+                vectors = self.embed_queries(queries)
+            with metrics.stage("search"):
+                found = vdb.search_by_vectors(np.stack(vectors), k)
+            docs = vdb.store.get_map(sorted({row_id for hits in found for row_id, _ in hits}))
+            return [self._candidates(vdb, vector, hits, docs) for vector, hits in zip(vectors, found)]
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        stats = {
+            "query_embeddings": self._query_cache.stats(),
+            "retrieval_results": self._result_cache.stats(),
+            "index_version": self._index[1] if self._index else "",
+        }
+        if self._batcher is not None:
+            stats["query_batches"] = self._batcher.stats()
+        stats["relevance_gate"] = get_gate().stats()
+        stats["context"] = context_totals()
+        cache = getattr(self._embeddings, "cache", None)
+        if cache is not None:
+            stats["chunk_embeddings"] = cache.stats()
+        return stats
+
+    def rebuild(self, force_rebuild: bool = False) -> IngestStats:
+        """Обновляет индекс, переиспользуя уже загруженную модель эмбеддингов."""
+        with self._lock, metrics.stage("ingest"):
+            vdb, stats = update_vector_store(force_rebuild=force_rebuild, embeddings=self.embeddings)
+            vdb.close()
+            self._set_index(VectorDB.load(self.vector_dir, self.embeddings), VectorDB.stamp(self.vector_dir))
+            self._checked_at = time.monotonic()
+            return stats
+
+    def reset(self) -> None:
+        """Сбрасывает загруженный индекс; следующий запрос перечитает его с диска."""
+        with self._lock:
+            self._set_index(None, None)
+
+
+_engine: Optional[RAGEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RAGEngine:
+    """Возвращает общий для процесса экземпляр RAGEngine."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RAGEngine()
+    return _engine
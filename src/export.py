@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+
+from .config import db_cfg
+from .database import Conversation, Message, engine
+
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def to_iso(value: Optional[datetime]) -> Optional[str]:
+    """Дата в ISO 8601 для JSON выгрузки и архива; None остаётся None."""
+    return value.isoformat() if value else None
+
+
+def iter_export(
+    user_id: Optional[str] = None,
+    conversation_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    chunk_rows: Optional[int] = None,
+    db_engine=None,
+) -> Iterator[Dict[str, object]]:
+    """Записи выгрузки диалогов: строка диалога, за ней — его сообщения по времени.
+
+    Один запрос conversations LEFT JOIN messages в порядке (id диалога, время,
+    id сообщения) — SQLite отдаёт его по индексам без сортировки, — читается
+    курсором порциями по chunk_rows строк, поэтому память не зависит от объёма.
+    Фильтр по датам — по created_at диалога, как в списке диалогов.
+    """
+    stmt = (
+        select(
+            Conversation.id,
+            Conversation.user_id,
+            Conversation.title,
+            Conversation.conversation_type,
+            Conversation.created_at,
+            Conversation.updated_at,
+            Message.id,
+            Message.role,
+            Message.content,
+            Message.timestamp,
+        )
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .order_by(Conversation.id, Message.timestamp, Message.id)
+    )
+    if user_id:
+        stmt = stmt.where(Conversation.user_id == user_id)
+    if conversation_type:
+        stmt = stmt.where(Conversation.conversation_type == conversation_type)
+    if date_from:
+        stmt = stmt.where(Conversation.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(Conversation.created_at <= date_to)
+
+    chunk_rows = chunk_rows or db_cfg.export_chunk_rows
+    with (db_engine or engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt)
+        current = None
+        for conv_id, owner, title, kind, created_at, updated_at, message_id, role, content, timestamp in result:
+            if conv_id != current:
+                current = conv_id
+                yield {
+                    "record": "conversation",
+                    "id": conv_id,
+                    "user_id": owner,
+                    "title": title,
+                    "type": kind,
+                    "created_at": to_iso(created_at),
+                    "updated_at": to_iso(updated_at),
+                }
+            if message_id is not None:
+                yield {
+                    "record": "message",
+                    "conversation_id": conv_id,
+                    "id": message_id,
+                    "role": role,
+                    "content": content,
+                    "timestamp": to_iso(timestamp),
+                }
+
+
+def ndjson_chunks(
+    records: Iterable[Dict[str, object]], compress: bool = False, chunk_bytes: int = 1 << 16
+) -> Iterator[bytes]:
+    """NDJSON по записям, порциями около chunk_bytes; compress — поток gzip."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray()
+    for record in records:
+        buffer += _encode(record).encode("utf-8")
+        buffer += b"\n"
+        if len(buffer) >= chunk_bytes:
+            data = gz.compress(bytes(buffer)) if gz else bytes(buffer)
+            buffer.clear()
+            if data:
+                yield data
+    tail = gz.compress(bytes(buffer)) + gz.flush() if gz else bytes(buffer)
+    if tail:
+        yield tail
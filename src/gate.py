@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import embed_cfg, paths, retrieval_cfg
+
+
+REFUSAL_TEXT = "Такой информации нет в предоставленных материалах. Попробуйте задать другой вопрос"
+
+GATE_NAME = "gate.json"
+
+
+class RelevanceGate:
+    """Фильтр релевантности перед генерацией.
+
+    Если даже ближайший чанк дальше max_distance (L2 между эмбеддингами),
+    запрос считается не относящимся к материалам, и вместо вызова LLM
+    сразу возвращается REFUSAL_TEXT. max_distance=None — фильтр выключен.
+    """
+
+    def __init__(self, max_distance: Optional[float] = None) -> None:
+        self.max_distance = max_distance
+        self.checked = 0
+        self.refused = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_distance is not None
+
+    def allows(self, hits: Sequence[Tuple[object, float]]) -> bool:
+        """hits — результаты поиска (что угодно, расстояние), ближайший первым."""
+        if not self.enabled:
+            return True
+        self.checked += 1
+        if hits and hits[0][1] <= self.max_distance:
+            return True
+        self.refused += 1
+        return False
+
+    def stats(self) -> Dict[str, object]:
+        return {"max_distance": self.max_distance, "checked": self.checked, "refused": self.refused}
+
+
+def gate_path(vector_dir: Path | None = None) -> Path:
+    return Path(vector_dir or paths.vector_dir) / GATE_NAME
+
+
+def read_threshold(vector_dir: Path | None = None) -> Optional[float]:
+    """Порог из RELEVANCE_MAX_DISTANCE или из откалиброванного gate.json.
+
+    Калибровка действительна только для той модели эмбеддингов, с которой
+    она выполнялась; для другой модели фильтр выключается.
+    """
+    if retrieval_cfg.relevance_max_distance:
+        return float(retrieval_cfg.relevance_max_distance)
+    try:
+        with open(gate_path(vector_dir), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get("model") != embed_cfg.model_name:
+        return None
+    return float(data["max_distance"])
+
+
+def calibrate(
+    relevant: Sequence[float],
+    irrelevant: Sequence[float],
+    target_recall: float = 0.98,
+) -> Dict[str, float | int]:
+    """Подбирает порог по расстояниям до ближайшего чанка у размеченных запросов.
+
+    Порог пропускает не меньше target_recall релевантных запросов; если выше
+    него до первого нерелевантного есть зазор, порог ставится в его середину.
+    """
+    rel = np.sort(np.asarray(relevant, dtype=np.float64))
+    irr = np.sort(np.asarray(irrelevant, dtype=np.float64))
+    if not len(rel):
+        raise ValueError("Нужен хотя бы один релевантный пример")
+    threshold = float(np.quantile(rel, target_recall, method="higher"))
+    above = irr[irr > threshold]
+    if len(above):
+        upper = rel[rel > threshold]
+        nearest = min(above[0], upper[0]) if len(upper) else above[0]
+        threshold = (threshold + float(nearest)) / 2
+    return {
+        "max_distance": threshold,
+        "relevant": int(len(rel)),
+        "irrelevant": int(len(irr)),
+        "relevant_passed": float(np.mean(rel <= threshold)),
+        "irrelevant_refused": float(np.mean(irr > threshold)) if len(irr) else 0.0,
+    }
+
+
+def save_calibration(result: Dict[str, float | int], vector_dir: Path | None = None) -> Path:
+    path = gate_path(vector_dir)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"model": embed_cfg.model_name, **result}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def load_examples(path: Path) -> List[Tuple[str, bool]]:
+    """Читает JSONL вида {"query": "...", "relevant": true}."""
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["query"], bool(row["relevant"])))
+    return examples
+
+
+_gate: Optional[RelevanceGate] = None
+_gate_mtime: Optional[int] = None
+_gate_lock = threading.Lock()
+
+
+def get_gate() -> RelevanceGate:
+    """Общий фильтр; перечитывается, если gate.json изменился после калибровки."""
+    global _gate, _gate_mtime
+    try:
+        mtime = gate_path().stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _gate is None or mtime != _gate_mtime:
+        with _gate_lock:
+            if _gate is None or mtime != _gate_mtime:
+                _gate = RelevanceGate(read_threshold())
+                _gate_mtime = mtime
+    return _gate
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from . import crud, metrics
+from .config import prompt_cfg
+from .database import SessionLocal
+from .llm import history_to_messages, invoke, response_text
+from .qcache import LRUCache
+
+
+SUMMARY_SYSTEM = (
+    "Ты ведёшь конспект диалога студента с ИИ-преподавателем курса "
+    "\"Хранение данных и Введение в Машинное обучение\".\n"
+    "Сожми диалог в краткую сводку: какие темы обсуждались, что спрашивал студент, "
+    "к каким выводам пришли, на чём остановились. Не добавляй ничего, чего не было в диалоге. "
+    "Пиши сплошным текстом, без приветствий и оценок, не длиннее {words} слов."
+)
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+# служебные токены на одно сообщение в чат-шаблоне модели
+MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text: str) -> int:
+    """Оценка числа токенов по длине текста (без токенизатора модели)."""
+    return math.ceil(len(text) / prompt_cfg.chars_per_token) if text else 0
+
+
+def message_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(count_tokens(m.content) + MESSAGE_OVERHEAD for m in messages)
+
+
+def _history_tokens(history: Sequence[Dict[str, str]]) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in history)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    limit = int(max_tokens * prompt_cfg.chars_per_token)
+    return text if len(text) <= limit else text[:max(limit - 1, 0)] + "…"
+
+
+def _update_digest(h, msg: Dict[str, str]) -> None:
+    h.update(msg["role"].encode())
+    h.update(b"\x00")
+    h.update(msg["content"].encode())
+    h.update(b"\x01")
+
+
+def _digest(history: Sequence[Dict[str, str]]) -> str:
+    h = hashlib.sha1()
+    for msg in history:
+        _update_digest(h, msg)
+    return h.hexdigest()
+
+
+@dataclass
+class SummaryState:
+    summary: str = ""
+    upto: int = 0  # сколько первых сообщений истории свёрнуто в summary
+    digest: str = ""  # хэш этих сообщений — проверка, что история та же
+
+
+class HistoryManager:
+    """Укладывает историю диалога в бюджет токенов.
+
+    Последние ходы идут в промпт дословно, более ранние сворачиваются в сводку.
+    Сводка хранится в диалоге (или, без conversation_id, в LRU-кэше процесса)
+    и обновляется только когда дословная часть перерастает бюджет: тогда старые
+    ходы дописываются в сводку, пока дословной части не останется половина
+    бюджета. Так вызов модели для сводки нужен раз в несколько ходов.
+    """
+
+    def __init__(self, budget: int | None = None, summary_tokens: int | None = None) -> None:
+        self.budget = budget if budget is not None else prompt_cfg.history_budget
+        self.summary_tokens = summary_tokens if summary_tokens is not None else prompt_cfg.summary_max_tokens
+        self.summaries = 0
+        self._states = LRUCache(1024)
+
+    def _anon_state(self, history: Sequence[Dict[str, str]]) -> Optional[SummaryState]:
+        """Сводка без conversation_id: ключ кэша — хэш свёрнутых ходов.
+
+        Берётся самая длинная сводка, свёрнутое начало которой совпадает с
+        началом history; диалоги с одинаковым первым сообщением не мешают друг другу.
+        """
+        h = hashlib.sha1()
+        found = None
+        for msg in history:
+            _update_digest(h, msg)
+            state = self._states.get(h.hexdigest())
+            if state is not None:
+                found = state
+        return found
+
+    def _load(self, history: Sequence[Dict[str, str]], conversation_id: Optional[int]) -> SummaryState:
+        state: Optional[SummaryState] = None
+        if conversation_id is not None:
+            db = SessionLocal()
+            try:
+                conv = crud.get_conversation(db, conversation_id)
+                if conv is not None and conv.summary:
+                    state = SummaryState(conv.summary, conv.summary_upto or 0, conv.summary_hash or "")
+            finally:
+                db.close()
+        else:
+            state = self._anon_state(history)
+        # сводка годится, только если свёрнутое начало истории не изменилось
+        if state is None or state.upto > len(history) or _digest(history[:state.upto]) != state.digest:
+            return SummaryState()
+        return state
+
+    def _save(self, history: Sequence[Dict[str, str]], conversation_id: Optional[int], state: SummaryState) -> None:
+        if conversation_id is not None:
+            db = SessionLocal()
+            try:
+                crud.update_conversation_summary(db, conversation_id, state.summary, state.upto, state.digest)
+            finally:
+                db.close()
+        else:
+            self._states.put(state.digest, state)
+
+    def _summarize(self, llm: BaseChatModel, previous: str, turns: Sequence[Dict[str, str]]) -> str:
+        words = max(int(self.summary_tokens * prompt_cfg.chars_per_token / 7), 30)
+        lines = [
+            f"{'Студент' if m['role'] == 'user' else 'Преподаватель'}: {m['content']}" for m in turns
+        ]
+        prompt = ""
+        if previous:
+            prompt += f"Сводка более ранней части диалога:\n{previous}\n\n"
+        prompt += "Продолжение диалога:\n" + "\n\n".join(lines) + "\n\nОбновлённая сводка:"
+        messages = [SystemMessage(content=SUMMARY_SYSTEM.format(words=words)), HumanMessage(content=prompt)]
+        # из рабочего потока — через общий ограничитель; Overloaded обрабатывает вызывающий
+        response = invoke(llm, messages, stage="summary", limited=True)
+        self.summaries += 1
+        return truncate_to_tokens(response_text(response).strip(), self.summary_tokens)
+
+    def prepare(
+        self,
+        history: Optional[List[Dict[str, str]]],
+        llm: BaseChatModel,
+        conversation_id: Optional[int] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """Возвращает (сводка ранних ходов, последние ходы дословно).
+
+        Если history не передана, а conversation_id есть, история берётся из БД.
+        """
+        if history is None and conversation_id is not None:
+            return self.prepare_stored(conversation_id, llm)
+        history = [m for m in history or [] if m.get("role") in ("user", "assistant")]
+        if not history:
+            return "", []
+        state = self._load(history, conversation_id)
+        cut = self._fold_point(history[state.upto:])
+        if cut:
+            try:
+                summary = self._summarize(llm, state.summary, history[state.upto:state.upto + cut])
+            except Exception:
+                # модель недоступна или очередь к ней переполнена — отбрасываем старые ходы, не сохраняя сводку
+                return state.summary, self._fit(history[state.upto + cut:])
+            upto = state.upto + cut
+            state = SummaryState(summary, upto, _digest(history[:upto]))
+            self._save(history, conversation_id, state)
+        return state.summary, self._fit(history[state.upto:])
+
+    def prepare_stored(self, conversation_id: int, llm: BaseChatModel) -> Tuple[str, List[Dict[str, str]]]:
+        """То же для истории из БД: читаются только сообщения после уже свёрнутых в сводку.
+
+        Сообщения в БД не меняются, поэтому хэш свёрнутого начала не проверяется.
+        """
+        db = SessionLocal()
+        try:
+            conv = crud.get_conversation(db, conversation_id)
+            if conv is None:
+                return "", []
+            state = SummaryState(conv.summary or "", conv.summary_upto or 0, conv.summary_hash or "")
+            tail = [
+                {"role": role, "content": content}
+                for role, content in crud.get_history_messages(db, conversation_id, offset=state.upto)
+            ]
+        finally:
+            db.close()
+        cut = self._fold_point(tail)
+        if cut:
+            try:
+                summary = self._summarize(llm, state.summary, tail[:cut])
+            except Exception:
+                return state.summary, self._fit(tail[cut:])
+            state = SummaryState(summary, state.upto + cut, "")
+            self._save([], conversation_id, state)
+            tail = tail[cut:]
+        return state.summary, self._fit(tail)
+
+    def _fold_point(self, tail: List[Dict[str, str]]) -> int:
+        """Сколько первых сообщений tail свернуть в сводку (0 — дословная часть влезает в бюджет).
+
+        Сворачиваем до половины бюджета, оставляя хотя бы последний ход.
+        """
+        if _history_tokens(tail) <= self.budget:
+            return 0
+        cut = 0
+        while len(tail) - cut > 2 and _history_tokens(tail[cut:]) > self.budget // 2:
+            cut += 1
+        return cut
+
+    def _fit(self, tail: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Обрезает слишком длинные сообщения, если даже последний ход не влезает в бюджет."""
+        if _history_tokens(tail) <= self.budget:
+            return tail
+        per_message = max(self.budget // len(tail) - MESSAGE_OVERHEAD, 1)
+        return [{**m, "content": truncate_to_tokens(m["content"], per_message)} for m in tail]
+
+
+@dataclass
+class Prompt:
+    messages: List[BaseMessage]
+    context: Dict[str, int] = field(default_factory=dict)  # статистика отбора контекста
+
+
+def build_prompt_messages(
+    system: str,
+    history: Optional[List[Dict[str, str]]],
+    select: Callable[[int], Tuple[str, Dict[str, int]]],
+    render: Callable[[str], str],
+    llm: BaseChatModel,
+    conversation_id: Optional[int] = None,
+) -> Prompt:
+    """Собирает промпт в пределах окна контекста модели.
+
+    render(context) возвращает текст последнего сообщения пользователя с
+    подставленным контекстом. История укладывается в свой бюджет;
+    select(budget) отбирает контекст в то, что осталось от окна после
+    системного промпта, истории, запроса и резерва под ответ, и возвращает
+    текст контекста и статистику отбора.
+    """
+    summary, recent = get_history_manager().prepare(history, llm, conversation_id)
+    with metrics.stage("prompt"):
+        messages: List[BaseMessage] = [SystemMessage(content=system)]
+        if summary:
+            messages.append(SystemMessage(content=SUMMARY_PREFIX + summary))
+        messages.extend(history_to_messages(recent))
+        used = message_tokens(messages) + count_tokens(render("")) + MESSAGE_OVERHEAD
+        budget = prompt_cfg.context_window - prompt_cfg.answer_reserve - used
+        context, stats = select(budget)
+        messages.append(HumanMessage(content=render(context)))
+    return Prompt(messages, stats)
+
+
+_manager: Optional[HistoryManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_history_manager() -> HistoryManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = HistoryManager()
+    return _manager
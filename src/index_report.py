@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from .bench import percentile_ms
+from .vectordb import VectorDB, describe_index
+
+
+def _timed_search(index, queries: np.ndarray, k: int):
+    # по одному запросу — так латентность соответствует обработке /ask
+    latencies: List[float] = []
+    labels = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, found = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - started)
+        labels[i] = found[0]
+    return labels, latencies
+
+
+def index_report(
+    vdb: VectorDB,
+    embeddings,
+    k: int = 5,
+    n_queries: int = 200,
+    questions: Optional[List[str]] = None,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Сравнивает текущий индекс с точным поиском: recall@k и латентность p50/p99.
+
+    Точные векторы чанков берутся через embeddings (обычно из кэша эмбеддингов),
+    поэтому отчёт корректен и для сжатых индексов (PQ). Запросы — переданные
+    вопросы или случайная выборка чанков корпуса.
+    """
+    rows, texts = [], []
+    for row_id, content in vdb.store.iter_contents():
+        rows.append(row_id)
+        texts.append(content)
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    exact = faiss.IndexIDMap(faiss.IndexFlatL2(vectors.shape[1]))
+    exact.add_with_ids(vectors, np.asarray(rows, dtype=np.int64))
+
+    if questions:
+        queries = np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(seed)
+        picked = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+        queries = vectors[np.sort(picked)]
+    k = min(k, len(vectors))
+
+    exact_labels, exact_lat = _timed_search(exact, queries, k)
+    approx_labels, approx_lat = _timed_search(vdb.index, queries, k)
+    # метки в обоих индексах — row_id чанков
+    recall = float(np.mean([
+        len(set(a[a != -1].tolist()) & set(e.tolist())) / k
+        for a, e in zip(approx_labels, exact_labels)
+    ]))
+    return {
+        "index": describe_index(vdb.index),
+        "vectors": int(len(vectors)),
+        "queries": int(len(queries)),
+        "k": k,
+        f"recall@{k}": recall,
+        "latency_ms": {
+            "index": {"p50": percentile_ms(approx_lat, 50), "p99": percentile_ms(approx_lat, 99)},
+            "exact": {"p50": percentile_ms(exact_lat, 50), "p99": percentile_ms(exact_lat, 99)},
+        },
+    }
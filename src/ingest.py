@@ -1,34 +1,51 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Tuple
 
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from langchain_core.embeddings import Embeddings
 from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
 
-from .config import paths, embed_cfg, chunk_cfg, ensure_dirs
-from .vectordb import VectorDB
+from . import metrics
+from .config import paths, embed_cfg, chunk_cfg, index_cfg, ensure_dirs
+from .embcache import EmbeddingCache, open_embedding_cache
+from .vectordb import VectorDB, describe_index
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
 
 
 def _iter_source_files(data_dir: Path) -> Iterable[Path]:
     for ext in ("*.pdf", "*.docx"):
-        yield from data_dir.glob(ext)
+        yield from sorted(data_dir.glob(ext))
+
+
+def load_file(file_path: Path) -> List[Document]:
+    if file_path.suffix.lower() == ".pdf":
+        loader = PyPDFLoader(str(file_path))
+    elif file_path.suffix.lower() == ".docx":
+        loader = Docx2txtLoader(str(file_path))
+    else:
+        return []
+    return loader.load()
 
 
 def load_documents(data_dir: Path | None = None) -> List[Document]:
     data_dir = data_dir or paths.data_dir
     docs: List[Document] = []
     for file_path in _iter_source_files(data_dir):
-        if file_path.suffix.lower() == ".pdf":
-            loader = PyPDFLoader(str(file_path))
-        elif file_path.suffix.lower() == ".docx":
-            loader = Docx2txtLoader(str(file_path))
-        else:
-            continue
-        docs.extend(loader.load())
+        docs.extend(load_file(file_path))
     return docs
 
 
@@ -41,46 +58,263 @@ def split_documents(documents: List[Document]) -> List[Document]:
     return splitter.split_documents(documents)
 
 
+def file_hash(file_path: Path) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_file(file_path: Path, digest: str, name: str | None = None) -> Tuple[List[str], List[Document]]:
+    """Разбирает файл на чанки и присваивает им стабильные id вида <путь>:<hash>:<номер>.
+
+    Хэш пути (name — путь относительно каталога данных) различает
+    побайтно одинаковые файлы, иначе их чанки получили бы одни и те же id.
+    """
+    chunks = split_documents(load_file(file_path))
+    prefix = hashlib.sha1((name or file_path.name).encode("utf-8")).hexdigest()[:8]
+    ids = []
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["file_hash"] = digest
+        chunk.metadata["chunk_index"] = i
+        ids.append(f"{prefix}:{digest[:16]}:{i}")
+    return ids, chunks
+
+
+def _chunk_file_job(job: Tuple[Path, str, str]) -> Tuple[List[str], List[Document]]:
+    return chunk_file(*job)
+
+
+def chunk_files(jobs: List[Tuple[Path, str, str]]) -> List[Tuple[List[str], List[Document]]]:
+    """Разбирает файлы в пуле процессов; порядок результата совпадает с порядком jobs."""
+    workers = chunk_cfg.parse_workers or os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return [_chunk_file_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_chunk_file_job, jobs))
+
+
 def get_embeddings_model():
     # SentenceTransformer runs fully local once the model is downloaded
     return SentenceTransformer(embed_cfg.model_name)
 
 
-def build_vector_store(force_rebuild: bool = True) -> VectorDB:
+class STEmbeddings(Embeddings):
+    """Обёртка SentenceTransformer под интерфейс Embeddings из langchain."""
+
+    def __init__(
+        self,
+        model: SentenceTransformer | None = None,
+        show_progress: bool = False,
+        cache: EmbeddingCache | None = None,
+    ) -> None:
+        self.model = model or get_embeddings_model()
+        self.show_progress = show_progress
+        self.cache = cache
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Кодирует тексты блоками фиксированного размера, при необходимости в пуле процессов.
+
+        Блоки одинаковы при любом числе процессов, поэтому и векторы совпадают.
+        """
+        block = embed_cfg.batch_size * embed_cfg.block_batches
+        if embed_cfg.num_workers > 1 and len(texts) > block:
+            pool = self.model.start_multi_process_pool(target_devices=["cpu"] * embed_cfg.num_workers)
+            try:
+                return self.model.encode_multi_process(
+                    texts, pool, batch_size=embed_cfg.batch_size, chunk_size=block,
+                    show_progress_bar=self.show_progress,
+                )
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        starts = range(0, len(texts), block)
+        if self.show_progress and len(texts) > block:
+            starts = tqdm(starts, desc="Embedding", unit="block")
+        parts = [self.model.encode(texts[i:i + block], batch_size=embed_cfg.batch_size) for i in starts]
+        if not parts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack(parts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.stage("embed_documents"):
+            if self.cache is None:
+                return self.encode(texts).tolist()
+            # кодируем только промахи кэша
+            keys, cached = self.cache.get_many(texts)
+            missing = [i for i, v in enumerate(cached) if v is None]
+            if missing:
+                fresh = self.encode([texts[i] for i in missing])
+                self.cache.put_many([keys[i] for i in missing], fresh)
+                self.cache.flush()
+                for i, vec in zip(missing, fresh):
+                    cached[i] = vec
+            return [v.tolist() for v in cached]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.encode([text], batch_size=1).tolist()[0]
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Кодирует пакет запросов одним вызовом модели."""
+        return self.model.encode(texts, batch_size=max(1, len(texts)))
+
+
+@dataclass
+class IngestStats:
+    full_rebuild: bool = False
+    files_added: int = 0
+    files_changed: int = 0
+    files_removed: int = 0
+    files_unchanged: int = 0
+    chunks_added: int = 0
+    chunks_removed: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    index: str = ""
+
+    def as_dict(self) -> Dict[str, int | bool | str]:
+        return asdict(self)
+
+
+def _index_settings() -> Dict[str, object]:
+    # при смене модели, параметров нарезки или структуры индекса инкрементальное
+    # обновление невозможно; nprobe/efSearch применяются при загрузке и не в счёт
+    return {
+        "embeddings_model": embed_cfg.model_name,
+        "chunk_size": chunk_cfg.chunk_size,
+        "chunk_overlap": chunk_cfg.chunk_overlap,
+        "index": {
+            "type": index_cfg.index_type,
+            "nlist": index_cfg.nlist,
+            "hnsw_m": index_cfg.hnsw_m,
+            "ef_construction": index_cfg.ef_construction,
+            "pq_m": index_cfg.pq_m,
+            "pq_nbits": index_cfg.pq_nbits,
+        },
+    }
+
+
+def load_manifest(vector_dir: Path | None = None) -> Dict | None:
+    path = Path(vector_dir or paths.vector_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(files: Dict[str, Dict], vector_dir: Path | None = None) -> None:
+    path = Path(vector_dir or paths.vector_dir) / MANIFEST_NAME
+    manifest = {"version": MANIFEST_VERSION, "settings": _index_settings(), "files": files}
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp.replace(path)
+
+
+def update_vector_store(
+    force_rebuild: bool = False,
+    embeddings: Embeddings | None = None,
+) -> Tuple[VectorDB, IngestStats]:
+    """Обновляет индекс: разбирает и эмбеддит только новые и изменённые файлы.
+
+    Чанки удалённых и изменённых файлов удаляются из индекса по id. При
+    force_rebuild, отсутствии манифеста или смене настроек индекс строится заново.
+    """
     ensure_dirs()
-    raw_docs = load_documents(paths.data_dir)
-    if not raw_docs:
+    embeddings = embeddings or STEmbeddings(show_progress=True, cache=open_embedding_cache())
+    cache = getattr(embeddings, "cache", None)
+    hits0, misses0 = (cache.hits, cache.misses) if cache else (0, 0)
+    current = {p.name: (p, file_hash(p)) for p in _iter_source_files(paths.data_dir)}
+    if not current:
         raise RuntimeError(f"No documents found in {paths.data_dir}. Add .pdf or .docx files.")
-    chunks = split_documents(raw_docs)
 
-    model = get_embeddings_model()
+    manifest = load_manifest()
+    full = (
+        force_rebuild
+        or manifest is None
+        or manifest.get("settings") != _index_settings()
+        or VectorDB.stamp(paths.vector_dir) is None
+    )
+    stats = IngestStats(full_rebuild=full)
+    old_files: Dict[str, Dict] = {} if full else manifest["files"]
+
+    new_files: Dict[str, Dict] = {}
+    to_remove: List[str] = []
+    jobs: List[Tuple[str, Path, str]] = []
+    for name, (file_path, digest) in current.items():
+        entry = old_files.get(name)
+        if entry is not None and entry["sha256"] == digest:
+            new_files[name] = entry
+            stats.files_unchanged += 1
+            continue
+        if entry is None:
+            stats.files_added += 1
+        else:
+            stats.files_changed += 1
+            to_remove.extend(entry["chunk_ids"])
+        jobs.append((name, file_path, digest))
 
-    class STEmbeddings(Embeddings):
-        def embed_documents(self, texts: List[str]) -> List[List[float]]:
-            return model.encode(texts, batch_size=embed_cfg.batch_size, show_progress_bar=True).tolist()
+    for name, entry in old_files.items():
+        if name not in current:
+            stats.files_removed += 1
+            to_remove.extend(entry["chunk_ids"])
 
-        def embed_query(self, text: str) -> List[float]:
-            return model.encode([text], batch_size=1).tolist()[0]
+    vdb = None
+    if not full:
+        vdb = VectorDB.load(paths.vector_dir, embeddings, writable=True)
+        if not to_remove and not jobs:
+            stats.index = describe_index(vdb.index)
+            return vdb, stats
+        if to_remove and not vdb.supports_delete:
+            # HNSW собираем заново; эмбеддинги берутся из кэша
+            vdb.close()
+            return update_vector_store(force_rebuild=True, embeddings=embeddings)
 
-    vdb = VectorDB.from_documents(chunks, STEmbeddings(), paths.vector_dir)
-    vdb.save()
-    return vdb
+    add_ids: List[str] = []
+    add_chunks: List[Document] = []
+    with metrics.stage("ingest_parse"):
+        parsed = chunk_files([(file_path, digest, name) for name, file_path, digest in jobs])
+    for (name, _, digest), (ids, chunks) in zip(jobs, parsed):
+        new_files[name] = {"sha256": digest, "chunk_ids": ids}
+        add_ids.extend(ids)
+        add_chunks.extend(chunks)
 
+    if vdb is None and not add_chunks:
+        # все файлы пустые (например, PDF из одних картинок) — строить индекс не из чего
+        raise RuntimeError(f"No documents found in {paths.data_dir}: no text could be extracted from the files.")
+    with metrics.stage("ingest_index"):
+        if vdb is None:
+            vdb = VectorDB.from_documents(add_chunks, embeddings, paths.vector_dir, ids=add_ids)
+        else:
+            vdb.delete(to_remove)
+            vdb.add_documents(add_chunks, ids=add_ids)
+    metrics.INGEST_CHUNKS.inc("added", amount=len(add_chunks))
+    metrics.INGEST_CHUNKS.inc("removed", amount=len(to_remove))
+    stats.chunks_added = len(add_chunks)
+    stats.chunks_removed = len(to_remove)
+    stats.index = describe_index(vdb.index)
+    if cache:
+        stats.cache_hits = cache.hits - hits0
+        stats.cache_misses = cache.misses - misses0
+    with metrics.stage("ingest_save"):
+        vdb.save()
+        save_manifest(new_files)
+    return vdb, stats
 
-def load_vector_store() -> VectorDB:
-    model = get_embeddings_model()
 
-    class STEmbeddings(Embeddings):
-        def embed_documents(self, texts: List[str]) -> List[List[float]]:
-            return model.encode(texts, batch_size=embed_cfg.batch_size, show_progress_bar=False).tolist()
+def build_vector_store(force_rebuild: bool = False, embeddings: Embeddings | None = None) -> VectorDB:
+    vdb, _ = update_vector_store(force_rebuild=force_rebuild, embeddings=embeddings)
+    return vdb
 
-        def embed_query(self, text: str) -> List[float]:
-            return model.encode([text], batch_size=1).tolist()[0]
 
-    return VectorDB.load(paths.vector_dir, STEmbeddings())
+def load_vector_store(embeddings: Embeddings | None = None) -> VectorDB:
+    return VectorDB.load(paths.vector_dir, embeddings or STEmbeddings())
 
 
 if __name__ == "__main__":
     build_vector_store()
     print("Vector store built at:", paths.vector_dir)
-
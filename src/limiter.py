@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from .config import llm_cfg
+
+
+class Overloaded(Exception):
+    """Очередь к LLM переполнена или ожидание слота превысило таймаут."""
+
+
+class ConcurrencyLimiter:
+    """Ограничивает число одновременных запросов к LLM и длину очереди ожидания.
+
+    Запрос, пришедший при заполненной очереди, сразу получает Overloaded;
+    запрос, не дождавшийся слота за wait_timeout секунд, — тоже. Синхронный
+    код из рабочих потоков (asyncio.to_thread) занимает слот через thread_slot.
+    """
+
+    def __init__(self, max_concurrency: int, max_waiting: int, wait_timeout: float) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.last_activity = time.monotonic()
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Цикл событий сервера, в котором ждут слота вызовы из рабочих потоков."""
+        self._loop = loop
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    async def acquire(self) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        sem = self._semaphore()
+        if sem.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded("Слишком много запросов к модели, повторите позже")
+        self.waiting += 1
+        try:
+            # не wait_for: в Python 3.11 он может снять ожидание уже после того,
+            # как семафор захвачен, и слот теряется навсегда. Отмена внутри
+            # asyncio.timeout доходит до Semaphore.acquire, и тот возвращает слот сам.
+            async with asyncio.timeout(self.wait_timeout):
+                await sem.acquire()
+        except TimeoutError:
+            self.rejected += 1
+            raise Overloaded("Модель занята: истекло время ожидания в очереди")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.last_activity = time.monotonic()
+
+    def release(self) -> None:
+        self.active -= 1
+        self.last_activity = time.monotonic()
+        self._semaphore().release()
+
+    def idle_for(self) -> float:
+        """Сколько секунд нет ни активных, ни ожидающих запросов (0 — если есть)."""
+        if self.active or self.waiting:
+            return 0.0
+        return time.monotonic() - self.last_activity
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def thread_slot(self) -> Iterator[None]:
+        """Слот для синхронного вызова модели из рабочего потока сервера.
+
+        Ожидание идёт в цикле событий, которому принадлежит семафор, поэтому
+        очередь и лимит общие с асинхронными запросами. Вне сервера (CLI,
+        скрипты) цикла нет, и вызов не ограничивается.
+        """
+        loop = self._loop
+        try:
+            asyncio.get_running_loop()
+            in_loop = True
+        except RuntimeError:
+            in_loop = False
+        if loop is None or in_loop or not loop.is_running():
+            yield
+            return
+        asyncio.run_coroutine_threadsafe(self.acquire(), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self.release)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+_llm_limiter: Optional[ConcurrencyLimiter] = None
+
+
+def get_llm_limiter() -> ConcurrencyLimiter:
+    """Общий для процесса ограничитель запросов к Ollama."""
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = ConcurrencyLimiter(llm_cfg.max_concurrency, llm_cfg.max_queue, llm_cfg.queue_timeout)
+    return _llm_limiter
@@ -1,47 +1,252 @@
 from __future__ import annotations
 
-import socket
-from typing import Optional
-from urllib.parse import urlparse
+import threading
+import time
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
+import httpx
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain_ollama import ChatOllama  # type: ignore
 
-from .config import llm_cfg
+from . import metrics
+from .config import llm_cfg, prompt_cfg
+from .limiter import get_llm_limiter
 
 
-def _check_ollama_available(base_url: str = "http://localhost:11434") -> bool:
-    """Проверяет доступность Ollama сервера."""
-    try:
-        parsed = urlparse(base_url)
-        host = parsed.hostname or "localhost"
-        port = parsed.port or 11434
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        result = sock.connect_ex((host, port))
-        sock.close()
-        return result == 0
-    except Exception:
-        return False
+class OllamaUnavailable(ConnectionError):
+    """Ollama не отвечает (по данным фоновой проверки)."""
 
 
-def get_chat_llm() -> BaseChatModel:
-    """Возвращает настроенную модель Ollama."""
+class OllamaHealth:
+    """Фоновая проверка доступности Ollama с закэшированным состоянием.
+
+    Раз в interval секунд запрашивает /api/ps: ответил сервер — available,
+    модель есть среди загруженных — model_loaded. Запросы к API смотрят только
+    на сохранённое состояние и соединений для проверки не открывают. Без
+    фонового потока (CLI) проверка выполняется один раз при первом обращении.
+    """
+
+    def __init__(self, base_url: str, model: str, interval: float) -> None:
+        self.base_url = base_url
+        self.model = model
+        self.interval = interval
+        self.available: Optional[bool] = None
+        self.model_loaded = False
+        self.error = ""
+        self.checked_at = 0.0
+        self.latency_ms = 0.0
+        self.warmup_ms: Optional[float] = None
+        self._http = httpx.Client(base_url=base_url, timeout=2.0)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        started = time.perf_counter()
+        try:
+            resp = self._http.get("/api/ps")
+            resp.raise_for_status()
+            loaded = resp.json().get("models") or []
+            self.model_loaded = any(self.model in (m.get("name"), m.get("model")) for m in loaded)
+            self.available = True
+            self.error = ""
+        except (httpx.HTTPError, ValueError) as e:
+            self.available = False
+            self.model_loaded = False
+            self.error = str(e) or type(e).__name__
+        self.latency_ms = (time.perf_counter() - started) * 1000
+        self.checked_at = time.time()
+        return self.available
+
+    def is_available(self) -> bool:
+        if self.available is None:
+            self.check()
+        return bool(self.available)
+
+    def _run(self) -> None:
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def state(self) -> Dict[str, object]:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "available": self.available,
+            "model_loaded": self.model_loaded,
+            "error": self.error,
+            "checked_at": self.checked_at,
+            "latency_ms": self.latency_ms,
+            "warmup_ms": self.warmup_ms,
+        }
+
+
+_health: Optional[OllamaHealth] = None
+_llm: Optional[ChatOllama] = None
+_lock = threading.Lock()
+
+
+def get_ollama_health() -> OllamaHealth:
+    global _health
+    if _health is None:
+        with _lock:
+            if _health is None:
+                _health = OllamaHealth(llm_cfg.ollama_base_url, llm_cfg.ollama_model, llm_cfg.health_interval)
+    return _health
+
+
+def _keep_alive() -> int | str:
+    value = llm_cfg.keep_alive
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def ensure_ollama_available() -> None:
     base_url = llm_cfg.ollama_base_url
-    if not _check_ollama_available(base_url):
-        raise ConnectionError(
+    if not get_ollama_health().is_available():
+        raise OllamaUnavailable(
             f"Ollama сервер недоступен на {base_url}.\n"
             "Решения:\n"
             "1. Убедитесь, что Ollama запущен\n"
             "2. Проверьте настройку OLLAMA_BASE_URL в .env файле (по умолчанию http://localhost:11434)\n"
             "3. Убедитесь, что модель загружена: ollama pull <model_name>"
         )
-    return ChatOllama(
-        model=llm_cfg.ollama_model,
-        base_url=base_url,
-        temperature=0.2
-    )
+
+
+def get_chat_llm() -> BaseChatModel:
+    """Возвращает общий для процесса клиент Ollama.
+
+    Один экземпляр держит пул HTTP-соединений; keep_alive в каждом запросе
+    не даёт Ollama выгружать модель между запросами.
+    """
+    global _llm
+    ensure_ollama_available()
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                pool = max(llm_cfg.max_concurrency * 2, 4)
+                _llm = ChatOllama(
+                    model=llm_cfg.ollama_model,
+                    base_url=llm_cfg.ollama_base_url,
+                    temperature=0.2,
+                    num_ctx=prompt_cfg.context_window,
+                    keep_alive=_keep_alive(),
+                    client_kwargs={
+                        "timeout": httpx.Timeout(llm_cfg.request_timeout, connect=5.0),
+                        "limits": httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+                    },
+                )
+    return _llm
+
+
+def warm_up(system: str = "") -> float:
+    """Загружает модель в память Ollama короткой генерацией (один токен).
+
+    Системный промпт прогоняется тем же, что у реальных запросов. Копия клиента
+    отличается только num_predict: num_ctx и остальные опции совпадают с
+    обычными запросами, иначе Ollama перезагрузила бы модель при первом из них.
+    Возвращает время прогрева в миллисекундах.
+    """
+    llm = get_chat_llm().model_copy(update={"num_predict": 1})
+    messages: List[BaseMessage] = [SystemMessage(content=system)] if system else []
+    messages.append(HumanMessage(content="Ответь одним словом: готов?"))
+    started = time.perf_counter()
+    llm.invoke(messages)
+    elapsed = (time.perf_counter() - started) * 1000
+    health = get_ollama_health()
+    health.warmup_ms = elapsed
+    health.check()
+    return elapsed
+
+
+def history_to_messages(history: Optional[List[Dict[str, str]]]) -> List[BaseMessage]:
+    """Преобразует историю диалога [{role, content}] в сообщения langchain."""
+    messages: List[BaseMessage] = []
+    for msg in history or []:
+        if msg["role"] == "user":
+            messages.append(HumanMessage(content=msg["content"]))
+        elif msg["role"] == "assistant":
+            messages.append(AIMessage(content=msg["content"]))
+    return messages
+
+
+def response_text(response) -> str:
+    return response.content if hasattr(response, "content") else str(response)
+
+
+def invoke(llm: BaseChatModel, messages: List[BaseMessage], stage: str = "llm", limited: bool = False):
+    """Вызов модели с учётом времени и токенов в метриках (stage — метка этапа).
+
+    limited — занять слот общего ограничителя: для вызовов из рабочих потоков
+    сервера, которые иначе обходят очередь к модели (Overloaded при перегрузке).
+    """
+    queued = time.perf_counter()
+    with get_llm_limiter().thread_slot() if limited else nullcontext():
+        if limited:
+            metrics.observe_stage("llm_queue", time.perf_counter() - queued)
+        with metrics.stage(stage):
+            response = llm.invoke(messages)
+    metrics.record_llm_usage(response, stage)
+    return response
+
+
+def stream_text(llm: BaseChatModel, messages: List[BaseMessage]) -> Iterator[str]:
+    """Отдаёт фрагменты ответа модели по мере их генерации."""
+    started = time.perf_counter()
+    first = True
+    with metrics.stage("llm"):
+        for chunk in llm.stream(messages):
+            # токены и длительности приходят в последнем фрагменте
+            metrics.record_llm_usage(chunk)
+            text = response_text(chunk)
+            if text:
+                if first:
+                    metrics.observe_stage("llm_first_token", time.perf_counter() - started)
+                    first = False
+                yield text
+
+
+async def ainvoke(llm: BaseChatModel, messages: List[BaseMessage]):
+    """Асинхронный вызов модели через общий ограничитель конкурентности."""
+    if isinstance(llm, ChatOllama):
+        ensure_ollama_available()
+    queued = time.perf_counter()
+    async with get_llm_limiter().slot():
+        metrics.observe_stage("llm_queue", time.perf_counter() - queued)
+        with metrics.stage("llm"):
+            response = await llm.ainvoke(messages)
+    metrics.record_llm_usage(response)
+    return response
+
+
+async def astream_text(llm: BaseChatModel, messages: List[BaseMessage]) -> AsyncIterator[str]:
+    """Асинхронный поток фрагментов ответа; слот ограничителя занят до конца генерации."""
+    if isinstance(llm, ChatOllama):
+        ensure_ollama_available()
+    queued = time.perf_counter()
+    async with get_llm_limiter().slot():
+        started = time.perf_counter()
+        metrics.observe_stage("llm_queue", started - queued)
+        first = True
+        with metrics.stage("llm"):
+            async for chunk in llm.astream(messages):
+                metrics.record_llm_usage(chunk)
+                text = response_text(chunk)
+                if text:
+                    if first:
+                        metrics.observe_stage("llm_first_token", time.perf_counter() - started)
+                        first = False
+                    yield text
 
 
 def generate_with_context(prompt: str, system: Optional[str] = None) -> str:
@@ -50,6 +255,6 @@ def generate_with_context(prompt: str, system: Optional[str] = None) -> str:
     if system:
         messages.append(SystemMessage(content=system))
     messages.append(HumanMessage(content=prompt))
-    out = llm.invoke(messages)
+    out = invoke(llm, messages)
     return out.content or ""
 
@@ -0,0 +1,595 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import httpx
+
+from .bench import _SUBJECTS, HashEmbeddings, _percentiles, synthetic_chunks, synthetic_questions, synthetic_sentence
+from .config import llm_cfg, prompt_cfg
+
+
+KINDS = ("ask", "quiz", "task", "history")
+DEFAULT_MIX = {"ask": 0.6, "quiz": 0.15, "task": 0.1, "history": 0.15}
+
+
+@dataclass
+class MockSettings:
+    latency: float = 0.5  # до первого токена (обработка промпта), с
+    token_rate: float = 20.0  # токенов в секунду при генерации
+    tokens: int = 150  # длина ответа в токенах
+    stream: bool = True  # False — ответ целиком по окончании генерации, даже если клиент просил поток
+    parallel: int = 1  # одновременных генераций (как OLLAMA_NUM_PARALLEL), остальные ждут в очереди
+    model: str = llm_cfg.ollama_model
+
+
+def _ns(seconds: float) -> int:
+    return int(seconds * 1e9)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: "MockOllama"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        model = self.mock.settings.model
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path in ("/api/ps", "/api/tags"):
+            self._send_json({"models": [{"name": model, "model": model, "size": 0}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json({"error": "invalid JSON"}, 400)
+            return
+        if self.path == "/api/chat":
+            prompt = "".join(str(m.get("content") or "") for m in body.get("messages") or [])
+        elif self.path == "/api/generate":
+            prompt = str(body.get("system") or "") + str(body.get("prompt") or "")
+        else:
+            self._send_json({"error": "not found"}, 404)
+            return
+        try:
+            self.mock.generate(self, self.path == "/api/chat", prompt, body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # клиент оборвал запрос
+
+
+class MockOllama:
+    """Ollama-совместимый HTTP-сервер без модели: /api/chat, /api/generate, /api/ps, /api/tags.
+
+    Ответ «генерируется» со временем обработки промпта settings.latency и
+    скоростью settings.token_rate токенов в секунду; одновременно идут не больше
+    settings.parallel генераций. Последний фрагмент, как у Ollama, несёт
+    prompt_eval_count, eval_count и длительности в наносекундах.
+    """
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.settings = settings or MockSettings()
+        self._slots = threading.Semaphore(max(self.settings.parallel, 1))
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self.requests = 0
+        self.active = 0
+        self.waiting = 0
+        self.max_active = 0
+        self.max_waiting = 0
+        self.queue_wait = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        handler = type("MockHandler", (_MockHandler,), {"mock": self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            **asdict(self.settings),
+            "requests": self.requests,
+            "max_active": self.max_active,
+            "max_waiting": self.max_waiting,
+            "avg_queue_wait_ms": self.queue_wait / self.requests * 1000 if self.requests else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    @contextmanager
+    def _slot(self) -> Iterator[None]:
+        started = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.queue_wait += time.perf_counter() - started
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+    def _tokens(self, n: int) -> List[str]:
+        with self._lock:
+            words = []
+            while len(words) < n:
+                words.extend(synthetic_sentence(self._rng).split())
+        return [w + " " for w in words[:n]]
+
+    def generate(self, handler: _MockHandler, chat: bool, prompt: str, body: dict) -> None:
+        s = self.settings
+        n = s.tokens
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if isinstance(num_predict, int) and num_predict > 0:
+            n = min(n, num_predict)
+        prompt_tokens = max(int(len(prompt) / prompt_cfg.chars_per_token), 1)
+        stream = body.get("stream", True)
+        model = body.get("model") or s.model
+
+        def chunk(text: str, done: bool = False, **extra) -> dict:
+            data = {"model": model, "created_at": datetime.utcnow().isoformat() + "Z", "done": done, **extra}
+            if chat:
+                data["message"] = {"role": "assistant", "content": text}
+            else:
+                data["response"] = text
+            return data
+
+        def send(data: dict) -> None:
+            line = json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            handler.wfile.flush()
+
+        tokens = self._tokens(n)
+        with self._slot():
+            started = time.perf_counter()
+            time.sleep(s.latency)
+            first = time.perf_counter()
+            if stream:
+                handler.send_response(200)
+                handler.send_header("Content-Type", "application/x-ndjson")
+                handler.send_header("Transfer-Encoding", "chunked")
+                handler.end_headers()
+            rate = max(s.token_rate, 1e-3)
+            for i, token in enumerate(tokens):
+                # по расписанию, а не sleep(1/rate) на токен — погрешности не накапливаются
+                time.sleep(max(first + (i + 1) / rate - time.perf_counter(), 0.0))
+                if stream and s.stream:
+                    send(chunk(token))
+            finished = time.perf_counter()
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += n
+        final = {
+            "done_reason": "stop",
+            "total_duration": _ns(finished - started),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": _ns(first - started),
+            "eval_count": n,
+            "eval_duration": _ns(finished - first),
+        }
+        if not stream:
+            handler._send_json(chunk("".join(tokens), True, **final))
+            return
+        if not s.stream:
+            send(chunk("".join(tokens)))
+        send(chunk("", True, **final))
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+
+class ProcessSampler:
+    """CPU и память процесса по /proc (только Linux) раз в interval секунд."""
+
+    def __init__(self, pid: int, interval: float = 0.5) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self.error = ""
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _read(self) -> Dict[str, float]:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        rss_kb = 0
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+                    break
+        return {
+            "t": time.perf_counter(),
+            "cpu": (int(fields[11]) + int(fields[12])) / self._tick,
+            "rss_mb": rss_kb / 1024,
+            "threads": int(fields[17]),
+        }
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.samples.append(self._read())
+            except (OSError, IndexError, ValueError) as e:
+                self.error = f"{type(e).__name__}: {e}"
+                return
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self) -> Dict[str, object]:
+        if len(self.samples) < 2:
+            return {"pid": self.pid, "unavailable": self.error or "not enough samples"}
+        cpu = [
+            (b["cpu"] - a["cpu"]) / (b["t"] - a["t"]) * 100 for a, b in zip(self.samples, self.samples[1:])
+        ]
+        first, last = self.samples[0], self.samples[-1]
+        return {
+            "pid": self.pid,
+            "cpu_percent_avg": (last["cpu"] - first["cpu"]) / (last["t"] - first["t"]) * 100,
+            "cpu_percent_max": max(cpu),
+            "cpu_seconds": last["cpu"] - first["cpu"],
+            "rss_mb_start": first["rss_mb"],
+            "rss_mb_max": max(s["rss_mb"] for s in self.samples),
+            "threads_max": max(s["threads"] for s in self.samples),
+        }
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """"ask=0.6,quiz=0.2,history=0.2" -> доли запросов каждого вида."""
+    mix: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise ValueError(f"Unknown request kind: {kind} (expected one of {', '.join(KINDS)})")
+        mix[kind] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("Traffic mix must have a positive weight")
+    return mix
+
+
+@dataclass
+class Result:
+    kind: str
+    ok: bool
+    latency: float
+    ttft: Optional[float] = None
+    error: str = ""
+
+
+class LoadGenerator:
+    """Открытая модель нагрузки: запросы отправляются по пуассоновскому расписанию
+    со средней частотой rps, не дожидаясь ответов на предыдущие, поэтому
+    медленный сервер не снижает нагрузку на себя. Задержка считается от
+    запланированного момента отправки.
+
+    Виртуальные пользователи продолжают свои диалоги (история читается из БД),
+    history — список диалогов пользователя и сообщения одного из них.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        rps: float,
+        duration: float,
+        mix: Dict[str, float],
+        users: int = 20,
+        stream: bool = True,
+        questions: Optional[Sequence[str]] = None,
+        topics: Optional[Sequence[str]] = None,
+        timeout: float = 300.0,
+        seed: int = 0,
+    ) -> None:
+        self.base_url = base_url
+        self.rps = rps
+        self.duration = duration
+        self.mix = mix
+        self.users = [f"loadtest_{i}" for i in range(max(users, 1))]
+        self.stream = stream
+        self.questions = list(questions or synthetic_questions(500, seed=seed))
+        self.topics = list(topics or _SUBJECTS)
+        self.timeout = timeout
+        self._rng = random.Random(seed)
+        self._conversations: Dict[str, List[int]] = {}
+
+    def schedule(self) -> List[tuple]:
+        """[(смещение от начала, вид запроса)] на всё время теста."""
+        kinds, weights = list(self.mix), list(self.mix.values())
+        plan, t = [], self._rng.expovariate(self.rps)
+        while t < self.duration:
+            plan.append((t, self._rng.choices(kinds, weights)[0]))
+            t += self._rng.expovariate(self.rps)
+        return plan
+
+    def _remember(self, user_id: str, data: dict) -> None:
+        conversation_id = data.get("conversation_id")
+        if conversation_id and conversation_id not in self._conversations.setdefault(user_id, []):
+            self._conversations[user_id].append(conversation_id)
+
+    async def _generate(self, client: httpx.AsyncClient, path: str, payload: dict, user_id: str) -> Optional[float]:
+        """POST генерации; возвращает время до первого фрагмента (для потоковых эндпоинтов)."""
+        if not self.stream:
+            resp = await client.post(path, json=payload)
+            resp.raise_for_status()
+            self._remember(user_id, resp.json())
+            return None
+        started = time.perf_counter()
+        ttft = None
+        event = ""
+        async with client.stream("POST", path + "/stream", json=payload) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+                resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                    if event == "token" and ttft is None:
+                        ttft = time.perf_counter() - started
+                elif line.startswith("data:") and event == "done":
+                    self._remember(user_id, json.loads(line[5:]))
+                elif line.startswith("data:") and event == "error":
+                    raise RuntimeError(json.loads(line[5:]).get("detail") or "stream error")
+        return ttft
+
+    async def _request(self, client: httpx.AsyncClient, kind: str) -> Optional[float]:
+        user_id = self._rng.choice(self.users)
+        known = self._conversations.get(user_id) or []
+        if kind == "history":
+            resp = await client.get(f"/users/{user_id}/conversations", params={"limit": 20})
+            resp.raise_for_status()
+            conversations = resp.json()["conversations"]
+            if conversations:
+                resp = await client.get(f"/conversations/{self._rng.choice(conversations)['id']}/messages")
+                resp.raise_for_status()
+            return None
+        payload: dict = {"user_id": user_id}
+        if kind == "ask":
+            payload["question"] = self._rng.choice(self.questions)
+            # половина вопросов — продолжение диалога: история читается из БД
+            if known and self._rng.random() < 0.5:
+                payload["conversation_id"] = self._rng.choice(known)
+        else:
+            payload["topic"] = self._rng.choice(self.topics)
+        return await self._generate(client, f"/{kind}", payload, user_id)
+
+    async def _one(self, client: httpx.AsyncClient, kind: str, scheduled: float) -> Result:
+        loop = asyncio.get_running_loop()
+        try:
+            ttft = await self._request(client, kind)
+            return Result(kind, True, loop.time() - scheduled, ttft)
+        except httpx.HTTPStatusError as e:
+            error = f"HTTP {e.response.status_code}"
+        except httpx.TimeoutException:
+            error = "timeout"
+        except Exception as e:
+            error = type(e).__name__
+        return Result(kind, False, loop.time() - scheduled, error=error)
+
+    async def run(self) -> List[Result]:
+        loop = asyncio.get_running_loop()
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            start = loop.time()
+            tasks = []
+            for offset, kind in self.schedule():
+                await asyncio.sleep(max(start + offset - loop.time(), 0.0))
+                tasks.append(asyncio.create_task(self._one(client, kind, start + offset)))
+            return list(await asyncio.gather(*tasks))
+
+
+def summarize(results: Sequence[Result], elapsed: float) -> Dict[str, object]:
+    def stats(items: Sequence[Result]) -> Dict[str, object]:
+        errors = [r for r in items if not r.ok]
+        ttft = [r.ttft for r in items if r.ok and r.ttft is not None]
+        data: Dict[str, object] = {
+            "requests": len(items),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(items) if items else 0.0,
+            "rps": len(items) / elapsed if elapsed else 0.0,
+            "latency_ms": _percentiles([r.latency for r in items if r.ok]),
+        }
+        if ttft:
+            data["ttft_ms"] = _percentiles(ttft)
+        if errors:
+            data["error_kinds"] = dict(Counter(r.error for r in errors).most_common(5))
+        return data
+
+    by_kind = {kind: stats([r for r in results if r.kind == kind]) for kind in KINDS}
+    return {"overall": stats(results), "by_kind": {k: v for k, v in by_kind.items() if v["requests"]}}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port: int, vector_dir: Optional[str]) -> None:
+    """Процесс API под нагрузкой; с vector_dir — синтетический индекс и хэш-эмбеддинги."""
+    import uvicorn
+
+    from . import engine as engine_module
+    from .server import app
+
+    if vector_dir:
+        engine_module._engine = engine_module.RAGEngine(vector_dir=Path(vector_dir))
+        engine_module._engine._embeddings = HashEmbeddings()
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _wait_ready(base_url: str, timeout: float, process: Optional[multiprocessing.Process] = None) -> None:
+    """Ждёт, пока API ответит на /health и увидит Ollama (мок)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and not process.is_alive():
+            raise RuntimeError(f"API server exited with code {process.exitcode}")
+        try:
+            resp = httpx.get(f"{base_url}/health", timeout=2.0)
+            if resp.status_code == 200 and resp.json()["ollama"]["available"]:
+                return
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"API server at {base_url} is not ready after {timeout:.0f}s")
+
+
+def _start_server(mock_url: str, tmp: Path, synthetic: bool, docs: int, seed: int) -> tuple:
+    vector_dir = None
+    if synthetic:
+        from .vectordb import VectorDB
+
+        vdb = VectorDB.from_documents(synthetic_chunks(docs, seed=seed), HashEmbeddings(), tmp / "vector_store")
+        vdb.save()
+        vdb.close()
+        vector_dir = str(tmp / "vector_store")
+    port = _free_port()
+    env = {"OLLAMA_BASE_URL": mock_url, "DATABASE_URL": f"sqlite:///{tmp / 'loadtest.db'}"}
+    saved = {key: os.environ.get(key) for key in env}
+    # новый процесс читает конфигурацию из окружения при импорте
+    os.environ.update(env)
+    try:
+        process = multiprocessing.get_context("spawn").Process(
+            target=_serve, args=(port, vector_dir), name="loadtest-api", daemon=True
+        )
+        process.start()
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return process, f"http://127.0.0.1:{port}"
+
+
+def run_loadtest(
+    rps: float = 2.0,
+    duration: float = 60.0,
+    mix: Optional[Dict[str, float]] = None,
+    users: int = 20,
+    stream: bool = True,
+    mock: Optional[MockSettings] = None,
+    mock_port: Optional[int] = None,
+    target: Optional[str] = None,
+    server_pid: Optional[int] = None,
+    synthetic: bool = False,
+    docs: int = 40,
+    questions: Optional[Sequence[str]] = None,
+    topics: Optional[Sequence[str]] = None,
+    timeout: float = 300.0,
+    startup_timeout: float = 180.0,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Нагрузочный тест API с мок-сервером Ollama вместо модели.
+
+    Без target поднимает мок и отдельный процесс API (своя временная БД,
+    OLLAMA_BASE_URL на мок; с synthetic — ещё синтетический индекс и
+    хэш-эмбеддинги вместо модели), подаёт смесь ask/quiz/task/history с
+    частотой rps в течение duration секунд и снимает CPU и память процесса
+    API. С target нагружает уже запущенный API; мок тогда поднимается только
+    при заданном mock_port (API должен смотреть на него), ресурсы — по server_pid.
+    """
+    mix = mix or DEFAULT_MIX
+    settings = mock or MockSettings()
+    ollama = None
+    process = None
+    report: Dict[str, object] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            if target is None or mock_port is not None:
+                ollama = MockOllama(settings, port=mock_port or 0).start()
+            if target is None:
+                process, target = _start_server(ollama.url, Path(tmp), synthetic, docs, seed)
+                server_pid = process.pid
+                _wait_ready(target, startup_timeout, process)
+            sampler = ProcessSampler(server_pid) if server_pid else None
+            if sampler:
+                sampler.start()
+            generator = LoadGenerator(target, rps, duration, mix, users, stream, questions, topics, timeout, seed)
+            started = time.perf_counter()
+            results = asyncio.run(generator.run())
+            elapsed = time.perf_counter() - started
+            if sampler:
+                sampler.stop()
+            report = {
+                "meta": {
+                    "created_at": datetime.utcnow().isoformat(),
+                    "target": target,
+                    "rps": rps,
+                    "duration": duration,
+                    "elapsed": elapsed,
+                    "mix": mix,
+                    "users": users,
+                    "stream": stream,
+                    "synthetic": synthetic,
+                },
+                **summarize(results, elapsed),
+                "server": sampler.summary() if sampler else {"unavailable": "no server pid"},
+            }
+            if ollama is not None:
+                report["mock"] = ollama.stats()
+        finally:
+            if process is not None:
+                process.terminate()
+                process.join(10)
+                if process.is_alive():
+                    process.kill()
+            if ollama is not None:
+                ollama.stop()
+    return report
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .qcache import LRUCache
+
+
+# эндпоинт текущего запроса; фоновые задачи и CLI — "background"
+_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="background")
+
+# от миллисекунд (поиск, SQLite) до минут (генерация на CPU)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values]
+        return lines
+
+
+class Histogram:
+    """Гистограмма Prometheus: счётчики по корзинам, сумма и число наблюдений на набор меток."""
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # [счётчики корзин..., +Inf, сумма]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in values:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {repr(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_number(cumulative)}")
+        return lines
+
+
+_registry: List[Counter | Histogram] = []
+
+REQUESTS = Counter(
+    "rag_http_requests_total", "HTTP requests by route, method and status code.", ("endpoint", "method", "status")
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "HTTP request time including the streamed body.", ("endpoint",)
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time of a processing stage: retrieve (embed_query, search and chunk reads), prompt, llm_queue, llm, "
+    "llm_first_token, summary, embed_documents, ingest (ingest_parse, ingest_index, ingest_save).",
+    ("endpoint", "stage"),
+)
+DB_SECONDS = Histogram(
+    "rag_db_operation_duration_seconds", "Time of a conversation database operation.", ("endpoint", "operation")
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "Prompt and completion tokens reported by the model.", ("endpoint", "stage", "type")
+)
+LLM_EVAL_SECONDS = Counter(
+    "rag_llm_eval_seconds_total",
+    "Model time from Ollama response metadata: prompt (prompt_eval_duration) and completion (eval_duration).",
+    ("endpoint", "stage", "phase"),
+)
+INGEST_CHUNKS = Counter("rag_ingest_chunks_total", "Chunks added to or removed from the index.", ("operation",))
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_stage(stage: str, seconds: float, endpoint: Optional[str] = None) -> None:
+    STAGE_SECONDS.observe(seconds, endpoint or _endpoint.get(), stage)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, _endpoint.get(), name)
+
+
+def timed_db(func: Callable) -> Callable:
+    """Декоратор операций CRUD: время вызова под именем функции."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, _endpoint.get(), name)
+
+    return wrapper
+
+
+def record_llm_usage(message, stage: str = "llm") -> None:
+    """Токены и время модели из ответа (или последнего фрагмента потока) langchain.
+
+    usage_metadata заполняют все чат-модели langchain; длительности в
+    наносекундах есть только в response_metadata Ollama.
+    """
+    usage = getattr(message, "usage_metadata", None)
+    meta = getattr(message, "response_metadata", None) or {}
+    if not usage and "eval_count" not in meta:
+        return
+    endpoint = _endpoint.get()
+    prompt = (usage or {}).get("input_tokens", meta.get("prompt_eval_count")) or 0
+    completion = (usage or {}).get("output_tokens", meta.get("eval_count")) or 0
+    LLM_TOKENS.inc(endpoint, stage, "prompt", amount=prompt)
+    LLM_TOKENS.inc(endpoint, stage, "completion", amount=completion)
+    if meta.get("prompt_eval_duration"):
+        LLM_EVAL_SECONDS.inc(endpoint, stage, "prompt", amount=meta["prompt_eval_duration"] / 1e9)
+    if meta.get("eval_duration"):
+        LLM_EVAL_SECONDS.inc(endpoint, stage, "completion", amount=meta["eval_duration"] / 1e9)
+
+
+_routes = LRUCache(1024)
+
+
+def _route(scope: dict) -> str:
+    """Шаблон маршрута (/conversations/{conversation_id}), чтобы id не плодили метки."""
+    path = scope.get("path", "")
+    route = _routes.get(path)
+    if route is None:
+        from starlette.routing import Match
+
+        route = "unmatched"
+        for candidate in getattr(scope.get("app"), "routes", ()):
+            if candidate.matches(scope)[0] != Match.NONE:
+                route = getattr(candidate, "path", path)
+                break
+        _routes.put(path, route)
+    return route
+
+
+class MetricsMiddleware:
+    """ASGI-посредник: задаёт эндпоинт для меток этапов и считает запросы и их время.
+
+    Эндпоинт хранится в ContextVar, поэтому он виден и в пуле потоков
+    (asyncio.to_thread и синхронные обработчики копируют контекст).
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = _route(scope)
+        token = _endpoint.set(endpoint)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+            REQUESTS.inc(endpoint, scope["method"], str(status))
+            _endpoint.reset(token)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import crud
+from .config import pregen_cfg
+from .database import SessionLocal
+from .embcache import normalize_text
+from .engine import RAGEngine, get_engine
+from .gate import REFUSAL_TEXT
+from .limiter import get_llm_limiter
+from .quiz import agenerate_quiz, generate_quiz
+from .tasks import agenerate_task, generate_task
+
+
+KINDS = ("quiz", "task")
+
+
+def topic_key(topic: str) -> str:
+    return normalize_text(topic).casefold()
+
+
+def title_from_source(source: str) -> str:
+    """Тема по имени файла лекции: «1_Системы_управления_БД.docx» -> «Системы управления БД»."""
+    stem = re.sub(r"^[\d\s._-]+", "", Path(source).stem)
+    return re.sub(r"[_\s]+", " ", stem).strip()
+
+
+def configured_topics(engine: RAGEngine | None = None) -> List[str]:
+    """Темы из PREGEN_TOPICS / PREGEN_TOPICS_FILE, иначе — из названий файлов корпуса."""
+    topics = [t.strip() for t in pregen_cfg.topics.split(";") if t.strip()]
+    if pregen_cfg.topics_file:
+        with open(pregen_cfg.topics_file, "r", encoding="utf-8") as f:
+            topics.extend(line.strip() for line in f if line.strip())
+    if not topics:
+        engine = engine or get_engine()
+        topics = [title_from_source(s) for s in engine.vdb.store.sources()]
+    unique: Dict[str, str] = {}
+    for topic in topics:
+        if topic:
+            unique.setdefault(topic_key(topic), topic)
+    return list(unique.values())
+
+
+class Pregenerator:
+    """Заранее генерирует квизы и задания по известным темам.
+
+    Для каждой темы и вида держит pregen_cfg.variants невыданных вариантов,
+    привязанных к текущей версии индекса; при смене версии старые варианты
+    удаляются. Фоновый цикл генерирует по одному варианту, только когда LLM
+    простаивает не меньше pregen_cfg.idle_seconds, и идёт через общий
+    ограничитель, поэтому запросы студентов не ждут за ним в очереди.
+    """
+
+    def __init__(self, engine: RAGEngine | None = None, topics: Optional[List[str]] = None) -> None:
+        self.engine = engine or get_engine()
+        self._topics = topics
+        self.generated = 0
+        self.served = 0
+        self._refused: Set[Tuple[str, str, str]] = set()  # (версия, вид, тема) отсечённые фильтром
+        self._version: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def topics(self) -> List[str]:
+        if self._topics is None:
+            self._topics = configured_topics(self.engine)
+        return self._topics
+
+    @staticmethod
+    def _num(kind: str) -> int:
+        return pregen_cfg.quiz_num if kind == "quiz" else 0
+
+    def pending(self) -> List[Tuple[str, str]]:
+        """Недостающие варианты (вид, тема); сначала темы, где вариантов меньше всего."""
+        version = self.engine.index_version
+        db = SessionLocal()
+        try:
+            if version != self._version:
+                crud.delete_stale_pregenerated(db, version)
+                self._version = version
+            counts = crud.count_fresh_pregenerated(db, version)
+        finally:
+            db.close()
+        jobs = []
+        for topic in self.topics():
+            key = topic_key(topic)
+            for kind in KINDS:
+                have = counts.get((kind, key, self._num(kind)), 0)
+                if have < pregen_cfg.variants and (version, kind, key) not in self._refused:
+                    jobs.append((have, kind, topic))
+        jobs.sort(key=lambda job: job[0])
+        return [(kind, topic) for _, kind, topic in jobs]
+
+    def _store(self, kind: str, topic: str, content: str, version: str) -> bool:
+        if not content.strip() or content.strip() == REFUSAL_TEXT:
+            self._refused.add((version, kind, topic_key(topic)))
+            return False
+        db = SessionLocal()
+        try:
+            crud.add_pregenerated(db, kind, topic, topic_key(topic), self._num(kind), content, version)
+        finally:
+            db.close()
+        self.generated += 1
+        return True
+
+    def generate_one(self, kind: str, topic: str) -> bool:
+        version = self.engine.index_version
+        if kind == "quiz":
+            content = generate_quiz(topic, self._num(kind), engine=self.engine)["questions"]
+        else:
+            content = generate_task(topic, engine=self.engine)["task"]
+        return self._store(kind, topic, content, version)
+
+    async def agenerate_one(self, kind: str, topic: str) -> bool:
+        version = self.engine.index_version
+        if kind == "quiz":
+            content = (await agenerate_quiz(topic, self._num(kind), engine=self.engine))["questions"]
+        else:
+            content = (await agenerate_task(topic, engine=self.engine))["task"]
+        return await asyncio.to_thread(self._store, kind, topic, content, version)
+
+    def fill(self) -> int:
+        """Генерирует все недостающие варианты сразу (для CLI); возвращает их число."""
+        before = self.generated
+        while True:
+            jobs = self.pending()
+            if not jobs:
+                return self.generated - before
+            self.generate_one(*jobs[0])
+
+    async def run(self) -> None:
+        limiter = get_llm_limiter()
+        pause = max(pregen_cfg.idle_seconds / 4, 1.0)
+        while True:
+            await asyncio.sleep(pause)
+            if limiter.idle_for() < pregen_cfg.idle_seconds:
+                continue
+            try:
+                jobs = await asyncio.to_thread(self.pending)
+                if jobs:
+                    await self.agenerate_one(*jobs[0])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # нет индекса, Ollama недоступна или занята — попробуем в следующий простой
+                continue
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _match(self, db, topic: str, version: str) -> Optional[str]:
+        """Ключ ближайшей по смыслу темы с вариантами, если она достаточно близка."""
+        topics = crud.get_pregenerated_topics(db, version)
+        if not topics:
+            return None
+        query = self.engine.embed_query(topic)
+        vectors = np.stack([self.engine.embed_query(title) for _, title in topics])
+        sims = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(sims))
+        return topics[best][0] if sims[best] >= pregen_cfg.match_threshold else None
+
+    def take(self, kind: str, topic: str, num: int = 0) -> Optional[str]:
+        """Невыданный вариант по теме запроса (точное совпадение или близкая тема) или None."""
+        version = self.engine.index_version
+        key = topic_key(topic)
+        db = SessionLocal()
+        try:
+            item = crud.take_pregenerated(db, kind, key, num, version)
+            if item is None:
+                match = self._match(db, topic, version)
+                if match is not None and match != key:
+                    item = crud.take_pregenerated(db, kind, match, num, version)
+        finally:
+            db.close()
+        if item is None:
+            return None
+        self.served += 1
+        return item.content
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": pregen_cfg.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "generated": self.generated,
+            "served": self.served,
+        }
+
+
+_pregenerator: Optional[Pregenerator] = None
+_pregenerator_lock = threading.Lock()
+
+
+def get_pregenerator() -> Pregenerator:
+    global _pregenerator
+    if _pregenerator is None:
+        with _pregenerator_lock:
+            if _pregenerator is None:
+                _pregenerator = Pregenerator()
+    return _pregenerator
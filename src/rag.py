@@ -1,15 +1,21 @@
 from __future__ import annotations
 
-from typing import List, Dict, Optional
+import asyncio
+import time
+from typing import AsyncIterator, List, Dict, Iterator, Optional
 
 from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
-from .ingest import load_vector_store
-from .llm import get_chat_llm
+from .engine import RAGEngine, get_engine
+from .gate import REFUSAL_TEXT, get_gate
+from .config import context_cfg, llm_cfg
+from .context import Candidates, select_context
+from .history import Prompt, build_prompt_messages
+from .llm import ainvoke, astream_text, invoke, response_text, stream_text
 
 
 SYSTEM_PROMPT = (
@@ -69,31 +75,139 @@ def _format_docs(docs) -> str:
 
 
 class RAGQA:
-    def __init__(self, llm: BaseChatModel | None = None, k: int = 5) -> None:
-        self.vdb = load_vector_store()
-        self.retriever = self.vdb.as_retriever(k=k)
-        self.llm = llm or get_chat_llm()
-
-    def ask(self, question: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, str]:
-        context_docs = self.retriever.invoke(question)
-        context = _format_docs(context_docs)
-        
-        # Формируем историю сообщений
-        messages = [SystemMessage(content=SYSTEM_PROMPT)]
-        
-        if history:
-            for msg in history:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(AIMessage(content=msg["content"]))
-        
-        # Добавляем текущий вопрос с контекстом
-        messages.append(HumanMessage(content=f"Вопрос: {question}\n\nКонтекст:\n{context}\n\nТвой ответ:"))
-        
-        # Вызываем LLM
-        response = self.llm.invoke(messages)
-        answer = response.content if hasattr(response, 'content') else str(response)
-        
-        return {"question": question, "answer": answer}
+    def __init__(self, llm: BaseChatModel | None = None, k: int = 5, engine: RAGEngine | None = None) -> None:
+        self.engine = engine or get_engine()
+        self.k = k
+        self._llm = llm
 
+    @property
+    def llm(self) -> BaseChatModel:
+        return self._llm or self.engine.llm
+
+    def build_messages(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        conversation_id: Optional[int] = None,
+        candidates: Optional[Candidates] = None,
+    ) -> Optional[Prompt]:
+        """Промпт для LLM; None, если вопрос отсечён фильтром релевантности.
+
+        candidates — уже найденные кандидаты (пакетный режим); иначе поиск выполняется здесь.
+        """
+        if candidates is None:
+            candidates = self.engine.candidates(question, self.k * context_cfg.fetch_factor)
+        if not get_gate().allows(candidates.scored()):
+            return None
+        # история и контекст укладываются в окно модели: старые ходы — в сводку,
+        # из найденных чанков убираются повторы и перекрытия
+        return build_prompt_messages(
+            SYSTEM_PROMPT,
+            history,
+            lambda budget: select_context(candidates, self.k, budget),
+            lambda context: f"Вопрос: {question}\n\nКонтекст:\n{context}\n\nТвой ответ:",
+            self.llm,
+            conversation_id,
+        )
+
+    def ask(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        conversation_id: Optional[int] = None,
+    ) -> Dict[str, object]:
+        prompt = self.build_messages(question, history, conversation_id)
+        if prompt is None:
+            return {"question": question, "answer": REFUSAL_TEXT}
+        response = invoke(self.llm, prompt.messages)
+        return {"question": question, "answer": response_text(response), "context": prompt.context}
+
+    def stream(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        conversation_id: Optional[int] = None,
+        context_stats: Optional[Dict[str, int]] = None,
+    ) -> Iterator[str]:
+        """Потоковый вариант ask: отдаёт фрагменты ответа по мере генерации.
+
+        Если передан context_stats, в него записывается статистика отбора контекста.
+        """
+        prompt = self.build_messages(question, history, conversation_id)
+        if prompt is None:
+            yield REFUSAL_TEXT
+            return
+        if context_stats is not None:
+            context_stats.update(prompt.context)
+        yield from stream_text(self.llm, prompt.messages)
+
+    async def aask(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        conversation_id: Optional[int] = None,
+    ) -> Dict[str, object]:
+        """Асинхронный ask: поиск выполняется в пуле потоков, вызов модели — через ограничитель."""
+        prompt = await asyncio.to_thread(self.build_messages, question, history, conversation_id)
+        if prompt is None:
+            return {"question": question, "answer": REFUSAL_TEXT}
+        response = await ainvoke(self.llm, prompt.messages)
+        return {"question": question, "answer": response_text(response), "context": prompt.context}
+
+    async def astream(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        conversation_id: Optional[int] = None,
+        context_stats: Optional[Dict[str, int]] = None,
+    ) -> AsyncIterator[str]:
+        prompt = await asyncio.to_thread(self.build_messages, question, history, conversation_id)
+        if prompt is None:
+            yield REFUSAL_TEXT
+            return
+        if context_stats is not None:
+            context_stats.update(prompt.context)
+        async for token in astream_text(self.llm, prompt.messages):
+            yield token
+
+    async def _ask_item(
+        self, index: int, question: str, candidates: Candidates, sem: asyncio.Semaphore
+    ) -> Dict[str, object]:
+        async with sem:
+            started = time.perf_counter()
+            try:
+                prompt = await asyncio.to_thread(self.build_messages, question, None, None, candidates)
+                if prompt is None:
+                    out: Dict[str, object] = {"question": question, "answer": REFUSAL_TEXT}
+                else:
+                    response = await ainvoke(self.llm, prompt.messages)
+                    out = {"question": question, "answer": response_text(response), "context": prompt.context}
+            except Exception as e:
+                out = {"question": question, "error": str(e) or type(e).__name__}
+            out["index"] = index
+            out["ms"] = (time.perf_counter() - started) * 1000
+            return out
+
+    async def aask_batch(self, questions: List[str], concurrency: int | None = None) -> AsyncIterator[Dict[str, object]]:
+        """Отвечает на пакет вопросов без истории; результаты отдаются по мере готовности.
+
+        Эмбеддинги и поиск выполняются для всего пакета сразу, генерации — не
+        более concurrency одновременно (и через общий ограничитель). Ошибка
+        отдельного вопроса попадает в его результат ("error") и не прерывает
+        пакет. У каждого результата есть index — номер вопроса в пакете.
+        """
+        if not questions:
+            return
+        batch = await asyncio.to_thread(self.engine.candidates_batch, questions, self.k * context_cfg.fetch_factor)
+        # больше слотов общего ограничителя брать бессмысленно: лишние ждали бы в его очереди
+        sem = asyncio.Semaphore(max(min(concurrency or llm_cfg.batch_concurrency, llm_cfg.max_concurrency), 1))
+        pending = [
+            asyncio.ensure_future(self._ask_item(i, question, candidates, sem))
+            for i, (question, candidates) in enumerate(zip(questions, batch))
+        ]
+        try:
+            for done in asyncio.as_completed(pending):
+                yield await done
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Select, delete, func, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .config import retention_cfg
+from .database import ArchivedConversation, Conversation, Message, engine
+from .export import to_iso
+
+
+MODES = ("archive", "delete")
+
+# повторы пакета, если блокировку записи не удалось получить за busy_timeout
+_BATCH_RETRIES = 3
+
+
+@dataclass
+class RetentionStats:
+    cutoff: str
+    mode: str
+    dry_run: bool = False
+    conversations: int = 0
+    messages: int = 0
+    archived_bytes: int = 0  # размер сжатых архивов
+    freed_pages: int = 0  # страниц возвращено ОС incremental_vacuum
+    vacuum: str = "skipped"  # incremental, off (БД без auto_vacuum=INCREMENTAL) или skipped
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return asdict(self)
+
+
+def _archive_rows(conn, ids: List[int] | Select, now: datetime) -> List[Dict[str, object]]:
+    """Строки archived_conversations для пакета диалогов (сообщения — одним запросом)."""
+    messages: Dict[int, List[Dict[str, object]]] = defaultdict(list)
+    for conversation_id, role, content, timestamp in conn.execute(
+        select(Message.conversation_id, Message.role, Message.content, Message.timestamp)
+        .where(Message.conversation_id.in_(ids))
+        .order_by(Message.conversation_id, Message.timestamp, Message.id)
+    ):
+        messages[conversation_id].append({"role": role, "content": content, "timestamp": to_iso(timestamp)})
+    rows = []
+    for conv in conn.execute(select(Conversation).where(Conversation.id.in_(ids))).mappings():
+        items = messages.pop(conv["id"], [])
+        data = {
+            "conversation": {
+                "id": conv["id"],
+                "user_id": conv["user_id"],
+                "title": conv["title"],
+                "type": conv["conversation_type"],
+                "created_at": to_iso(conv["created_at"]),
+                "updated_at": to_iso(conv["updated_at"]),
+            },
+            "messages": items,
+        }
+        rows.append({
+            "conversation_id": conv["id"],
+            "user_id": conv["user_id"],
+            "title": conv["title"],
+            "conversation_type": conv["conversation_type"],
+            "created_at": conv["created_at"],
+            "updated_at": conv["updated_at"],
+            "message_count": len(items),
+            "archived_at": now,
+            "payload": zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"), 6),
+        })
+    return rows
+
+
+def _process_batch(conn, ids: List[int], mode: str, cutoff: datetime) -> Tuple[int, int, int]:
+    """Выносит пакет диалогов; возвращает (диалогов, сообщений, байт архива).
+
+    Каждый запрос заново проверяет updated_at < cutoff: диалог, в который
+    успели дописать ход, остаётся в рабочих таблицах со всеми сообщениями.
+    """
+    still_stale = select(Conversation.id).where(Conversation.id.in_(ids), Conversation.updated_at < cutoff)
+    archived = 0
+    if mode == "archive":
+        rows = _archive_rows(conn, still_stale, datetime.utcnow())
+        if rows:
+            conn.execute(insert(ArchivedConversation), rows)
+            archived = sum(len(r["payload"]) for r in rows)
+    messages = conn.execute(delete(Message).where(Message.conversation_id.in_(still_stale))).rowcount
+    conversations = conn.execute(
+        delete(Conversation).where(Conversation.id.in_(ids), Conversation.updated_at < cutoff)
+    ).rowcount
+    return conversations, messages, archived
+
+
+def incremental_vacuum(db_engine=None, pages: int = 0) -> Tuple[str, int]:
+    """Возвращает ОС свободные страницы БД (pages=0 — все) и сбрасывает WAL.
+
+    Работает только при auto_vacuum=INCREMENTAL; иначе возвращает ("off", 0).
+    """
+    with (db_engine or engine).connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return "off", 0
+        before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # execute() модуля sqlite3 делает один шаг (одна страница), executescript — до конца
+        conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return "incremental", before - after
+
+
+def enable_incremental_vacuum(db_engine=None) -> None:
+    """Переводит существующую БД в auto_vacuum=INCREMENTAL полным VACUUM (блокирует БД на время)."""
+    with (db_engine or engine).connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+def apply_retention(
+    days: Optional[int] = None,
+    mode: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    dry_run: bool = False,
+    vacuum: bool = True,
+    db_engine=None,
+) -> RetentionStats:
+    """Выносит из рабочих таблиц диалоги без активности дольше days дней.
+
+    Диалоги выбираются пакетами по batch_size в порядке id; каждый пакет —
+    одна транзакция BEGIN IMMEDIATE: блокировка записи берётся до чтения
+    пакета (pysqlite сам начал бы транзакцию только на первом DML, и ход,
+    добавленный между SELECT и DELETE, был бы удалён). Затем (mode=archive)
+    сжатые копии в archived_conversations и два DELETE; все они повторяют
+    условие updated_at < cutoff. В конце освободившиеся страницы
+    возвращаются ОС incremental_vacuum.
+    """
+    days = retention_cfg.days if days is None else days
+    mode = mode or retention_cfg.mode
+    batch_size = batch_size or retention_cfg.batch_size
+    if days <= 0:
+        raise ValueError("Retention period must be at least one day")
+    if mode not in MODES:
+        raise ValueError(f"Unknown retention mode: {mode}")
+    db_engine = db_engine or engine
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stats = RetentionStats(cutoff=cutoff.isoformat(), mode=mode, dry_run=dry_run)
+    stale = Conversation.updated_at < cutoff
+
+    last_id = 0
+    while True:
+        for attempt in range(_BATCH_RETRIES):
+            try:
+                done = (0, 0, 0)
+                with db_engine.connect() as conn:
+                    if not dry_run:
+                        conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    ids = list(conn.execute(
+                        select(Conversation.id).where(stale, Conversation.id > last_id)
+                        .order_by(Conversation.id).limit(batch_size)
+                    ).scalars())
+                    if ids and dry_run:
+                        messages = conn.execute(
+                            select(func.count(Message.id)).where(Message.conversation_id.in_(ids))
+                        ).scalar()
+                        done = (len(ids), messages, 0)
+                    elif ids:
+                        done = _process_batch(conn, ids, mode, cutoff)
+                    conn.commit()
+                break
+            except OperationalError:
+                if attempt == _BATCH_RETRIES - 1:
+                    raise
+        if not ids:
+            break
+        stats.conversations += done[0]
+        stats.messages += done[1]
+        stats.archived_bytes += done[2]
+        last_id = ids[-1]
+
+    if vacuum and not dry_run and stats.conversations:
+        stats.vacuum, stats.freed_pages = incremental_vacuum(db_engine, retention_cfg.vacuum_pages)
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def read_archived(db: Session, conversation_id: int) -> Optional[Dict[str, object]]:
+    """Архивная копия диалога в формате GET /conversations/{id}/export или None."""
+    row = (
+        db.query(ArchivedConversation.payload)
+        .filter(ArchivedConversation.conversation_id == conversation_id)
+        .order_by(ArchivedConversation.id.desc())
+        .first()
+    )
+    return json.loads(zlib.decompress(row.payload)) if row else None
+
+
+class RetentionJob:
+    """Периодически применяет политику хранения в фоне API (раз в retention_cfg.interval_hours)."""
+
+    def __init__(self) -> None:
+        self.last: Optional[RetentionStats] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        interval = max(retention_cfg.interval_hours * 3600, 60.0)
+        while True:
+            try:
+                self.last = await asyncio.to_thread(apply_retention)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # БД занята или повреждена — попробуем в следующий раз
+                pass
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_job: Optional[RetentionJob] = None
+_job_lock = threading.Lock()
+
+
+def get_retention_job() -> RetentionJob:
+    global _job
+    if _job is None:
+        with _job_lock:
+            if _job is None:
+                _job = RetentionJob()
+    return _job
@@ -1,23 +1,67 @@
 from __future__ import annotations
 
-from typing import List
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from .config import ensure_dirs
-from .ingest import build_vector_store
-from .rag import RAGQA
-from .quiz import generate_quiz
-from .tasks import generate_task
-from .database import init_db, get_db
+from .config import ensure_dirs, llm_cfg, pregen_cfg, retention_cfg
+from .engine import get_engine
+from .llm import OllamaUnavailable, get_ollama_health, warm_up
+from .rag import RAGQA, SYSTEM_PROMPT
+from .quiz import agenerate_quiz, astream_quiz
+from .tasks import agenerate_task, astream_task
+from .limiter import Overloaded, get_llm_limiter
+from .pregen import get_pregenerator
+from .retention import get_retention_job, read_archived
+from .database import init_db, get_db, SessionLocal
+from .export import iter_export, ndjson_chunks
+from .metrics import MetricsMiddleware, render as render_metrics
 from . import crud
 
 
-app = FastAPI(title="RAG-EDU Agent", version="1.0")
+def _warm_up() -> None:
+    """Загружает индекс, модель эмбеддингов и LLM до первого запроса."""
+    engine = get_engine()
+    try:
+        engine.embed_query("прогрев")
+        engine.vdb
+    except Exception:
+        pass  # индекса ещё нет — его построит /ingest
+    try:
+        warm_up(SYSTEM_PROMPT)
+    except Exception:
+        pass  # Ollama недоступна — состояние видно в /health
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # синхронные вызовы модели из рабочих потоков ждут слота в этом цикле
+    get_llm_limiter().bind(asyncio.get_running_loop())
+    health = get_ollama_health()
+    health.start()
+    warmup = asyncio.create_task(asyncio.to_thread(_warm_up)) if llm_cfg.warmup else None
+    if pregen_cfg.enabled:
+        get_pregenerator().start()
+    if retention_cfg.days > 0:
+        get_retention_job().start()
+    yield
+    get_retention_job().stop()
+    get_pregenerator().stop()
+    if warmup is not None:
+        warmup.cancel()
+    health.stop()
+
+
+app = FastAPI(title="RAG-EDU Agent", version="1.0", lifespan=lifespan)
 ensure_dirs()
 init_db()  # Инициализация базы данных
 
@@ -29,6 +73,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 class MessageHistory(BaseModel):
@@ -39,33 +84,68 @@ class MessageHistory(BaseModel):
 class AskRequest(BaseModel):
     question: str
     k: int | None = None
+    # история от клиента (старые клиенты); без неё история берётся из диалога conversation_id
     history: list[MessageHistory] | None = None
+    # диалог: из него читается история, в него сохраняется ход
+    conversation_id: int | None = None
+    # без conversation_id: создать диалог этого пользователя первым ходом
+    user_id: str | None = None
+
+
+class AskBatchRequest(BaseModel):
+    questions: list[str]
+    k: int | None = None
+    concurrency: int | None = None  # одновременных генераций (не больше OLLAMA_MAX_CONCURRENCY)
 
 
 class AskResponse(BaseModel):
     question: str
     answer: str
+    # статистика отбора контекста: кандидаты, склейки, дубликаты, сэкономленные токены
+    context: dict | None = None
+    # куда сохранён ход (если указан conversation_id или user_id)
+    conversation_id: int | None = None
+    user_message_id: int | None = None
+    assistant_message_id: int | None = None
 
 
 class QuizRequest(BaseModel):
     topic: str
     num: int = 5
     history: list[MessageHistory] | None = None
+    conversation_id: int | None = None
+    user_id: str | None = None
+    pregenerated: bool = True  # можно отдать заранее сгенерированный вариант
 
 
 class QuizResponse(BaseModel):
     topic: str
     questions: str
+    context: dict | None = None
+    pregenerated: bool = False
+    # куда сохранён ход (если указан conversation_id или user_id)
+    conversation_id: int | None = None
+    user_message_id: int | None = None
+    assistant_message_id: int | None = None
 
 
 class TaskRequest(BaseModel):
     topic: str
     history: list[MessageHistory] | None = None
+    conversation_id: int | None = None
+    user_id: str | None = None
+    pregenerated: bool = True
 
 
 class TaskResponse(BaseModel):
     topic: str
     task: str
+    context: dict | None = None
+    pregenerated: bool = False
+    # куда сохранён ход (если указан conversation_id или user_id)
+    conversation_id: int | None = None
+    user_message_id: int | None = None
+    assistant_message_id: int | None = None
 
 
 # Модели для работы с историей диалогов
@@ -91,6 +171,23 @@ class MessageResponse(BaseModel):
         from_attributes = True
 
 
+class TurnCreate(BaseModel):
+    # без conversation_id диалог создаётся в той же транзакции из user_id, title и conversation_type
+    conversation_id: int | None = None
+    user_id: str | None = None
+    title: str | None = None
+    conversation_type: str | None = None
+    user_content: str
+    assistant_content: str
+
+
+class TurnResponse(BaseModel):
+    conversation_id: int
+    created: bool
+    user_message: MessageResponse
+    assistant_message: MessageResponse
+
+
 class ConversationResponse(BaseModel):
     id: int
     user_id: str
@@ -118,34 +215,307 @@ class ConversationListItem(BaseModel):
 
 
 @app.post("/ingest")
-def ingest() -> dict:
+def ingest(force: bool = False) -> dict:
     try:
-        build_vector_store()
-        return {"status": "ok"}
+        stats = get_engine().rebuild(force_rebuild=force)
+        return {"status": "ok", **stats.as_dict()}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/cache/stats")
+def cache_stats() -> dict:
+    """Статистика кэшей эмбеддингов и поиска (для подбора их размеров)."""
+    return {**get_engine().cache_stats(), "pregenerated": get_pregenerator().stats()}
+
+
+@app.get("/health")
+def health() -> dict:
+    """Состояние Ollama по последней фоновой проверке (без обращения к серверу)."""
+    engine = get_engine()
+    return {
+        "ollama": get_ollama_health().state(),
+        "index_version": engine.cache_stats()["index_version"],
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """Метрики в формате Prometheus: запросы, время этапов, операции БД, токены модели."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(_: Request, exc: Overloaded) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
+@app.exception_handler(OllamaUnavailable)
+async def ollama_unavailable_handler(_: Request, exc: OllamaUnavailable) -> JSONResponse:
+    retry = str(max(int(llm_cfg.health_interval), 1))
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": retry})
+
+
+def _history(req: AskRequest | QuizRequest | TaskRequest) -> Optional[List[Dict[str, str]]]:
+    """История из запроса; None — взять её из диалога conversation_id."""
+    if req.history is None:
+        return None
+    return [{"role": h.role, "content": h.content} for h in req.history]
+
+
+def _quiz_text(topic: str, questions: str) -> str:
+    return f'Квиз по теме "{topic}":\n\n{questions}'
+
+
+def _task_text(topic: str, task: str) -> str:
+    return f'Задание по теме "{topic}":\n\n{task}'
+
+
 @app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest):
+async def ask(req: AskRequest):
+    await _require_conversation(req)
+    qa = RAGQA(k=req.k or 5)
+    out = await qa.aask(req.question, history=_history(req), conversation_id=req.conversation_id)
+    saved = await _persist(req, "question", req.question, out["answer"])
+    return AskResponse(**out, **saved)
+
+
+@app.post("/ask/batch")
+async def ask_batch(req: AskBatchRequest):
+    """Пакет вопросов без истории (ночные прогоны, генерация FAQ).
+
+    Ответ — NDJSON: по строке на вопрос в порядке готовности ({"index", "question",
+    "answer" или "error", "context", "ms"}), последняя строка — {"done": true, ...}.
+    """
+    if len(req.questions) > llm_cfg.batch_max_questions:
+        raise HTTPException(
+            status_code=413, detail=f"Слишком много вопросов в пакете (максимум {llm_cfg.batch_max_questions})"
+        )
     qa = RAGQA(k=req.k or 5)
-    history = [{"role": h.role, "content": h.content} for h in (req.history or [])]
-    out = qa.ask(req.question, history=history)
-    return AskResponse(**out)
+    started = time.perf_counter()
+    results = qa.aask_batch(req.questions, req.concurrency)
+    # поиск по всему пакету выполняется до первого результата: его ошибки — обычный HTTP-ответ
+    try:
+        first = await results.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def lines() -> AsyncIterator[str]:
+        errors = 0
+        try:
+            if first is not None:
+                errors += "error" in first
+                yield json.dumps(first, ensure_ascii=False) + "\n"
+                async for item in results:
+                    errors += "error" in item
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            await results.aclose()
+        done = {
+            "done": True,
+            "total": len(req.questions),
+            "errors": errors,
+            "total_ms": (time.perf_counter() - started) * 1000,
+        }
+        yield json.dumps(done, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def _pregenerated(allowed: bool, kind: str, topic: str, num: int = 0) -> Optional[str]:
+    """Заранее сгенерированный вариант для темы, если он есть и клиент не против."""
+    if not allowed:
+        return None
+    try:
+        return await asyncio.to_thread(get_pregenerator().take, kind, topic, num)
+    except FileNotFoundError:
+        return None  # индекса нет — ошибку покажет обычная генерация
+
+
+async def _once(text: str) -> AsyncIterator[str]:
+    yield text
 
 
 @app.post("/quiz", response_model=QuizResponse)
-def quiz(req: QuizRequest):
-    history = [{"role": h.role, "content": h.content} for h in (req.history or [])]
-    out = generate_quiz(req.topic, req.num, history=history)
-    return QuizResponse(**out)
+async def quiz(req: QuizRequest):
+    await _require_conversation(req)
+    ready = await _pregenerated(req.pregenerated, "quiz", req.topic, req.num)
+    if ready is not None:
+        out = {"topic": req.topic, "questions": ready, "pregenerated": True}
+    else:
+        out = await agenerate_quiz(req.topic, req.num, history=_history(req), conversation_id=req.conversation_id)
+    saved = await _persist(req, "quiz", req.topic, _quiz_text(req.topic, out["questions"]))
+    return QuizResponse(**out, **saved)
 
 
 @app.post("/task", response_model=TaskResponse)
-def task(req: TaskRequest):
-    history = [{"role": h.role, "content": h.content} for h in (req.history or [])]
-    out = generate_task(req.topic, history=history)
-    return TaskResponse(**out)
+async def task(req: TaskRequest):
+    await _require_conversation(req)
+    ready = await _pregenerated(req.pregenerated, "task", req.topic)
+    if ready is not None:
+        out = {"topic": req.topic, "task": ready, "pregenerated": True}
+    else:
+        out = await agenerate_task(req.topic, history=_history(req), conversation_id=req.conversation_id)
+    saved = await _persist(req, "task", req.topic, _task_text(req.topic, out["task"]))
+    return TaskResponse(**out, **saved)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _save_turn(
+    conversation_id: Optional[int],
+    user_content: str,
+    answer: str,
+    user_id: Optional[str] = None,
+    conversation_type: Optional[str] = None,
+) -> dict:
+    db = SessionLocal()
+    try:
+        saved = crud.append_turn(
+            db,
+            user_content,
+            answer,
+            conversation_id=conversation_id,
+            user_id=user_id,
+            title=user_content[:80],
+            conversation_type=conversation_type,
+        )
+        if saved is None:
+            # диалог удалён, пока шла генерация
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        conversation_id, user_msg, assistant_msg = saved
+        return {
+            "conversation_id": conversation_id,
+            "user_message_id": user_msg.id,
+            "assistant_message_id": assistant_msg.id,
+        }
+    finally:
+        db.close()
+
+
+def _conversation_exists(conversation_id: int) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.get_conversation(db, conversation_id) is not None
+    finally:
+        db.close()
+
+
+async def _require_conversation(req: AskRequest | QuizRequest | TaskRequest) -> None:
+    """404 для неизвестного conversation_id — до генерации и до заголовков потока."""
+    if req.conversation_id is not None and not await asyncio.to_thread(_conversation_exists, req.conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+async def _persist(
+    req: AskRequest | QuizRequest | TaskRequest, conversation_type: str, user_content: str, answer: str
+) -> dict:
+    """Сохраняет ход в диалог запроса (или в новый диалог req.user_id); {} — сохранять некуда.
+
+    Если диалог исчез, пока шла генерация, — HTTPException 404.
+    """
+    if req.conversation_id is None and not req.user_id:
+        return {}
+    return await asyncio.to_thread(
+        _save_turn, req.conversation_id, user_content, answer, req.user_id, conversation_type
+    )
+
+
+async def _event_stream(
+    tokens: AsyncIterator[str],
+    save: Callable[[str], Awaitable[dict]],
+    context_stats: Optional[dict] = None,
+) -> StreamingResponse:
+    """Оборачивает поток фрагментов ответа в Server-Sent Events.
+
+    События: token (очередной фрагмент), done (полный ответ, время до первого
+    фрагмента, общее время и статистика отбора контекста) или error. Готовый
+    ответ передаётся в save; её результат (id сохранённых сообщений)
+    дописывается в done, а HTTPException из save превращается в error.
+
+    Первый фрагмент ожидается до отправки заголовков, поэтому перегрузка
+    (Overloaded) и ошибки поиска возвращаются обычным HTTP-ответом.
+    """
+    started = time.perf_counter()
+    try:
+        first = await tokens.__anext__()
+    except StopAsyncIteration:
+        first = None
+    ttft_ms = (time.perf_counter() - started) * 1000
+
+    async def events() -> AsyncIterator[str]:
+        parts: List[str] = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield _sse("token", {"token": first})
+                async for token in tokens:
+                    parts.append(token)
+                    yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        finally:
+            await tokens.aclose()
+        answer = "".join(parts)
+        done = {"answer": answer, "ttft_ms": ttft_ms, "total_ms": (time.perf_counter() - started) * 1000}
+        if context_stats:
+            done["context"] = context_stats
+        try:
+            done.update(await save(answer))
+        except HTTPException as e:
+            yield _sse("error", {"detail": e.detail})
+            return
+        yield _sse("done", done)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest):
+    await _require_conversation(req)
+    qa = RAGQA(k=req.k or 5)
+    stats: dict = {}
+    tokens = qa.astream(req.question, history=_history(req), conversation_id=req.conversation_id, context_stats=stats)
+    return await _event_stream(tokens, lambda answer: _persist(req, "question", req.question, answer), stats)
+
+
+@app.post("/quiz/stream")
+async def quiz_stream(req: QuizRequest):
+    await _require_conversation(req)
+    ready = await _pregenerated(req.pregenerated, "quiz", req.topic, req.num)
+
+    async def save(answer: str) -> dict:
+        return await _persist(req, "quiz", req.topic, _quiz_text(req.topic, answer))
+
+    if ready is not None:
+        return await _event_stream(_once(ready), save)
+    stats: dict = {}
+    tokens = astream_quiz(
+        req.topic, req.num, history=_history(req), conversation_id=req.conversation_id, context_stats=stats
+    )
+    return await _event_stream(tokens, save, stats)
+
+
+@app.post("/task/stream")
+async def task_stream(req: TaskRequest):
+    await _require_conversation(req)
+    ready = await _pregenerated(req.pregenerated, "task", req.topic)
+
+    async def save(answer: str) -> dict:
+        return await _persist(req, "task", req.topic, _task_text(req.topic, answer))
+
+    if ready is not None:
+        return await _event_stream(_once(ready), save)
+    stats: dict = {}
+    tokens = astream_task(req.topic, history=_history(req), conversation_id=req.conversation_id, context_stats=stats)
+    return await _event_stream(tokens, save, stats)
 
 
 # Эндпоинты для работы с историей диалогов
@@ -179,47 +549,79 @@ def get_conversation(
 @app.get("/users/{user_id}/conversations")
 def get_user_conversations(
     user_id: str,
-    skip: int = 0,
+    skip: int = Query(0, deprecated=True, description="Не поддерживается: используйте cursor"),
     limit: int = 100,
+    cursor: str | None = None,
     search: str | None = None,
     conversation_type: str | None = None,
     date_from: str | None = None,
     date_to: str | None = None,
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ):
-    """Получение всех диалогов пользователя с фильтрацией и поиском."""
-    from datetime import datetime
-    
+    """Получение всех диалогов пользователя с фильтрацией и поиском.
+
+    Следующая страница — с cursor=next_cursor из ответа (next_cursor=null —
+    страниц больше нет). skip (OFFSET) больше не поддерживается: ненулевое
+    значение отклоняется с 400, а не отдаёт молча первую страницу. Общее число
+    диалогов (total) считается отдельным запросом; include_total=false его
+    отключает для клиентов, которым хватает next_cursor.
+    """
     # Преобразуем строки дат в datetime
     date_from_dt = datetime.fromisoformat(date_from) if date_from else None
     date_to_dt = datetime.fromisoformat(date_to) if date_to else None
+    limit = max(1, min(limit, 500))
+    if skip:
+        raise HTTPException(status_code=400, detail="skip is no longer supported, use cursor=next_cursor")
     
-    conversations = crud.get_user_conversations(
-        db, user_id, skip, limit, search, conversation_type, date_from_dt, date_to_dt
-    )
-    total = crud.count_user_conversations(
-        db, user_id, search, conversation_type, date_from_dt, date_to_dt
-    )
+    try:
+        rows, next_cursor = crud.list_user_conversations(
+            db, user_id, limit, cursor, search, conversation_type, date_from_dt, date_to_dt
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Формируем ответ с количеством сообщений
-    result = []
-    for conv in conversations:
-        result.append({
-            "id": conv.id,
-            "user_id": conv.user_id,
-            "title": conv.title,
-            "conversation_type": conv.conversation_type,
-            "created_at": conv.created_at,
-            "updated_at": conv.updated_at,
-            "message_count": len(conv.messages)
-        })
+    # Число сообщений посчитано в том же запросе
+    result = [
+        {
+            "id": row.id,
+            "user_id": row.user_id,
+            "title": row.title,
+            "conversation_type": row.conversation_type,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "message_count": row.message_count
+        }
+        for row in rows
+    ]
     
-    return {
+    response = {
         "conversations": result,
-        "total": total,
-        "skip": skip,
+        "next_cursor": next_cursor,
         "limit": limit
     }
+    if include_total:
+        response["total"] = crud.count_user_conversations(
+            db, user_id, search, conversation_type, date_from_dt, date_to_dt
+        )
+    return response
+
+
+@app.get("/users/{user_id}/search")
+def search_user_conversations(
+    user_id: str,
+    q: str,
+    limit: int = 20,
+    conversation_type: str | None = None,
+    db: Session = Depends(get_db)
+):
+    """Полнотекстовый поиск по заголовкам и сообщениям диалогов пользователя.
+
+    Результаты — по убыванию релевантности, с фрагментом текста, где слова
+    запроса выделены <mark>, и id найденного сообщения.
+    """
+    limit = max(1, min(limit, 100))
+    return {"results": crud.search_conversations(db, user_id, q, limit, conversation_type)}
 
 
 @app.delete("/conversations/{conversation_id}")
@@ -254,6 +656,37 @@ def add_message(
     return db_message
 
 
+@app.post("/turns", response_model=TurnResponse)
+def append_turn(
+    turn: TurnCreate,
+    db: Session = Depends(get_db)
+):
+    """Сохранение хода диалога (вопрос и ответ) одной транзакцией.
+
+    Заменяет два вызова POST /messages; без conversation_id создаёт диалог.
+    """
+    if turn.conversation_id is None and not (turn.user_id and turn.conversation_type):
+        raise HTTPException(status_code=400, detail="Without conversation_id, user_id and conversation_type are required")
+    saved = crud.append_turn(
+        db,
+        turn.user_content,
+        turn.assistant_content,
+        conversation_id=turn.conversation_id,
+        user_id=turn.user_id,
+        title=turn.title or turn.user_content[:80],
+        conversation_type=turn.conversation_type
+    )
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    conversation_id, user_msg, assistant_msg = saved
+    return TurnResponse(
+        conversation_id=conversation_id,
+        created=turn.conversation_id is None,
+        user_message=MessageResponse.model_validate(user_msg),
+        assistant_message=MessageResponse.model_validate(assistant_msg),
+    )
+
+
 @app.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 def get_conversation_messages(
     conversation_id: int,
@@ -282,10 +715,13 @@ def export_conversation(
     conversation_id: int,
     db: Session = Depends(get_db)
 ):
-    """Экспорт диалога в JSON формате."""
+    """Экспорт диалога в JSON формате (вынесенного политикой хранения — из архива)."""
     conversation = crud.get_conversation(db, conversation_id)
     if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+        archived = read_archived(db, conversation_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return archived
     
     messages = crud.get_conversation_messages(db, conversation_id)
     
@@ -309,3 +745,30 @@ def export_conversation(
     
     return export_data
 
+
+
+@app.get("/export")
+def export_conversations(
+    user_id: str | None = None,
+    conversation_type: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    gzip: bool = False,
+):
+    """Потоковая выгрузка диалогов в NDJSON (для аналитики).
+
+    Строка {"record": "conversation", ...}, за ней строки {"record": "message", ...}
+    этого диалога; без фильтров — все пользователи. gzip=true — сжатый поток.
+    """
+    try:
+        date_from_dt = datetime.fromisoformat(date_from) if date_from else None
+        date_to_dt = datetime.fromisoformat(date_to) if date_to else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {e}")
+    records = iter_export(user_id, conversation_type, date_from_dt, date_to_dt)
+    filename = "conversations.ndjson.gz" if gzip else "conversations.ndjson"
+    return StreamingResponse(
+        ndjson_chunks(records, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
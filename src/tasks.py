@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+import asyncio
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 
-from .llm import get_chat_llm
-from .ingest import load_vector_store
+from .engine import RAGEngine, get_engine
+from .gate import REFUSAL_TEXT, get_gate
+from .config import context_cfg
+from .context import select_context
+from .history import Prompt, build_prompt_messages
+from .llm import ainvoke, astream_text, invoke, response_text, stream_text
 
 
 TASK_SYSTEM = (
@@ -41,30 +46,92 @@ TASK_PROMPT = ChatPromptTemplate.from_messages([
 ])
 
 
-def generate_task(topic: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, str]:
-    vdb = load_vector_store()
-    retriever = vdb.as_retriever(k=8)
-    context_docs = retriever.invoke(topic)
-    context = "\n---\n".join(d.page_content for d in context_docs)
-
-    # Формируем историю сообщений
-    messages = [SystemMessage(content=TASK_SYSTEM)]
-    
-    if history:
-        for msg in history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                messages.append(AIMessage(content=msg["content"]))
-    
-    # Добавляем текущий запрос с контекстом
-    prompt_text = f"Составь задание по теме: {topic}. Ограничивайся только информацией из Контекста.\nВключи: цель задания, формулировку, критерии оценивания, ожидаемый формат ответа.\n\nКонтекст:\n{context}\n\nЗадание:"
-    messages.append(HumanMessage(content=prompt_text))
-    
-    # Вызываем LLM
-    llm = get_chat_llm()
-    response = llm.invoke(messages)
-    out = response.content if hasattr(response, 'content') else str(response)
-    
-    return {"topic": topic, "task": out}
+def build_task_messages(
+    topic: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    engine: RAGEngine | None = None,
+    conversation_id: Optional[int] = None,
+) -> Optional[Prompt]:
+    """Промпт для LLM; None, если тема отсечена фильтром релевантности."""
+    engine = engine or get_engine()
+    candidates = engine.candidates(topic, 8 * context_cfg.fetch_factor)
+    if not get_gate().allows(candidates.scored()):
+        return None
+    # история и контекст укладываются в окно модели: старые ходы — в сводку,
+    # из найденных чанков убираются повторы и перекрытия
+    return build_prompt_messages(
+        TASK_SYSTEM,
+        history,
+        lambda budget: select_context(candidates, 8, budget),
+        lambda context: f"Составь задание по теме: {topic}. Ограничивайся только информацией из Контекста.\nВключи: цель задания, формулировку, критерии оценивания, ожидаемый формат ответа.\n\nКонтекст:\n{context}\n\nЗадание:",
+        engine.llm,
+        conversation_id,
+    )
 
+
+def generate_task(
+    topic: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    engine: RAGEngine | None = None,
+    conversation_id: Optional[int] = None,
+) -> Dict[str, object]:
+    engine = engine or get_engine()
+    prompt = build_task_messages(topic, history, engine, conversation_id)
+    if prompt is None:
+        return {"topic": topic, "task": REFUSAL_TEXT}
+    response = invoke(engine.llm, prompt.messages)
+    return {"topic": topic, "task": response_text(response), "context": prompt.context}
+
+
+def stream_task(
+    topic: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    engine: RAGEngine | None = None,
+    conversation_id: Optional[int] = None,
+    context_stats: Optional[Dict[str, int]] = None,
+) -> Iterator[str]:
+    """Потоковый вариант generate_task: отдаёт фрагменты ответа по мере генерации.
+
+    Если передан context_stats, в него записывается статистика отбора контекста.
+    """
+    engine = engine or get_engine()
+    prompt = build_task_messages(topic, history, engine, conversation_id)
+    if prompt is None:
+        yield REFUSAL_TEXT
+        return
+    if context_stats is not None:
+        context_stats.update(prompt.context)
+    yield from stream_text(engine.llm, prompt.messages)
+
+
+async def agenerate_task(
+    topic: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    engine: RAGEngine | None = None,
+    conversation_id: Optional[int] = None,
+) -> Dict[str, object]:
+    """Асинхронный вариант generate_task: поиск в пуле потоков, вызов модели через ограничитель."""
+    engine = engine or get_engine()
+    prompt = await asyncio.to_thread(build_task_messages, topic, history, engine, conversation_id)
+    if prompt is None:
+        return {"topic": topic, "task": REFUSAL_TEXT}
+    response = await ainvoke(engine.llm, prompt.messages)
+    return {"topic": topic, "task": response_text(response), "context": prompt.context}
+
+
+async def astream_task(
+    topic: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    engine: RAGEngine | None = None,
+    conversation_id: Optional[int] = None,
+    context_stats: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[str]:
+    engine = engine or get_engine()
+    prompt = await asyncio.to_thread(build_task_messages, topic, history, engine, conversation_id)
+    if prompt is None:
+        yield REFUSAL_TEXT
+        return
+    if context_stats is not None:
+        context_stats.update(prompt.context)
+    async for token in astream_text(engine.llm, prompt.messages):
+        yield token
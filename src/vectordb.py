@@ -1,35 +1,246 @@
 from __future__ import annotations
 
+import math
+import os
+import pickle
+import uuid
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, List, Optional, Sequence, Tuple
 
-from langchain_community.vectorstores import FAISS
+import faiss
+import numpy as np
 from langchain.schema import Document
 
+from .chunkstore import ChunkStore
+from .config import index_cfg
+
+
+INDEX_NAME = "index.faiss"
+CHUNKS_NAME = "chunks.sqlite3"
+INDEX_FILES = (INDEX_NAME, CHUNKS_NAME)
+LEGACY_DOCSTORE = "index.pkl"
+INDEX_TYPES = ("flat", "ivf", "hnsw", "pq", "ivfpq")
+
+
+def index_factory_string(n_vectors: int) -> str:
+    """Строка faiss.index_factory для настроенного типа индекса и размера корпуса.
+
+    Если векторов слишком мало для обучения IVF/PQ, используется точный Flat.
+    """
+    kind = index_cfg.index_type.lower()
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE={index_cfg.index_type!r}, expected one of {INDEX_TYPES}")
+    nlist = index_cfg.nlist or max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    pq = f"PQ{index_cfg.pq_m}x{index_cfg.pq_nbits}"
+    if kind in ("pq", "ivfpq") and n_vectors < 2 ** index_cfg.pq_nbits:
+        return "Flat"
+    if kind == "ivf":
+        return f"IVF{nlist},Flat" if n_vectors >= nlist else "Flat"
+    if kind == "ivfpq":
+        return f"IVF{nlist},{pq}" if n_vectors >= nlist else pq
+    if kind == "hnsw":
+        return f"HNSW{index_cfg.hnsw_m}"
+    if kind == "pq":
+        return pq
+    return "Flat"
+
+
+def base_index(index):
+    """Индекс под обёрткой IndexIDMap (или сам индекс, если обёртки нет)."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index) -> None:
+    """Применяет параметры поиска (nprobe, efSearch) из конфигурации."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = index_cfg.nprobe
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = index_cfg.ef_search
+
+
+def build_index(vectors: np.ndarray):
+    """Создаёт и обучает FAISS-индекс настроенного типа (L2); векторы не добавляются.
+
+    Метки векторов — row_id чанков в ChunkStore: IVF хранит их сам, остальные
+    типы оборачиваются в IndexIDMap2.
+    """
+    index = faiss.index_factory(vectors.shape[1], index_factory_string(len(vectors)), faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = index_cfg.ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    if faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+    set_search_params(index)
+    return index
+
+
+def describe_index(index) -> str:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return f"{type(index).__name__}(nlist={ivf.nlist}, nprobe={ivf.nprobe}, ntotal={index.ntotal})"
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return f"{type(base).__name__}(M={base.hnsw.nb_neighbors(1)}, efSearch={base.hnsw.efSearch}, ntotal={index.ntotal})"
+    return f"{type(base).__name__}(ntotal={index.ntotal})"
+
 
 class VectorDB:
-    def __init__(self, path: Path, faiss_store: FAISS | None = None) -> None:
+    """FAISS-индекс векторов и ChunkStore с текстом чанков в одном каталоге.
+
+    Текст и метаданные не держатся в памяти: после поиска из SQLite читаются
+    только найденные top-k чанков. Полная перестройка пишется во временные
+    файлы и подменяет старые атомарно.
+    """
+
+    def __init__(self, path: Path, index, store: ChunkStore, embeddings=None, building: bool = False) -> None:
         self.path = Path(path)
-        self.faiss = faiss_store
+        self.index = index
+        self.store = store
+        self.embeddings = embeddings
+        self._building = building
 
     @classmethod
-    def from_documents(cls, docs: Iterable[Document], embeddings, path: Path) -> "VectorDB":
-        store = FAISS.from_documents(list(docs), embeddings)
-        return cls(path=path, faiss_store=store)
+    def from_documents(
+        cls, docs: Iterable[Document], embeddings, path: Path, ids: Optional[List[str]] = None
+    ) -> "VectorDB":
+        docs = list(docs)
+        ids = ids or [uuid.uuid4().hex for _ in docs]
+        vectors = np.asarray(embeddings.embed_documents([d.page_content for d in docs]), dtype=np.float32)
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        building = path / (CHUNKS_NAME + ".building")
+        building.unlink(missing_ok=True)
+        store = ChunkStore(building, writable=True)
+        rows = store.insert(ids, docs)
+        index = build_index(vectors)
+        index.add_with_ids(vectors, np.asarray(rows, dtype=np.int64))
+        return cls(path, index, store, embeddings, building=True)
+
+    @classmethod
+    def load(cls, path: Path, embeddings=None, writable: bool = False) -> "VectorDB":
+        path = Path(path)
+        cls.check_format(path)
+        index = faiss.read_index(str(path / INDEX_NAME))
+        set_search_params(index)
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None and not writable:
+            # прямое отображение id -> вектор, чтобы reconstruct работал и для IVF
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return cls(path, index, ChunkStore(path / CHUNKS_NAME, writable=writable), embeddings)
+
+    @staticmethod
+    def check_format(path: Path) -> None:
+        """FileNotFoundError с подсказкой, если в каталоге лежит только индекс старого формата.
+
+        index.pkl сам не распаковывается: перевод выполняется явно командой migrate-index.
+        """
+        path = Path(path)
+        if not (path / CHUNKS_NAME).exists() and (path / LEGACY_DOCSTORE).exists():
+            raise FileNotFoundError(
+                f"В {path} индекс старого формата ({LEGACY_DOCSTORE}). "
+                "Выполните: python -m src.cli migrate-index"
+            )
+
+    @property
+    def supports_delete(self) -> bool:
+        # HNSW в FAISS не умеет удалять векторы — такой индекс перестраивается целиком
+        return not isinstance(base_index(self.index), faiss.IndexHNSW)
+
+    def add_documents(self, docs: List[Document], ids: List[str]) -> None:
+        if not docs:
+            return
+        vectors = np.asarray(self.embeddings.embed_documents([d.page_content for d in docs]), dtype=np.float32)
+        rows = self.store.insert(ids, docs)
+        self.index.add_with_ids(vectors, np.asarray(rows, dtype=np.int64))
+
+    def delete(self, ids: List[str]) -> None:
+        """Удаляет чанки по id; неизвестные id пропускаются."""
+        rows = self.store.delete(ids)
+        if rows:
+            self.index.remove_ids(np.asarray(rows, dtype=np.int64))
 
     def save(self) -> None:
-        if self.faiss is None:
-            raise ValueError("FAISS store is not initialized")
         self.path.mkdir(parents=True, exist_ok=True)
-        self.faiss.save_local(str(self.path))
+        self.store.commit()
+        tmp = self.path / (INDEX_NAME + ".tmp")
+        faiss.write_index(self.index, str(tmp))
+        if self._building:
+            self.store.close()
+            os.replace(self.store.path, self.path / CHUNKS_NAME)
+            self.store = ChunkStore(self.path / CHUNKS_NAME, writable=True)
+            self._building = False
+        os.replace(tmp, self.path / INDEX_NAME)
 
-    @classmethod
-    def load(cls, path: Path, embeddings) -> "VectorDB":
-        store = FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
-        return cls(path=path, faiss_store=store)
+    def search_by_vector(self, vector: Sequence[float], k: int = 5) -> List[Tuple[int, float]]:
+        """Ищет k ближайших чанков; возвращает пары (row_id чанка, L2-расстояние)."""
+        return self.search_by_vectors(np.asarray([vector], dtype=np.float32), k)[0]
+
+    def search_by_vectors(self, vectors: np.ndarray, k: int = 5) -> List[List[Tuple[int, float]]]:
+        """Пакетный поиск: один вызов FAISS на всю матрицу запросов."""
+        distances, labels = self.index.search(np.ascontiguousarray(vectors, dtype=np.float32), k)
+        return [
+            [(int(label), float(dist)) for label, dist in zip(row_labels, row_dist) if label != -1]
+            for row_labels, row_dist in zip(labels, distances)
+        ]
+
+    def reconstruct(self, row_ids: Sequence[int]) -> Optional[np.ndarray]:
+        """Векторы чанков по row_id из самого индекса (у PQ — приближённые).
+
+        None, если индекс не умеет восстанавливать векторы.
+        """
+        if not len(row_ids):
+            return None
+        try:
+            return np.vstack([self.index.reconstruct(int(r)) for r in row_ids])
+        except RuntimeError:
+            return None
+
+    def get_documents(self, ids: Sequence[int]) -> List[Document]:
+        return self.store.get(ids)
+
+    @staticmethod
+    def stamp(path: Path) -> tuple | None:
+        """Отпечаток файлов индекса на диске (mtime и размер), None если индекса нет."""
+        parts = []
+        for name in INDEX_FILES:
+            try:
+                st = (Path(path) / name).stat()
+            except FileNotFoundError:
+                return None
+            parts.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(parts)
+
+    def close(self) -> None:
+        self.store.close()
+
+
+def migrate_legacy_store(path: Path) -> int:
+    """Однократно переводит индекс langchain (index.faiss + index.pkl) в новый формат.
 
-    def as_retriever(self, k: int = 5):
-        if self.faiss is None:
-            raise ValueError("FAISS store is not initialized")
-        return self.faiss.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    index.pkl распаковывается через pickle — запускайте только для своих файлов.
+    Возвращает число перенесённых чанков; index.pkl после переноса удаляется.
+    """
+    path = Path(path)
+    with open(path / LEGACY_DOCSTORE, "rb") as f:
+        docstore, index_to_id = pickle.load(f)
+    legacy = faiss.read_index(str(path / INDEX_NAME))
+    vectors = legacy.reconstruct_n(0, legacy.ntotal)
+    ids = [index_to_id[i] for i in range(legacy.ntotal)]
+    docs = [docstore.search(chunk_id) for chunk_id in ids]
 
+    building = path / (CHUNKS_NAME + ".building")
+    building.unlink(missing_ok=True)
+    store = ChunkStore(building, writable=True)
+    rows = store.insert(ids, docs)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(legacy.d))
+    index.add_with_ids(vectors, np.asarray(rows, dtype=np.int64))
+    vdb = VectorDB(path, index, store, building=True)
+    vdb.save()
+    vdb.close()
+    (path / LEGACY_DOCSTORE).unlink()
+    return len(rows)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from src import rag, server
+from src.gate import RelevanceGate
+from src.rag import RAGQA
+
+
+class FlakyModel(BaseChatModel):
+    """Отвечает эхом вопроса; на вопрос со словом «сбой» падает."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "flaky"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        question = messages[-1].content.split("\n")[0]
+        if "сбой" in question:
+            raise RuntimeError("model crashed")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"Ответ на «{question}»"))])
+
+
+QUESTIONS = ["Что такое нормальные формы?", "Вызови сбой модели", "Зачем нужны индексы?"]
+
+
+def _qa(rag_engine, monkeypatch) -> RAGQA:
+    monkeypatch.setattr(rag, "get_gate", lambda: RelevanceGate(None))
+    return RAGQA(llm=FlakyModel(), k=2, engine=rag_engine)
+
+
+def test_failed_item_does_not_break_the_batch(rag_engine, monkeypatch):
+    qa = _qa(rag_engine, monkeypatch)
+
+    async def collect():
+        return [item async for item in qa.aask_batch(QUESTIONS, concurrency=2)]
+
+    results = sorted(asyncio.run(collect()), key=lambda item: item["index"])
+    assert [item["question"] for item in results] == QUESTIONS
+    failed = results[1]
+    assert failed["error"] == "model crashed" and "answer" not in failed
+    for item in (results[0], results[2]):
+        assert item["answer"] == f"Ответ на «Вопрос: {item['question']}»"
+        assert item["context"]["selected"] >= 1 and item["ms"] >= 0
+
+
+def test_batch_endpoint_streams_ndjson_with_error_count(rag_engine, monkeypatch):
+    qa = _qa(rag_engine, monkeypatch)
+    monkeypatch.setattr(server, "RAGQA", lambda k=5: qa)
+    client = TestClient(server.app)
+
+    response = client.post("/ask/batch", json={"questions": QUESTIONS})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    *items, done = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(item["index"] for item in items) == [0, 1, 2]
+    assert (done["done"], done["total"], done["errors"]) == (True, 3, 1)
+
+    too_many = client.post("/ask/batch", json={"questions": ["?"] * 10_000})
+    assert too_many.status_code == 413
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.batcher import MicroBatcher
+
+
+def _submit_all(batcher, items):
+    barrier = threading.Barrier(len(items))
+
+    def call(item):
+        barrier.wait()
+        return batcher.submit(item)
+
+    with ThreadPoolExecutor(len(items)) as pool:
+        return list(pool.map(call, items))
+
+
+def test_concurrent_submits_share_a_batch():
+    sizes = []
+
+    def handler(items):
+        sizes.append(len(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(handler, window=0.2, max_batch=32)
+    # каждый поток получает результат своего элемента
+    assert _submit_all(batcher, list(range(8))) == [i * 10 for i in range(8)]
+    assert sum(sizes) == 8 and len(sizes) < 8
+    assert batcher.stats()["items"] == 8 and batcher.stats()["avg_batch_size"] > 1
+
+
+def test_max_batch_is_respected():
+    sizes = []
+
+    def handler(items):
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(handler, window=0.2, max_batch=3)
+    assert _submit_all(batcher, list(range(7))) == list(range(7))
+    assert max(sizes) <= 3 and sum(sizes) == 7
+
+
+def test_handler_error_reaches_every_caller_and_worker_survives():
+    def handler(items):
+        if "bad" in items:
+            raise ValueError("сбой поиска")
+        return items
+
+    batcher = MicroBatcher(handler, window=0.2, max_batch=32)
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher.submit, item) for item in ("bad", "good")]
+        errors = [f.exception() for f in futures]
+    # "good" мог попасть в тот же пакет (ошибка) или в следующий (результат)
+    assert isinstance(errors[0], ValueError)
+    assert errors[1] is None or isinstance(errors[1], ValueError)
+    assert batcher.submit("after") == "after"
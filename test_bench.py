@@ -0,0 +1,30 @@
+from src import bench
+
+
+def test_list_conversations_stage_runs():
+    result = bench.run_benchmarks(docs=2, queries=5, stages=["db_list_conversations"])
+    stage = result["stages"]["db_list_conversations"]
+    assert "error" not in stage and stage["throughput"] > 0
+    assert bench.failed_stages(result) == []
+
+
+def test_crashed_stage_is_an_error_not_skipped(monkeypatch):
+    def boom(*_):
+        raise RuntimeError("сломано")
+
+    original = bench._stages
+
+    def stages(*args):
+        out = original(*args)
+        for stage in out:
+            if stage.name == "search":
+                stage.op = boom
+        return out
+
+    monkeypatch.setattr(bench, "_stages", stages)
+    result = bench.run_benchmarks(docs=2, queries=5, stages=["search", "format_docs"])
+    assert result["stages"]["search"] == {"error": "RuntimeError: сломано"}
+    assert bench.failed_stages(result) == ["search"]
+
+    regressions = bench.compare(result, result)
+    assert [r["stage"] for r in regressions] == ["search"]
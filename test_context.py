@@ -0,0 +1,69 @@
+import numpy as np
+from langchain.schema import Document
+
+from src.context import Candidates, join_overlapping, merge_adjacent, mmr, select_context
+
+
+def _chunk(text: str, index: int, file_hash: str = "f1") -> Document:
+    return Document(page_content=text, metadata={"file_hash": file_hash, "chunk_index": index})
+
+
+def test_mmr_drops_near_duplicates_and_prefers_diversity():
+    query = np.array([1.0, 0.0, 0.1])
+    vectors = np.array([
+        [1.0, 0.0, 0.0],     # самый релевантный
+        [0.99, 0.01, 0.0],   # почти дубликат первого
+        [0.6, 0.0, 0.8],     # менее релевантный, но о другом
+        [0.95, 0.31, 0.0],   # релевантнее третьего, но похож на первый
+    ])
+    selected, duplicates = mmr(query, vectors, k=3, lambda_=0.5, duplicate_threshold=0.97)
+    assert selected == [0, 2, 3] and duplicates == 1
+    # без штрафа за похожесть порядок — по релевантности
+    assert mmr(query, vectors, k=3, lambda_=1.0, duplicate_threshold=0.97)[0] == [0, 3, 2]
+
+
+def test_mmr_with_lambda_one_is_plain_relevance_order():
+    rng = np.random.default_rng(0)
+    query = rng.normal(size=8)
+    vectors = rng.normal(size=(10, 8))
+    selected, duplicates = mmr(query, vectors, k=4, lambda_=1.0, duplicate_threshold=1.01)
+    cosine = vectors @ query / np.linalg.norm(vectors, axis=1)
+    assert selected == list(np.argsort(-cosine)[:4]) and duplicates == 0
+    assert mmr(query, vectors[:0], k=4, lambda_=0.7, duplicate_threshold=0.95) == ([], 0)
+
+
+def test_join_overlapping_does_not_repeat_the_overlap():
+    a = "Первая нормальная форма требует атомарных значений."
+    b = "атомарных значений. Вторая форма убирает частичные зависимости."
+    assert join_overlapping(a, b, 40) == (
+        "Первая нормальная форма требует атомарных значений. Вторая форма убирает частичные зависимости."
+    )
+    assert join_overlapping("Без перекрытия.", "Другой текст.", 40) == "Без перекрытия.\nДругой текст."
+
+
+def test_merge_adjacent_joins_runs_within_a_file():
+    docs = [
+        _chunk("чанк 5", 5),
+        _chunk("чанк 3", 3),
+        _chunk("чанк 4", 4),
+        _chunk("другой файл 4", 4, file_hash="f2"),
+        _chunk("чанк 9", 9),
+    ]
+    merged, absorbed = merge_adjacent(docs, row_ids=list(range(len(docs))))
+    assert absorbed == 2
+    # склеенный фрагмент стоит на месте самого релевантного из своих чанков
+    assert [d.page_content for d in merged] == ["чанк 3\nчанк 4\nчанк 5", "другой файл 4", "чанк 9"]
+    assert merged[0].metadata["merged_chunks"] == 3
+    assert "merged_chunks" not in merged[1].metadata
+
+
+def test_select_context_fits_the_token_budget():
+    docs = [_chunk(f"Фрагмент {i}: " + "слово " * 60, i * 10) for i in range(4)]
+    candidates = Candidates(
+        query_vector=np.ones(4), row_ids=list(range(4)), docs=docs, distances=[0.1, 0.2, 0.3, 0.4],
+        vectors=np.eye(4),
+    )
+    context, stats = select_context(candidates, k=4, max_tokens=300)
+    assert context.startswith("Фрагмент 0") and "Фрагмент 3" not in context
+    assert stats["selected"] + stats["over_budget"] == 4 and stats["tokens"] <= 300
+    assert stats["tokens_saved"] == stats["tokens_naive"] - stats["tokens"] > 0
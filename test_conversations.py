@@ -0,0 +1,89 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from src import crud
+from src.database import SessionLocal
+
+
+def _walk(db, user_id, limit, between_pages=None):
+    ids, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = crud.list_user_conversations(db, user_id, limit=limit, cursor=cursor)
+        ids.extend(row.id for row in rows)
+        pages += 1
+        if cursor is None:
+            return ids, pages
+        if between_pages:
+            between_pages()
+
+
+def test_cursor_is_stable_across_inserts(db):
+    original = [crud.create_conversation(db, "u1", f"Диалог {i}", "question").id for i in range(7)]
+
+    # новые диалоги попадают в начало списка и не сдвигают уже выданные страницы
+    ids, _ = _walk(db, "u1", 3, lambda: crud.create_conversation(db, "u1", "Новый", "question"))
+    assert ids == sorted(original, reverse=True)
+
+
+def test_last_page(db):
+    for i in range(6):
+        crud.create_conversation(db, "u2", f"Диалог {i}", "question")
+
+    # страница ровно в limit строк — последняя, лишнего пустого запроса нет
+    ids, pages = _walk(db, "u2", 3)
+    assert len(ids) == 6 and pages == 2
+
+    rows, cursor = crud.list_user_conversations(db, "u2", limit=10)
+    assert len(rows) == 6 and cursor is None
+    assert crud.list_user_conversations(db, "nobody", limit=10) == ([], None)
+
+
+def test_listing_keeps_total_by_default():
+    from src.server import app
+
+    db = SessionLocal()
+    try:
+        for i in range(3):
+            crud.create_conversation(db, "api_user", f"Диалог {i}", "question")
+    finally:
+        db.close()
+    client = TestClient(app)
+
+    page = client.get("/users/api_user/conversations", params={"limit": 2}).json()
+    assert page["total"] == 3 and len(page["conversations"]) == 2 and page["next_cursor"]
+    rest = client.get("/users/api_user/conversations", params={"cursor": page["next_cursor"]}).json()
+    assert len(rest["conversations"]) == 1 and rest["next_cursor"] is None
+
+    lean = client.get("/users/api_user/conversations", params={"include_total": "false"}).json()
+    assert "total" not in lean
+
+    # OFFSET-пагинации больше нет: skip не игнорируется молча
+    response = client.get("/users/api_user/conversations", params={"skip": 20})
+    assert response.status_code == 400 and "cursor" in response.json()["detail"]
+
+
+def test_unknown_conversation_is_404_before_generation(monkeypatch):
+    from src import server
+
+    def no_model(*_, **__):
+        raise AssertionError("генерация не должна начинаться")
+
+    monkeypatch.setattr(server, "RAGQA", no_model)
+    monkeypatch.setattr(server, "agenerate_quiz", no_model)
+    monkeypatch.setattr(server, "astream_task", no_model)
+    client = TestClient(server.app)
+    for path, body in (
+        ("/ask", {"question": "Что такое индекс?"}),
+        ("/ask/stream", {"question": "Что такое индекс?"}),
+        ("/quiz", {"topic": "SQL"}),
+        ("/task/stream", {"topic": "SQL"}),
+    ):
+        response = client.post(path, json={**body, "conversation_id": 10**9})
+        assert response.status_code == 404, path
+        assert response.json() == {"detail": "Conversation not found"}
+
+    # диалог удалён во время генерации — сохранение тоже 404, а не пустой ответ
+    with pytest.raises(HTTPException) as e:
+        server._save_turn(10**9, "вопрос", "ответ")
+    assert e.value.status_code == 404
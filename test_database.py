@@ -52,7 +52,7 @@ def test_conversation_system():
         
         # Получаем все диалоги пользователя
         print("📋 Получение всех диалогов пользователя...")
-        user_conversations = crud.get_user_conversations(db, "test_user_123")
+        user_conversations, _ = crud.list_user_conversations(db, "test_user_123")
         print(f"✅ Найдено диалогов: {len(user_conversations)}\n")
         
         # Выводим сообщения
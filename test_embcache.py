@@ -0,0 +1,68 @@
+import multiprocessing
+
+import numpy as np
+
+from src.embcache import EmbeddingCache, text_key
+
+DIM = 8
+
+
+def _vector(text: str) -> np.ndarray:
+    return np.frombuffer(text_key(text) * 2, dtype=np.float32)[:DIM].copy()
+
+
+def _put(root, texts) -> None:
+    cache = EmbeddingCache(root, "test-model", 1 << 30)
+    for text in texts:
+        cache.put_many([text_key(text)], _vector(text)[None, :])
+        cache.flush()
+
+
+def _assert_complete(root, texts) -> None:
+    cache = EmbeddingCache(root, "test-model", 1 << 30)
+    _, vectors = cache.get_many(texts)
+    assert cache.misses == 0
+    for text, vec in zip(texts, vectors):
+        np.testing.assert_array_equal(vec, _vector(text))
+
+
+def test_interleaved_instances_share_directory(tmp_path):
+    a = EmbeddingCache(tmp_path, "test-model", 1 << 30)
+    b = EmbeddingCache(tmp_path, "test-model", 1 << 30)
+    texts = [f"текст {i}" for i in range(6)]
+    for i, text in enumerate(texts):
+        cache = a if i % 2 else b
+        cache.put_many([text_key(text)], _vector(text)[None, :])
+    a.flush()
+    b.flush()
+    # экземпляр видит строки, дописанные другим, без перезагрузки
+    _, vectors = a.get_many(texts)
+    assert all(v is not None for v in vectors)
+    _assert_complete(tmp_path, texts)
+
+
+def test_concurrent_processes(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    batches = [[f"процесс {p} текст {i}" for i in range(40)] for p in range(3)]
+    procs = [ctx.Process(target=_put, args=(tmp_path, texts)) for texts in batches]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(60)
+        assert proc.exitcode == 0
+    _assert_complete(tmp_path, [t for texts in batches for t in texts])
+
+
+def test_size_mismatch_is_not_loaded(tmp_path):
+    texts = [f"текст {i}" for i in range(4)]
+    _put(tmp_path, texts)
+    cache = EmbeddingCache(tmp_path, "test-model", 1 << 30)
+    with open(cache._vectors_path, "ab") as f:
+        f.write(b"\0" * 12)
+
+    cache = EmbeddingCache(tmp_path, "test-model", 1 << 30)
+    _, vectors = cache.get_many(texts)
+    assert vectors == [None] * len(texts)
+    # после сброса кэш снова пригоден для записи
+    _put(tmp_path, texts[:2])
+    _assert_complete(tmp_path, texts[:2])
@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import write_store
+from src.bench import HashEmbeddings
+from src.qcache import LRUCache
+
+
+def test_engine_reloads_index_when_stamp_changes(rag_engine, tmp_path):
+    old_vdb, old_version = rag_engine._current()
+    assert rag_engine.retrieve("нормальные формы", k=1)[0].page_content == "Нормальные формы отношений"
+    # соединение из другого потока тоже должно закрыться при замене индекса
+    worker = threading.Thread(target=lambda: old_vdb.store.count())
+    worker.start()
+    worker.join()
+    readers = list(old_vdb.store._readers)
+    assert len(readers) == 2
+
+    write_store(tmp_path, ["Транзакции и уровни изоляции", "Блокировки строк", "Журнал WAL"])
+
+    vdb, version = rag_engine._current()
+    assert vdb is not old_vdb and version != old_version
+    assert rag_engine.retrieve("уровни изоляции транзакции", k=1)[0].page_content == "Транзакции и уровни изоляции"
+    assert old_vdb.store._readers == []
+    for conn in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_unchanged_index_is_not_reloaded(rag_engine):
+    vdb, version = rag_engine._current()
+    assert rag_engine._current() == (vdb, version)
+
+
+class CountingEmbeddings(HashEmbeddings):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = 0
+
+    def embed_queries(self, texts):
+        self.calls += 1
+        return super().embed_queries(texts)
+
+
+def test_result_cache_is_invalidated_by_index_version(rag_engine, tmp_path):
+    rag_engine._embeddings = embeddings = CountingEmbeddings()
+    first = rag_engine.search("нормальные формы", k=2)
+    assert rag_engine.search("  нормальные   формы ", k=2) == first
+    stats = rag_engine.cache_stats()
+    assert stats["retrieval_results"]["hits"] == 1 and embeddings.calls == 1
+    version = stats["index_version"]
+
+    write_store(tmp_path, ["Нормальные формы и зависимости", "Блокировки строк", "Журнал WAL"])
+
+    hits = rag_engine.search("нормальные формы", k=2)
+    stats = rag_engine.cache_stats()
+    assert stats["index_version"] != version
+    assert stats["retrieval_results"]["hits"] == 1 and stats["retrieval_results"]["size"] == 1
+    # эмбеддинг запроса от версии индекса не зависит и берётся из кэша
+    assert embeddings.calls == 1
+    docs = rag_engine.vdb.get_documents([row_id for row_id, _ in hits])
+    assert docs[0].page_content == "Нормальные формы и зависимости"
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["size"] == 2 and cache.stats()["misses"] == 1
@@ -0,0 +1,61 @@
+import gzip
+import json
+
+from fastapi.testclient import TestClient
+
+from src import crud
+from src.database import SessionLocal
+from src.export import iter_export, ndjson_chunks
+
+
+def _seed(db, user_id: str):
+    quiz = crud.create_conversation(db, user_id, "Квиз по SQL", "quiz")
+    crud.add_message(db, quiz.id, "user", "SQL")
+    crud.add_message(db, quiz.id, "assistant", "Вопрос 1: что делает JOIN?")
+    empty = crud.create_conversation(db, user_id, "Пустой", "question")
+    other = crud.create_conversation(db, "someone_else", "Чужой", "question")
+    crud.add_message(db, other.id, "user", "Привет")
+    return quiz.id, empty.id
+
+
+def test_records_follow_their_conversation(db, db_engine):
+    quiz_id, empty_id = _seed(db, "u1")
+    records = list(iter_export(user_id="u1", chunk_rows=1, db_engine=db_engine))
+    assert [(r["record"], r.get("conversation_id", r["id"])) for r in records] == [
+        ("conversation", quiz_id), ("message", quiz_id), ("message", quiz_id), ("conversation", empty_id),
+    ]
+    assert [r["role"] for r in records if r["record"] == "message"] == ["user", "assistant"]
+
+    quizzes = list(iter_export(user_id="u1", conversation_type="quiz", db_engine=db_engine))
+    assert {r["record"] for r in quizzes} == {"conversation", "message"} and len(quizzes) == 3
+    assert len([r for r in iter_export(db_engine=db_engine) if r["record"] == "conversation"]) == 3
+
+
+def test_ndjson_chunks_plain_and_gzip():
+    records = [{"record": "message", "id": i, "content": "текст " * 20} for i in range(50)]
+    plain = list(ndjson_chunks(records, chunk_bytes=1024))
+    assert len(plain) > 1
+    lines = b"".join(plain).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == records
+
+    packed = b"".join(ndjson_chunks(records, compress=True, chunk_bytes=1024))
+    assert gzip.decompress(packed) == b"".join(plain)
+
+
+def test_export_endpoint_streams_ndjson():
+    from src.server import app
+
+    db = SessionLocal()
+    try:
+        quiz_id, _ = _seed(db, "export_user")
+    finally:
+        db.close()
+    client = TestClient(app)
+
+    response = client.get("/export", params={"user_id": "export_user", "gzip": "true"})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/gzip"
+    records = [json.loads(line) for line in gzip.decompress(response.content).decode("utf-8").splitlines()]
+    assert (records[0]["record"], records[0]["id"], records[0]["user_id"]) == ("conversation", quiz_id, "export_user")
+    assert len(records) == 4
+
+    assert client.get("/export", params={"date_from": "вчера"}).status_code == 400
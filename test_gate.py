@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from src.gate import RelevanceGate, calibrate, gate_path, read_threshold, save_calibration
+
+
+def test_separable_examples_put_threshold_in_the_gap():
+    result = calibrate([0.2, 0.3, 0.4, 0.5], [0.9, 1.0])
+    assert result["max_distance"] == pytest.approx(0.7)
+    assert result["relevant_passed"] == 1.0 and result["irrelevant_refused"] == 1.0
+
+
+def test_overlapping_examples_keep_target_recall():
+    relevant = [0.1 * i for i in range(1, 11)]
+    result = calibrate(relevant, [0.5, 0.95, 1.2], target_recall=0.8)
+    # порог не ниже 80-го перцентиля релевантных и не доходит до 0.95
+    assert 0.9 <= result["max_distance"] < 0.95
+    assert result["relevant_passed"] >= 0.8
+    assert result["irrelevant_refused"] == pytest.approx(2 / 3)
+
+
+def test_calibration_needs_relevant_examples():
+    with pytest.raises(ValueError):
+        calibrate([], [1.0])
+
+
+def test_saved_threshold_is_used_only_for_its_model(tmp_path):
+    save_calibration(calibrate([0.2, 0.4], [1.0]), tmp_path)
+    assert read_threshold(tmp_path) == pytest.approx(0.7)
+
+    data = json.loads(gate_path(tmp_path).read_text(encoding="utf-8"))
+    gate_path(tmp_path).write_text(json.dumps({**data, "model": "other-model"}), encoding="utf-8")
+    assert read_threshold(tmp_path) is None
+
+
+def test_gate_refuses_distant_hits():
+    gate = RelevanceGate(max_distance=0.7)
+    assert gate.allows([("chunk", 0.5)])
+    assert not gate.allows([("chunk", 0.8)])
+    assert not gate.allows([])
+    assert gate.stats() == {"max_distance": 0.7, "checked": 3, "refused": 2}
+    assert RelevanceGate().allows([])
@@ -0,0 +1,51 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src import llm as llm_module
+from src.history import HistoryManager
+from src.limiter import ConcurrencyLimiter
+
+
+def _history(first: str, n: int = 6):
+    turns = [{"role": "user", "content": first}]
+    for i in range(1, n):
+        turns.append({"role": "assistant" if i % 2 else "user", "content": f"Ход {i}: " + "слово " * 50})
+    return turns
+
+
+def test_summary_waits_for_limiter_slot(monkeypatch):
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_waiting=0, wait_timeout=0.1)
+    monkeypatch.setattr(llm_module, "get_llm_limiter", lambda: limiter)
+    model = FakeListChatModel(responses=["Сводка диалога"])
+    history = _history("Что такое индекс?")
+
+    async def scenario():
+        limiter.bind(asyncio.get_running_loop())
+        # слот занят генерацией ответа — сводка из рабочего потока получает Overloaded
+        async with limiter.slot():
+            summary, recent = await asyncio.to_thread(HistoryManager(budget=250).prepare, history, model)
+        assert summary == "" and limiter.rejected == 1
+        # слот свободен — сводка строится и слот возвращается
+        manager = HistoryManager(budget=250)
+        summary, recent = await asyncio.to_thread(manager.prepare, history, model)
+        assert summary == "Сводка диалога" and manager.summaries == 1
+        assert limiter.active == 0
+        return recent
+
+    recent = asyncio.run(scenario())
+    assert recent == history[-2:]
+
+
+def test_anonymous_summaries_are_keyed_by_folded_turns():
+    model = FakeListChatModel(responses=["Сводка A", "Сводка B"])
+    manager = HistoryManager(budget=250)
+    a = _history("Привет")
+    b = _history("Привет")
+    b[1] = {"role": "assistant", "content": "Другой ответ: " + "слово " * 50}
+
+    assert manager.prepare(a, model)[0] == "Сводка A"
+    # тот же первый вопрос, другой диалог — сводка A не подходит и не затирается
+    assert manager.prepare(b, model)[0] == "Сводка B"
+    assert manager.prepare(a + [{"role": "user", "content": "Дальше"}], model)[0] == "Сводка A"
+    assert manager.summaries == 2
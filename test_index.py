@@ -0,0 +1,74 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from src import vectordb
+from src.bench import HashEmbeddings, synthetic_chunks
+from src.index_report import index_report
+from src.vectordb import VectorDB, build_index, describe_index, index_factory_string
+
+N, DIM = 2000, 32
+
+
+@pytest.fixture
+def index_type(monkeypatch):
+    def use(kind: str, **params) -> None:
+        cfg = replace(vectordb.index_cfg, index_type=kind, hnsw_m=16, pq_m=8, pq_nbits=4, **params)
+        monkeypatch.setattr(vectordb, "index_cfg", cfg)
+
+    return use
+
+
+@pytest.mark.parametrize("kind, described, deletes", [
+    ("flat", "IndexFlat", True),
+    ("ivf", "IndexIVFFlat(nlist=51, nprobe=8,", True),
+    ("hnsw", "IndexHNSWFlat(M=16, efSearch=64,", False),
+    ("pq", "IndexPQ(", True),
+    ("ivfpq", "IndexIVFPQ(nlist=51, nprobe=8,", True),
+])
+def test_index_types_are_built_and_described(index_type, kind, described, deletes):
+    index_type(kind)
+    vectors = np.random.default_rng(0).standard_normal((N, DIM)).astype(np.float32)
+    rows = np.arange(100, 100 + N, dtype=np.int64)
+
+    index = build_index(vectors)
+    index.add_with_ids(vectors, rows)
+
+    assert describe_index(index).startswith(described)
+    assert describe_index(index).endswith(f"ntotal={N})")
+    _, labels = index.search(vectors[:5], 10)
+    assert set(labels[:, 0].tolist()) <= set(rows.tolist())
+    vdb = VectorDB(".", index, store=None)
+    assert vdb.supports_delete is deletes
+    if deletes:
+        assert index.remove_ids(rows[:10]) == 10 and index.ntotal == N - 10
+
+
+def test_small_corpus_falls_back_to_flat(index_type):
+    index_type("ivfpq", nlist=64)
+    assert index_factory_string(300) == "IVF64,PQ8x4"
+    assert index_factory_string(20) == "PQ8x4"
+    assert index_factory_string(10) == "Flat"
+    index_type("ivf", nlist=64)
+    assert index_factory_string(10) == "Flat"
+    assert index_factory_string(1000) == "IVF64,Flat"
+
+
+def test_unknown_index_type_is_rejected(index_type):
+    index_type("annoy")
+    with pytest.raises(ValueError, match="FAISS_INDEX_TYPE"):
+        index_factory_string(1000)
+
+
+def test_index_report_of_exact_index(tmp_path):
+    docs = synthetic_chunks(n_docs=4)
+    embeddings = HashEmbeddings()
+    vdb = VectorDB.from_documents(docs, embeddings, tmp_path, ids=[f"c{i}" for i in range(len(docs))])
+    try:
+        report = index_report(vdb, embeddings, k=5, n_queries=20)
+    finally:
+        vdb.close()
+    assert report["vectors"] == len(docs) and report["queries"] == 20
+    assert report["recall@5"] == 1.0
+    assert set(report["latency_ms"]["index"]) == {"p50", "p99"}
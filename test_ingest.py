@@ -0,0 +1,127 @@
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from conftest import write_docx
+from src import ingest
+from src.bench import HashEmbeddings
+from src.ingest import STEmbeddings, chunk_file, chunk_files, file_hash, load_manifest, update_vector_store
+
+TEXT = [f"Параграф {i}: таблицы, ключи и ограничения целостности в SQL." for i in range(40)]
+
+
+def test_identical_files_get_distinct_chunk_ids(store_paths):
+    a = write_docx(store_paths.data_dir / "a.docx", TEXT)
+    b = write_docx(store_paths.data_dir / "b.docx", TEXT)
+    assert file_hash(a) == file_hash(b)
+
+    ids_a, _ = chunk_file(a, file_hash(a))
+    ids_b, _ = chunk_file(b, file_hash(b))
+    assert ids_a and not set(ids_a) & set(ids_b)
+
+    vdb, stats = update_vector_store(embeddings=HashEmbeddings())
+    try:
+        assert stats.files_added == 2
+        assert vdb.index.ntotal == stats.chunks_added == len(ids_a) + len(ids_b)
+    finally:
+        vdb.close()
+
+
+def _paragraphs(topic: str):
+    return [f"{topic}, раздел {i}: определения, примеры и типичные ошибки." for i in range(30)]
+
+
+def test_incremental_update_touches_only_changed_files(store_paths):
+    embeddings = HashEmbeddings()
+    write_docx(store_paths.data_dir / "sql.docx", _paragraphs("SQL"))
+    write_docx(store_paths.data_dir / "ml.docx", _paragraphs("Машинное обучение"))
+    vdb, stats = update_vector_store(embeddings=embeddings)
+    vdb.close()
+    assert stats.full_rebuild and stats.files_added == 2
+    total = stats.chunks_added
+
+    vdb, stats = update_vector_store(embeddings=embeddings)
+    vdb.close()
+    assert not stats.full_rebuild and stats.files_unchanged == 2 and stats.chunks_added == 0
+
+    old_ids = set(load_manifest(store_paths.vector_dir)["files"]["sql.docx"]["chunk_ids"])
+    write_docx(store_paths.data_dir / "sql.docx", _paragraphs("SQL")[:10])
+    (store_paths.data_dir / "ml.docx").unlink()
+    write_docx(store_paths.data_dir / "nosql.docx", _paragraphs("NoSQL"))
+    vdb, stats = update_vector_store(embeddings=embeddings)
+    try:
+        assert not stats.full_rebuild
+        assert (stats.files_changed, stats.files_removed, stats.files_added) == (1, 1, 1)
+        assert stats.chunks_removed == total
+        assert vdb.index.ntotal == vdb.store.count() == stats.chunks_added
+        assert {Path(source).name for source in vdb.store.sources()} == {"sql.docx", "nosql.docx"}
+    finally:
+        vdb.close()
+    files = load_manifest(store_paths.vector_dir)["files"]
+    assert set(files) == {"sql.docx", "nosql.docx"}
+    assert not old_ids & set(files["sql.docx"]["chunk_ids"])
+
+    vdb, stats = update_vector_store(force_rebuild=True, embeddings=embeddings)
+    vdb.close()
+    assert stats.full_rebuild and stats.files_added == 2
+
+
+def test_full_rebuild_without_text_reports_no_documents(store_paths):
+    write_docx(store_paths.data_dir / "scan.docx", [])
+
+    with pytest.raises(RuntimeError, match="No documents found"):
+        update_vector_store(embeddings=HashEmbeddings())
+    assert load_manifest(store_paths.vector_dir) is None
+
+
+def _parse(store_paths, monkeypatch, workers: int):
+    monkeypatch.setattr(ingest, "chunk_cfg", replace(ingest.chunk_cfg, parse_workers=workers))
+    jobs = [(p, file_hash(p), p.name) for p in sorted(store_paths.data_dir.iterdir())]
+    return [(ids, [(c.page_content, c.metadata) for c in chunks]) for ids, chunks in chunk_files(jobs)]
+
+
+def test_parallel_parsing_keeps_order_and_ids(store_paths, monkeypatch):
+    for topic in ("Индексы", "Транзакции", "Нормализация"):
+        write_docx(store_paths.data_dir / f"{topic}.docx", _paragraphs(topic))
+
+    serial = _parse(store_paths, monkeypatch, 1)
+    assert len(serial) == 3 and all(ids for ids, _ in serial)
+    assert _parse(store_paths, monkeypatch, 3) == serial
+
+
+class BlockModel:
+    """Модель, чей результат зависит от состава пакета (как паддинг у трансформеров)."""
+
+    def __init__(self) -> None:
+        self.blocks = []
+        self.hash = HashEmbeddings(dim=16)
+
+    def encode(self, texts, batch_size=32, **_):
+        self.blocks.append(list(texts))
+        return self.hash.embed_queries(texts) + 1e-3 * max(len(t) for t in texts)
+
+    def start_multi_process_pool(self, target_devices):
+        return target_devices
+
+    def stop_multi_process_pool(self, pool):
+        pass
+
+    def encode_multi_process(self, texts, pool, batch_size=32, chunk_size=None, **_):
+        # sentence-transformers раздаёт процессам куски по chunk_size текстов
+        return np.vstack([self.encode(texts[i:i + chunk_size]) for i in range(0, len(texts), chunk_size)])
+
+
+def test_encode_is_identical_for_any_number_of_workers(monkeypatch):
+    texts = [f"Чанк {i} " + "слово " * (i % 7) for i in range(50)]
+    results = {}
+    for workers in (1, 3):
+        cfg = replace(ingest.embed_cfg, num_workers=workers, batch_size=4, block_batches=2)
+        monkeypatch.setattr(ingest, "embed_cfg", cfg)
+        model = BlockModel()
+        results[workers] = (STEmbeddings(model=model).encode(texts), model.blocks)
+
+    (single, single_blocks), (multi, multi_blocks) = results[1], results[3]
+    assert single_blocks == multi_blocks and len(single_blocks) == 7
+    np.testing.assert_array_equal(single, multi)
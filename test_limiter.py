@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+
+from src import llm as llm_module
+from src.limiter import ConcurrencyLimiter, Overloaded
+
+
+def test_full_queue_is_rejected_immediately():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_waiting=1, wait_timeout=5)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == 1
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        limiter.release()
+        await waiter
+        assert (limiter.active, limiter.waiting, limiter.rejected) == (1, 0, 1)
+
+    asyncio.run(scenario())
+
+
+def test_wait_timeout_is_rejected():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_waiting=5, wait_timeout=0.05)
+        async with limiter.slot():
+            with pytest.raises(Overloaded):
+                await limiter.acquire()
+        assert limiter.stats()["rejected"] == 1 and limiter.idle_for() > 0
+
+    asyncio.run(scenario())
+
+
+def test_overloaded_model_returns_503(monkeypatch):
+    from src import server
+
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_waiting=0, wait_timeout=0.05)
+    monkeypatch.setattr(llm_module, "get_llm_limiter", lambda: limiter)
+    model = FakeListChatModel(responses=["ответ"])
+
+    class BusyQA:
+        def __init__(self, k: int = 5) -> None:
+            pass
+
+        async def aask(self, question, history=None, conversation_id=None):
+            # единственный слот занят другим запросом
+            async with limiter.slot():
+                await llm_module.ainvoke(model, [HumanMessage(content=question)])
+
+        async def astream(self, question, history=None, conversation_id=None, context_stats=None):
+            async with limiter.slot():
+                async for token in llm_module.astream_text(model, [HumanMessage(content=question)]):
+                    yield token
+
+    monkeypatch.setattr(server, "RAGQA", BusyQA)
+    client = TestClient(server.app)
+    for path in ("/ask", "/ask/stream"):
+        response = client.post(path, json={"question": "Что такое индекс?"})
+        assert response.status_code == 503, path
+        assert response.headers["Retry-After"] == "5"
+    assert limiter.rejected == 2
+
+
+def test_timeouts_racing_releases_keep_full_capacity():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=2, max_waiting=100, wait_timeout=0.001)
+
+        async def worker():
+            for _ in range(100):
+                try:
+                    async with limiter.slot():
+                        await asyncio.sleep(0.001)
+                except Overloaded:
+                    pass
+
+        await asyncio.gather(*(worker() for _ in range(10)))
+        assert limiter.rejected > 0 and (limiter.active, limiter.waiting) == (0, 0)
+        # все слоты снова доступны сразу
+        for _ in range(limiter.max_concurrency):
+            await asyncio.wait_for(limiter.acquire(), timeout=1)
+
+    asyncio.run(scenario())
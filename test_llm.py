@@ -0,0 +1,85 @@
+import httpx
+import pytest
+from langchain_ollama import ChatOllama
+
+from src import llm as llm_module
+from src.llm import OllamaHealth, OllamaUnavailable, ensure_ollama_available, warm_up
+
+BASE_URL = "http://ollama.test"
+
+
+def _health(state: dict) -> OllamaHealth:
+    """OllamaHealth, чей /api/ps отвечает по state: up — сервер доступен, models — загруженные модели."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/api/ps"
+        state["calls"] = state.get("calls", 0) + 1
+        if not state["up"]:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"models": [{"name": m, "model": m} for m in state["models"]]})
+
+    health = OllamaHealth(BASE_URL, "qwen:7b", interval=60)
+    health._http = httpx.Client(base_url=BASE_URL, transport=httpx.MockTransport(handler))
+    return health
+
+
+def test_health_state_transitions():
+    state = {"up": True, "models": []}
+    health = _health(state)
+    assert health.available is None
+
+    assert health.is_available() and not health.model_loaded
+    assert health.is_available() and state["calls"] == 1  # состояние берётся из кэша
+
+    state["models"] = ["qwen:7b"]
+    assert health.check() and health.model_loaded
+
+    state["up"] = False
+    assert not health.check()
+    assert health.state()["available"] is False and not health.model_loaded
+    assert "connection refused" in health.error
+
+    state["up"] = True
+    assert health.check() and health.error == "" and health.model_loaded
+
+
+def test_unavailable_ollama_fails_fast(monkeypatch):
+    health = _health({"up": False, "models": []})
+    monkeypatch.setattr(llm_module, "_health", health)
+    with pytest.raises(OllamaUnavailable, match="недоступен"):
+        ensure_ollama_available()
+
+
+class RecordingClient:
+    def __init__(self) -> None:
+        self.requests = []
+
+    def chat(self, **params):
+        self.requests.append(params)
+        done = {"model": params["model"], "created_at": "2024-01-01T00:00:00Z", "done": True, "done_reason": "stop"}
+        message = {"role": "assistant", "content": "Готов"}
+        return iter([{**done, "message": message}]) if params["stream"] else {**done, "message": message}
+
+
+def test_warm_up_changes_only_num_predict(monkeypatch):
+    health = _health({"up": True, "models": ["qwen:7b"]})
+    monkeypatch.setattr(llm_module, "_health", health)
+    chat = ChatOllama(
+        model="qwen:7b", base_url=BASE_URL, temperature=0.2, num_ctx=4096,
+        top_p=0.9, repeat_penalty=1.1, stop=["</s>"], keep_alive=300,
+    )
+    chat._client = client = RecordingClient()
+    monkeypatch.setattr(llm_module, "get_chat_llm", lambda: chat)
+
+    elapsed = warm_up("Системный промпт")
+
+    (request,) = client.requests
+    options = request["options"]
+    assert options["num_predict"] == 1
+    assert (options["num_ctx"], options["temperature"], options["top_p"], options["repeat_penalty"]) == (4096, 0.2, 0.9, 1.1)
+    assert options["stop"] == ["</s>"] and request["keep_alive"] == 300
+    system = request["messages"][0]
+    assert (system["role"], system["content"]) == ("system", "Системный промпт")
+    # общий клиент не изменился
+    assert chat.num_predict is None
+    assert health.warmup_ms == elapsed and health.model_loaded
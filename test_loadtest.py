@@ -0,0 +1,69 @@
+import json
+
+import httpx
+import pytest
+
+from src.loadtest import LoadGenerator, MockOllama, MockSettings, Result, parse_mix, summarize
+
+
+def test_parse_mix():
+    assert parse_mix("ask=0.6, quiz=0.2,history") == {"ask": 0.6, "quiz": 0.2, "history": 1.0}
+    with pytest.raises(ValueError, match="Unknown request kind"):
+        parse_mix("ask=1,chat=1")
+    with pytest.raises(ValueError, match="positive weight"):
+        parse_mix("ask=0")
+
+
+def test_schedule_is_reproducible_and_follows_mix():
+    def plan(seed: int) -> list:
+        return LoadGenerator("http://test", rps=50, duration=20, mix={"ask": 3, "history": 1}, seed=seed).schedule()
+
+    first = plan(1)
+    assert first == plan(1) and first != plan(2)
+    offsets = [t for t, _ in first]
+    assert offsets == sorted(offsets) and 0 < offsets[0] and offsets[-1] < 20
+    assert 800 < len(first) < 1200  # в среднем rps * duration
+    asks = sum(kind == "ask" for _, kind in first) / len(first)
+    assert 0.7 < asks < 0.8
+
+
+def test_summarize_by_kind():
+    results = [
+        Result("ask", True, 1.0, ttft=0.2),
+        Result("ask", True, 3.0, ttft=0.4),
+        Result("ask", False, 5.0, error="HTTP 503"),
+        Result("history", True, 0.1),
+    ]
+    report = summarize(results, elapsed=2.0)
+
+    overall = report["overall"]
+    assert (overall["requests"], overall["errors"], overall["rps"]) == (4, 1, 2.0)
+    assert overall["error_kinds"] == {"HTTP 503": 1}
+    assert set(report["by_kind"]) == {"ask", "history"}
+    ask = report["by_kind"]["ask"]
+    assert ask["latency_ms"]["p50"] == pytest.approx(2000.0)
+    assert ask["ttft_ms"]["p50"] == pytest.approx(300.0)
+    assert "ttft_ms" not in report["by_kind"]["history"]
+
+
+@pytest.fixture
+def mock_ollama():
+    mock = MockOllama(MockSettings(latency=0.01, token_rate=1000, tokens=8, parallel=1, model="mock:1b")).start()
+    yield mock
+    mock.stop()
+
+
+def test_mock_ollama_streams_chat_with_usage(mock_ollama):
+    with httpx.Client(base_url=mock_ollama.url, timeout=10) as client:
+        assert client.get("/api/ps").json()["models"][0]["name"] == "mock:1b"
+        payload = {"model": "mock:1b", "messages": [{"role": "user", "content": "Привет"}], "options": {"num_predict": 5}}
+        with client.stream("POST", "/api/chat", json=payload) as response:
+            chunks = [json.loads(line) for line in response.iter_lines() if line]
+        full = client.post("/api/generate", json={"prompt": "Привет", "stream": False}).json()
+
+    *tokens, last = chunks
+    assert len(tokens) == 5 and all(c["message"]["content"] for c in tokens)
+    assert last["done"] and last["eval_count"] == 5 and last["prompt_eval_count"] >= 1
+    assert full["done"] and len(full["response"].split()) == 8
+    stats = mock_ollama.stats()
+    assert (stats["requests"], stats["completion_tokens"], stats["max_active"]) == (2, 13, 1)
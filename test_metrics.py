@@ -0,0 +1,62 @@
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+
+from src import metrics
+
+
+def test_counter_and_histogram_text_format(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+    calls = metrics.Counter("t_calls_total", "Calls.", ("endpoint",))
+    latency = metrics.Histogram("t_seconds", "Latency.", ("endpoint",), buckets=(1.0, 0.1))
+    calls.inc("/ask")
+    calls.inc("/ask", amount=2)
+    calls.inc('say "hi"\n')
+    for value in (0.05, 0.1, 0.5, 5.0):
+        latency.observe(value, "/ask")
+
+    assert metrics.render() == "\n".join([
+        "# HELP t_calls_total Calls.",
+        "# TYPE t_calls_total counter",
+        't_calls_total{endpoint="/ask"} 3',
+        't_calls_total{endpoint="say \\"hi\\"\\n"} 1',
+        "# HELP t_seconds Latency.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{endpoint="/ask",le="0.1"} 2',
+        't_seconds_bucket{endpoint="/ask",le="1.0"} 3',
+        't_seconds_bucket{endpoint="/ask",le="+Inf"} 4',
+        't_seconds_sum{endpoint="/ask"} 5.65',
+        't_seconds_count{endpoint="/ask"} 4',
+    ]) + "\n"
+
+
+def test_ollama_usage_is_recorded(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+    monkeypatch.setattr(metrics, "LLM_TOKENS", metrics.Counter("t_tokens_total", "Tokens.", ("endpoint", "stage", "type")))
+    monkeypatch.setattr(metrics, "LLM_EVAL_SECONDS", metrics.Counter("t_eval_total", "Eval.", ("endpoint", "stage", "phase")))
+    message = AIMessage(content="ответ", response_metadata={
+        "prompt_eval_count": 120, "eval_count": 30, "prompt_eval_duration": 1_500_000_000, "eval_duration": 3_000_000_000,
+    })
+
+    metrics.record_llm_usage(message, "summary")
+    metrics.record_llm_usage(AIMessage(content="без метаданных"))
+
+    text = metrics.render()
+    assert 't_tokens_total{endpoint="background",stage="summary",type="prompt"} 120' in text
+    assert 't_tokens_total{endpoint="background",stage="summary",type="completion"} 30' in text
+    assert 't_eval_total{endpoint="background",stage="summary",phase="prompt"} 1.5' in text
+    assert 't_eval_total{endpoint="background",stage="summary",phase="completion"} 3' in text
+    assert 'stage="llm"' not in text
+
+
+def test_metrics_endpoint_uses_route_templates():
+    from src.server import app
+
+    client = TestClient(app)
+    assert client.get("/conversations/987654321").status_code == 404
+    response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'rag_http_requests_total{endpoint="/conversations/{conversation_id}",method="GET",status="404"}' in text
+    assert "/conversations/987654321" not in text
+    assert 'rag_db_operation_duration_seconds_count{endpoint="/conversations/{conversation_id}",operation="get_conversation"}' in text
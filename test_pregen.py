@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import write_store
+from src import pregen, server
+from src.config import pregen_cfg
+from src.gate import REFUSAL_TEXT
+from src.pregen import Pregenerator
+
+VARIANTS, NUM = pregen_cfg.variants, pregen_cfg.quiz_num
+
+
+@pytest.fixture
+def pregenerator(rag_engine, monkeypatch):
+    counter = itertools.count()
+    monkeypatch.setattr(pregen, "generate_quiz", lambda topic, num, engine=None: {"questions": f"Квиз {next(counter)}: {topic}"})
+    monkeypatch.setattr(pregen, "generate_task", lambda topic, engine=None: {"task": f"Задание {next(counter)}: {topic}"})
+    return Pregenerator(engine=rag_engine, topics=["Нормальные формы", "Индексы"])
+
+
+def test_each_variant_is_served_once(pregenerator):
+    assert pregenerator.fill() == 2 * 2 * VARIANTS
+    assert pregenerator.pending() == []
+
+    quizzes = [pregenerator.take("quiz", "  нормальные   ФОРМЫ ", NUM) for _ in range(VARIANTS)]
+    assert len(set(quizzes)) == VARIANTS and all(q.endswith(": Нормальные формы") for q in quizzes)
+    assert pregenerator.take("quiz", "Нормальные формы", NUM) is None
+    assert pregenerator.take("quiz", "Индексы", NUM + 1) is None  # другое число вопросов
+    # близкая по смыслу тема с другим ключом
+    assert pregenerator.take("task", "Нормальные формы!", 0).startswith("Задание")
+    assert pregenerator.take("task", "Транзакции", 0) is None
+    assert pregenerator.served == VARIANTS + 1
+    # выданное восполняется, начиная с темы, где вариантов не осталось
+    assert pregenerator.pending() == [("quiz", "Нормальные формы"), ("task", "Нормальные формы")]
+
+
+def test_index_change_drops_old_variants(pregenerator, tmp_path):
+    pregenerator.fill()
+    write_store(tmp_path, ["Индексы и B-деревья", "Нормальные формы отношений", "Журнал WAL"])
+
+    assert pregenerator.take("task", "Индексы", 0) is None
+    assert len(pregenerator.pending()) == 4
+
+
+def test_refused_topics_are_not_stored_or_retried(pregenerator, monkeypatch):
+    monkeypatch.setattr(pregen, "generate_task", lambda topic, engine=None: {"task": REFUSAL_TEXT})
+
+    assert pregenerator.fill() == 2 * VARIANTS
+    assert pregenerator.pending() == []
+    assert pregenerator.take("task", "Индексы", 0) is None
+
+
+def test_quiz_endpoint_serves_pregenerated_variant(pregenerator, monkeypatch):
+    pregenerator.fill()
+
+    async def generated(topic, num, history=None, conversation_id=None):
+        return {"topic": topic, "questions": "Свежий квиз"}
+
+    monkeypatch.setattr(server, "get_pregenerator", lambda: pregenerator)
+    monkeypatch.setattr(server, "agenerate_quiz", generated)
+    client = TestClient(server.app)
+
+    body = client.post("/quiz", json={"topic": "Индексы", "num": NUM}).json()
+    assert body["pregenerated"] is True and body["questions"].endswith(": Индексы")
+    body = client.post("/quiz", json={"topic": "Индексы", "num": NUM, "pregenerated": False}).json()
+    assert body["questions"] == "Свежий квиз" and not body["pregenerated"]
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select, text, update
+from sqlalchemy.orm import sessionmaker
+
+from src import crud, retention
+from src.database import SEARCH_TABLE, ArchivedConversation, Conversation, Message
+
+
+def _old_conversation(db, user_id: str, days: int = 400) -> int:
+    conv = crud.create_conversation(db, user_id, "Старый диалог", "question")
+    crud.add_message(db, conv.id, "user", "Что такое нормальная форма?")
+    db.execute(update(Conversation).where(Conversation.id == conv.id)
+               .values(updated_at=datetime.utcnow() - timedelta(days=days)))
+    db.commit()
+    return conv.id
+
+
+def _messages(db_engine, conversation_id: int) -> int:
+    with db_engine.connect() as conn:
+        return conn.execute(
+            select(func.count(Message.id)).where(Message.conversation_id == conversation_id)
+        ).scalar()
+
+
+def test_append_during_batch_is_not_lost(db, db_engine, monkeypatch):
+    conversation_id = _old_conversation(db, "u1")
+    Session = sessionmaker(bind=db_engine)
+    appended = {}
+
+    def append() -> None:
+        session = Session()
+        try:
+            appended["turn"] = crud.append_turn(session, "Новый вопрос", "Новый ответ", conversation_id=conversation_id)
+        finally:
+            session.close()
+
+    original = retention._archive_rows
+    writer = threading.Thread(target=append)
+
+    def archive_rows(conn, ids, now):
+        # пакет уже выбран — в этот момент пользователь дописывает ход
+        writer.start()
+        time.sleep(0.3)
+        return original(conn, ids, now)
+
+    monkeypatch.setattr(retention, "_archive_rows", archive_rows)
+    stats = retention.apply_retention(days=30, mode="archive", vacuum=False, db_engine=db_engine)
+    writer.join(10)
+
+    if appended["turn"] is None:
+        # ход отклонён (диалог уже вынесен) — в архиве всё, что было сохранено
+        assert stats.conversations == 1
+        assert retention.read_archived(db, conversation_id)["messages"][0]["content"] == "Что такое нормальная форма?"
+        assert _messages(db_engine, conversation_id) == 0
+    else:
+        # ход сохранён — диалог остался рабочим со всеми сообщениями
+        assert stats.conversations == 0
+        assert _messages(db_engine, conversation_id) == 3
+
+
+def test_batch_skips_conversations_updated_after_selection(db, db_engine):
+    fresh = _old_conversation(db, "u2")
+    stale = _old_conversation(db, "u2")
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    # id выбраны, затем в первый диалог дописали ход
+    crud.append_turn(db, "Вопрос", "Ответ", conversation_id=fresh)
+
+    with db_engine.begin() as conn:
+        done = retention._process_batch(conn, [fresh, stale], "archive", cutoff)
+
+    assert done[:2] == (1, 1)
+    assert _messages(db_engine, fresh) == 3 and _messages(db_engine, stale) == 0
+    archived = db.execute(select(ArchivedConversation.conversation_id)).scalars().all()
+    assert archived == [stale]
+
+
+def _search_rows(db_engine) -> int:
+    with db_engine.connect() as conn:
+        return conn.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+
+
+def test_archive_mode_moves_stale_conversations_in_batches(db, db_engine):
+    stale = [_old_conversation(db, "u3") for _ in range(5)]
+    fresh = crud.create_conversation(db, "u3", "Свежий", "question").id
+
+    stats = retention.apply_retention(days=30, mode="archive", batch_size=2, vacuum=False, db_engine=db_engine)
+
+    assert (stats.conversations, stats.messages) == (5, 5) and stats.archived_bytes > 0
+    assert crud.get_conversation(db, fresh) is not None
+    assert all(crud.get_conversation(db, cid) is None for cid in stale)
+    archived = retention.read_archived(db, stale[0])
+    assert archived["conversation"]["id"] == stale[0]
+    assert [m["content"] for m in archived["messages"]] == ["Что такое нормальная форма?"]
+    # строки полнотекстового поиска удалены триггерами: остался заголовок свежего диалога
+    assert _search_rows(db_engine) == 1
+
+
+def test_delete_mode_and_dry_run(db, db_engine):
+    stale = _old_conversation(db, "u4")
+
+    dry = retention.apply_retention(days=30, mode="delete", dry_run=True, db_engine=db_engine)
+    assert (dry.conversations, dry.messages) == (1, 1)
+    assert crud.get_conversation(db, stale) is not None
+
+    stats = retention.apply_retention(days=30, mode="delete", vacuum=False, db_engine=db_engine)
+    assert (stats.conversations, stats.messages, stats.archived_bytes) == (1, 1, 0)
+    assert retention.read_archived(db, stale) is None
+    assert _messages(db_engine, stale) == 0
+
+
+def test_invalid_settings_are_rejected(db_engine):
+    with pytest.raises(ValueError):
+        retention.apply_retention(days=0, db_engine=db_engine)
+    with pytest.raises(ValueError):
+        retention.apply_retention(days=30, mode="shred", db_engine=db_engine)
+
+
+def test_archived_conversation_is_still_exportable():
+    from src.database import SessionLocal, engine
+    from src.server import app
+
+    db = SessionLocal()
+    try:
+        conversation_id = _old_conversation(db, "archive_api_user", days=4000)
+    finally:
+        db.close()
+    retention.apply_retention(days=3650, mode="archive", vacuum=False, db_engine=engine)
+
+    client = TestClient(app)
+    assert client.get(f"/conversations/{conversation_id}").status_code == 404
+    exported = client.get(f"/conversations/{conversation_id}/export").json()
+    assert exported["conversation"]["id"] == conversation_id
+    assert exported["messages"][0]["content"] == "Что такое нормальная форма?"
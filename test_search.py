@@ -0,0 +1,64 @@
+from sqlalchemy import text, update
+
+from src import crud
+from src.database import SEARCH_TABLE, Message, rebuild_search_index
+
+
+def _ids(results):
+    return [r["id"] for r in results]
+
+
+def _fts_rows(db) -> int:
+    return db.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+
+
+def test_triggers_follow_inserts_updates_and_deletes(db):
+    conv = crud.create_conversation(db, "u1", "Индексы в PostgreSQL", "question")
+    msg = crud.add_message(db, conv.id, "user", "Как работает нормализация таблиц?")
+
+    hit = crud.search_conversations(db, "u1", "нормализация")
+    assert _ids(hit) == [conv.id] and hit[0]["message_id"] == msg.id
+    assert "<mark>" in hit[0]["snippet"]
+    # совпадение в заголовке — без id сообщения
+    assert crud.search_conversations(db, "u1", "индексы")[0]["message_id"] is None
+
+    db.execute(update(Message).where(Message.id == msg.id).values(content="Что такое транзакция?"))
+    db.commit()
+    assert crud.search_conversations(db, "u1", "нормализация") == []
+    assert _ids(crud.search_conversations(db, "u1", "транзакция")) == [conv.id]
+
+    crud.update_conversation_title(db, conv.id, "Блокировки")
+    assert crud.search_conversations(db, "u1", "индексы") == []
+    assert _ids(crud.search_conversations(db, "u1", "блокировки")) == [conv.id]
+
+    crud.delete_conversation(db, conv.id)
+    assert crud.search_conversations(db, "u1", "транзакция") == []
+    assert _fts_rows(db) == 0
+
+
+def test_search_is_scoped_to_user_and_ranked(db):
+    weak = crud.create_conversation(db, "u1", "Разное", "question")
+    crud.add_message(db, weak.id, "user", "Вопрос про индексы и ещё много других слов о курсе и экзамене")
+    strong = crud.create_conversation(db, "u1", "Индексы", "question")
+    crud.add_message(db, strong.id, "user", "Индексы, индексы: B-дерево")
+    other = crud.create_conversation(db, "u2", "Индексы", "question")
+    crud.add_message(db, other.id, "user", "Индексы")
+
+    results = crud.search_conversations(db, "u1", "индексы")
+    assert _ids(results) == [strong.id, weak.id]
+    assert results[0]["rank"] > results[1]["rank"]
+    # все слова запроса обязательны, формы слова находятся по префиксу
+    assert _ids(crud.search_conversations(db, "u1", "индексов дерево")) == [strong.id]
+    assert crud.search_conversations(db, "u1", "  ") == []
+
+
+def test_rebuild_search_index(db, db_engine):
+    conv = crud.create_conversation(db, "u1", "Нормальные формы", "question")
+    crud.add_message(db, conv.id, "user", "Третья нормальная форма")
+    crud.add_message(db, conv.id, "assistant", "Нет транзитивных зависимостей")
+    db.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    db.commit()
+    assert crud.search_conversations(db, "u1", "транзитивных") == []
+
+    assert rebuild_search_index(db_engine) == 3
+    assert _ids(crud.search_conversations(db, "u1", "транзитивных")) == [conv.id]
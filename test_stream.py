@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src import rag, server
+from src.gate import REFUSAL_TEXT, RelevanceGate
+from src.rag import RAGQA
+
+ANSWER = "Индекс ускоряет поиск строк."
+
+
+class NoModel(FakeListChatModel):
+    def _call(self, *args, **kwargs):
+        raise AssertionError("модель не должна вызываться")
+
+
+def _events(body: str):
+    """Разбирает поток SSE на пары (событие, данные)."""
+    events = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        event_line, data_line = block.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        events.append((event_line[7:], json.loads(data_line[6:])))
+    return events
+
+
+@pytest.fixture
+def ask_stream(rag_engine, monkeypatch):
+    def post(model, max_distance=None):
+        monkeypatch.setattr(rag, "get_gate", lambda: RelevanceGate(max_distance))
+        monkeypatch.setattr(server, "RAGQA", lambda k=5: RAGQA(llm=model, k=k, engine=rag_engine))
+        response = TestClient(server.app).post("/ask/stream", json={"question": "Что такое нормальные формы?"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        return _events(response.text)
+
+    return post
+
+
+def test_ask_stream_sends_tokens_then_done(ask_stream):
+    events = ask_stream(FakeListChatModel(responses=[ANSWER]))
+
+    *tokens, (last, done) = events
+    assert {name for name, _ in tokens} == {"token"} and len(tokens) > 1
+    assert "".join(data["token"] for _, data in tokens) == ANSWER
+    assert last == "done" and done["answer"] == ANSWER
+    assert done["ttft_ms"] <= done["total_ms"]
+    assert done["context"]["selected"] >= 1
+
+
+def test_refused_question_streams_refusal_without_calling_model(ask_stream):
+    events = ask_stream(NoModel(responses=[""]), max_distance=-1.0)
+
+    assert len(events) == 2 and events[0] == ("token", {"token": REFUSAL_TEXT})
+    name, done = events[1]
+    assert name == "done" and done["answer"] == REFUSAL_TEXT and "context" not in done
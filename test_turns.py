@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import DatabaseError
+
+from src import crud
+from src.database import Conversation, Message
+
+
+def _count(db, column) -> int:
+    return db.execute(select(func.count(column))).scalar()
+
+
+def test_turn_creates_conversation_and_both_messages(db):
+    conversation_id, user_msg, assistant_msg = crud.append_turn(
+        db, "Что такое внешний ключ?", "Ссылка на ключ другой таблицы.",
+        user_id="u1", title="Что такое внешний ключ?", conversation_type="question",
+    )
+    messages = crud.get_conversation_messages(db, conversation_id)
+    assert [(m.id, m.role) for m in messages] == [(user_msg.id, "user"), (assistant_msg.id, "assistant")]
+    conv = crud.get_conversation(db, conversation_id)
+    assert conv.user_id == "u1" and conv.updated_at == assistant_msg.timestamp
+
+
+def test_turn_to_existing_conversation_bumps_updated_at(db):
+    conv = crud.create_conversation(db, "u1", "Диалог", "question")
+    before = conv.updated_at
+    conversation_id, _, assistant_msg = crud.append_turn(db, "Вопрос", "Ответ", conversation_id=conv.id)
+    db.refresh(conv)
+    assert conversation_id == conv.id and conv.updated_at == assistant_msg.timestamp > before
+    assert crud.append_turn(db, "Вопрос", "Ответ", conversation_id=10**9) is None
+    assert _count(db, Message.id) == 2
+
+
+@pytest.mark.parametrize("existing", [False, True])
+def test_failed_turn_writes_nothing(db, existing):
+    conv = crud.create_conversation(db, "u1", "Диалог", "question") if existing else None
+    updated_at = conv.updated_at if conv else None
+    db.execute(text(
+        "CREATE TRIGGER fail_answer BEFORE INSERT ON messages WHEN new.role = 'assistant' "
+        "BEGIN SELECT RAISE(ABORT, 'answer rejected'); END"
+    ))
+    db.commit()
+
+    with pytest.raises(DatabaseError):
+        crud.append_turn(
+            db, "Вопрос", "Ответ", conversation_id=conv.id if conv else None,
+            user_id="u1", title="Вопрос", conversation_type="question",
+        )
+    db.rollback()
+
+    # ни сообщения пользователя, ни нового диалога, ни сдвига updated_at
+    assert _count(db, Message.id) == 0
+    assert _count(db, Conversation.id) == (1 if existing else 0)
+    if conv:
+        db.refresh(conv)
+        assert conv.updated_at == updated_at
@@ -0,0 +1,51 @@
+import pickle
+
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from src.vectordb import CHUNKS_NAME, INDEX_NAME, LEGACY_DOCSTORE, VectorDB, migrate_legacy_store
+
+
+def _legacy_store(path, n: int = 12, dim: int = 8) -> np.ndarray:
+    """Индекс в формате langchain FAISS.save_local: index.faiss + pickle (docstore, index_to_id)."""
+    vectors = np.random.default_rng(0).standard_normal((n, dim)).astype(np.float32)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    faiss.write_index(index, str(path / INDEX_NAME))
+    ids = [f"legacy-{i}" for i in range(n)]
+    docstore = InMemoryDocstore({
+        chunk_id: Document(page_content=f"Чанк {i}", metadata={"source": "lecture.pdf", "page": i})
+        for i, chunk_id in enumerate(ids)
+    })
+    with open(path / LEGACY_DOCSTORE, "wb") as f:
+        pickle.dump((docstore, dict(enumerate(ids))), f)
+    return vectors
+
+
+def test_legacy_store_is_not_unpickled_on_load(tmp_path, monkeypatch):
+    _legacy_store(tmp_path)
+    monkeypatch.setattr(pickle, "load", lambda *_: pytest.fail("load() must not unpickle index.pkl"))
+
+    with pytest.raises(FileNotFoundError, match="migrate-index"):
+        VectorDB.load(tmp_path)
+    assert (tmp_path / LEGACY_DOCSTORE).exists()
+    assert not (tmp_path / CHUNKS_NAME).exists()
+
+
+def test_migrate_index_converts_legacy_store(tmp_path):
+    vectors = _legacy_store(tmp_path)
+
+    assert migrate_legacy_store(tmp_path) == len(vectors)
+    assert not (tmp_path / LEGACY_DOCSTORE).exists()
+    vdb = VectorDB.load(tmp_path)
+    try:
+        assert vdb.index.ntotal == vdb.store.count() == len(vectors)
+        (row, dist), *_ = vdb.search_by_vector(vectors[3], k=1)
+        assert dist == pytest.approx(0.0, abs=1e-5)
+        doc = vdb.get_documents([row])[0]
+        assert doc.page_content == "Чанк 3" and doc.metadata["page"] == 3
+    finally:
+        vdb.close()